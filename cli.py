@@ -5,55 +5,98 @@ Usage:
    cli [options] <apiid> <token> census list
    cli [options] <apiid> <token> census yl list
    cli [options] <apiid> <token> census leavers
+   cli [options] <apiid> <token> census dates <date>...
    cli [options] <apiid> <token> <section> movers list
    cli [options] <apiid> <token> <section> contacts list
    cli [options] <apiid> <token> <section> contacts details   
    cli [options] <apiid> <token> <section> events list
    cli [options] <apiid> <token> <section> events <event> attendees
    cli [options] <apiid> <token> <section> events <event> info
+   cli [options] <apiid> <token> <section> events export [<termname>...]
    cli [options] <apiid> <token> <section> users list
    cli [options] <apiid> <token> <section> members badges
    cli [options] <apiid> <token> member badges <firstname> <lastname>
    cli [options] <apiid> <token> <section> payments <start> <end>
    cli [options] <apiid> <token> group payments <outfile>
+   cli [options] <apiid> <token> query <query>
+   cli [options] <apiid> <token> quality
+   cli [options] <apiid> <token> batch [<script>]
+   cli [options] <apiid> <token> mirror
 
 
 Options:
    -a, --attending       Only list those that are attending.
-   -c, --csv             Output in CSV format.
+   -c, --csv             Output in CSV format (same as --format=csv).
+   --format=fmt          Output format: table, csv, jsonl or parquet [default: table].
+   -j, --json            Output in JSON format.
+   -f fields, --fields=fields  Comma separated list of fields to output.
    --no_headers          Exclude headers from tables.
    -t term, --term=term  Term to use
    -m age, --minage=age  Filter by age (decimal float).
+   --history=db          Load past terms from a history store (see history.py).
+   --outdir=dir          Directory for the output files of a batch [default: .].
+   --mirror=db           SQLite mirror written by 'mirror' [default: osm-mirror.sqlite].
+   --offline             Read from the mirror instead of OSM (contacts details,
+                         member badges and events info only).
+
+A batch script lists one command per line, without <apiid> and <token>,
+each optionally followed by '> filename', e.g.
+
+   census list --csv > census.csv
+   census yl list --csv > yl.csv
+   Maclean movers list
+
+If no script is given the commands are read from stdin.
 
 """
 
+import os
+import re
+import json
+import shlex
+import functools
 import logging
 
 import datetime
 import collections
+from contextlib import closing, redirect_stdout, ExitStack
+from concurrent.futures import ThreadPoolExecutor
 
 from io import StringIO
 
 log = logging.getLogger(__name__)
 
 from dateutil import relativedelta
-from docopt import docopt
+from docopt import docopt, DocoptExit
 import osm
-import tabulate
-from csv import writer as csv_writer
 import sys
+import numpy as np
 import pandas as pd
 
 from group import Group
+from history import HistoryStore
+from mirror import Mirror
+from output import write_rows, write_frame, FORMATS
+import quality
 from update import MAPPING
 
 DEF_CACHE = "osm.cache"
 DEF_CREDS = "osm.creds"
 
+# Groups already loaded, by term, so that the commands of a batch share
+# one load of each term.
+_groups = {}
+
+
+def group_for_term(osm, auth, term=None):
+    if term not in _groups:
+        _groups[term] = Group(osm, auth, MAPPING.keys(), term)
+    return _groups[term]
+
 
-def census_list(osm, auth, term=None, csv=False, attending_only=False,
+def census_list(osm, auth, term=None, fmt='table', attending_only=False,
                 no_headers=False):
-    group = Group(osm, auth, MAPPING.keys(), term)
+    group = group_for_term(osm, auth, term)
 
     section_map = {'Garrick': 'Beavers',
                    'Paget': 'Beavers',
@@ -65,72 +108,62 @@ def census_list(osm, auth, term=None, csv=False, attending_only=False,
                    'Boswell': 'Scouts',
                    'Johnson': 'Scouts'}
 
-    rows = []
-
-    def add_row(section, member):
-        rows.append([section_map[section], section, member['first_name'], member['last_name'],
-                     member['date_of_birth'],
-                     member['contact_primary_member.address1'],
-                     member['contact_primary_1.address1'],
-                     member['contact_primary_1.address2'],
-                     member['contact_primary_1.address3'],
-                     member['contact_primary_1.postcode'],
-                     member['contact_primary_2.address1'],
-                     member['floating.gender'].lower()])
+    def row(section, member):
+        return [section_map[section], section, member['first_name'], member['last_name'],
+                member['date_of_birth'],
+                member['contact_primary_member.address1'],
+                member['contact_primary_1.address1'],
+                member['contact_primary_1.address2'],
+                member['contact_primary_1.address3'],
+                member['contact_primary_1.postcode'],
+                member['contact_primary_2.address1'],
+                     member['floating.gender'].lower()]
 
     all_members_dict = group.all_yp_members_without_senior_duplicates_dict()
 
-    for section in ('Swinfen', 'Paget', 'Garrick'):
-        members = all_members_dict[section]
-        for member in members:
-            age = member.age().days / 365
-            if (age > 5 and age < 9):
-                add_row(section, member)
-            else:
-                log.info("Excluding: {} {} because not of Beaver age ({}).".format(
-                    member['first_name'], member['last_name'], age
-                ))
-
-    for section in ('Maclean', 'Rowallan', 'Somers'):
-        members = all_members_dict[section]
-        for member in members:
-            age = member.age().days / 365
-            if (age > 7 and age < 11):
-                add_row(section, member)
-            else:
-                log.info("Excluding: {} {} because not of Cub age ({}).".format(
-                    member['first_name'], member['last_name'], age
-                ))
-
-    for section in ('Johnson', 'Boswell', 'Erasmus'):
-        members = all_members_dict[section]
-        for member in members:
-            age = member.age().days / 365
-            if (age > 10 and age < 16):
-                add_row(section, member)
-            else:
-                log.info("Excluding: {} {} because not of Scout age ({}).".format(
-                    member['first_name'], member['last_name'], age
-                ))
+    def rows():
+        for section in ('Swinfen', 'Paget', 'Garrick'):
+            members = all_members_dict[section]
+            for member in members:
+                age = member.age().days / 365
+                if (age > 5 and age < 9):
+                    yield row(section, member)
+                else:
+                    log.info("Excluding: {} {} because not of Beaver age ({}).".format(
+                        member['first_name'], member['last_name'], age
+                    ))
+
+        for section in ('Maclean', 'Rowallan', 'Somers'):
+            members = all_members_dict[section]
+            for member in members:
+                age = member.age().days / 365
+                if (age > 7 and age < 11):
+                    yield row(section, member)
+                else:
+                    log.info("Excluding: {} {} because not of Cub age ({}).".format(
+                        member['first_name'], member['last_name'], age
+                    ))
+
+        for section in ('Johnson', 'Boswell', 'Erasmus'):
+            members = all_members_dict[section]
+            for member in members:
+                age = member.age().days / 365
+                if (age > 10 and age < 16):
+                    yield row(section, member)
+                else:
+                    log.info("Excluding: {} {} because not of Scout age ({}).".format(
+                        member['first_name'], member['last_name'], age
+                    ))
 
     headers = ["Section", "Section Name", "First", "Last", "DOB", "Address1", "Address1.1", "Address1.2", "Address1.3",
                "Address2", "Address3", "Gender"]
 
-    if csv:
-        w = csv_writer(sys.stdout)
-        if not no_headers:
-            w.writerow(list(headers))
-        w.writerows(rows)
-    else:
-        if not no_headers:
-            print(tabulate.tabulate(rows, headers=headers))
-        else:
-            print(tabulate.tabulate(rows, tablefmt="plain"))
+    write_rows(headers, rows(), fmt, no_headers)
 
 
-def census_yl_list(osm, auth, term=None, csv=False,
+def census_yl_list(osm, auth, term=None, fmt='table',
                    no_headers=False):
-    group = Group(osm, auth, MAPPING.keys(), term)
+    group = group_for_term(osm, auth, term)
 
     section_map = {'Garrick': 'Beavers',
                    'Paget': 'Beavers',
@@ -142,39 +175,35 @@ def census_yl_list(osm, auth, term=None, csv=False,
                    'Boswell': 'Scouts',
                    'Johnson': 'Scouts'}
 
-    rows = []
+    def rows():
+        for section in Group.YP_SECTIONS:
+            for member in group.section_yl_members(section):
+                yield [section_map[section], section, member['first_name'], member['last_name'],
+                       member['date_of_birth'],
+                       member['contact_primary_member.address1'],
+                       member['contact_primary_1.address1'],
+                       member['contact_primary_2.address1'],
+                       member['floating.gender'].lower()]
 
-    def add_row(section, member):
-        rows.append([section_map[section], section, member['first_name'], member['last_name'],
-                     member['date_of_birth'],
-                     member['contact_primary_member.address1'],
-                     member['contact_primary_1.address1'],
-                     member['contact_primary_2.address1'],
-                     member['floating.gender'].lower()])
+    headers = ["Section", "Section Name", "First", "Last", "DOB", "Address1", "Address2", "Address3", "Gender"]
 
-    for section in Group.YP_SECTIONS:
-        yls = group.section_yl_members(section)
-        for member in yls:
-            add_row(section, member)
+    write_rows(headers, rows(), fmt, no_headers)
 
-    headers = ["Section", "Section Name", "First", "Last", "DOB", "Address1", "Address2", "Address3", "Gender"]
 
-    if csv:
-        w = csv_writer(sys.stdout)
-        if not no_headers:
-            w.writerow(list(headers))
-        w.writerows(rows)
-    else:
-        if not no_headers:
-            print(tabulate.tabulate(rows, headers=headers))
-        else:
-            print(tabulate.tabulate(rows, tablefmt="plain"))
+def census_leavers(osm, auth, term=None, fmt='table',
+                   no_headers=False, history=None):
+    if history:
+        store = HistoryStore(history)
+        somers_terms = store.get_terms('20706')
 
+        def load_group(name):
+            return store.group(name, Group, MAPPING.keys())
+    else:
+        # Nasty hack - but I need a list of terms.
+        somers_terms = group_for_term(osm, auth)._sections.sections['20706'].get_terms()
 
-def census_leavers(osm, auth, term=None, csv=False,
-                   no_headers=False):
-    # Nasty hack - but I need a list of terms.
-    somers_terms = Group(osm, auth, MAPPING.keys(), None)._sections.sections['20706'].get_terms()
+        def load_group(name):
+            return group_for_term(osm, auth, name)
 
     def find_term(name):
         return [_ for _ in somers_terms if _['name'] == name][0]
@@ -205,53 +234,56 @@ def census_leavers(osm, auth, term=None, csv=False,
                    'Boswell': 'Scouts',
                    'Johnson': 'Scouts'}
 
-    rows = []
-    for old, new in pairs:
-        old_term = Group(osm, auth, MAPPING.keys(), old['name'])
-        new_term = Group(osm, auth, MAPPING.keys(), new['name'])
+    # Each term is the new term of one pair and the old term of the
+    # next, so load each one only once.
+    groups = {}
 
-        old_members_raw = old_term.all_yp_members_without_senior_duplicates()
-        new_members_raw = new_term.all_yp_members_without_senior_duplicates()
+    def get_group(name):
+        if name not in groups:
+            groups[name] = load_group(name)
+        return groups[name]
 
-        old_members = [(_['first_name'], _['last_name'])
-                       for _ in old_members_raw]
+    def rows():
+        for old, new in pairs:
+            leavers = get_group(old['name']).membership_diff(
+                get_group(new['name']), ref_date=old.enddate)
+            leavers = leavers[(leavers['change'] == 'left') &
+                              leavers['section'].isin(section_map.keys())]
 
-        new_members = [(_['first_name'], _['last_name'])
-                       for _ in new_members_raw]
+            for _, member in leavers.iterrows():
+                yield [old['name'], section_map[member['section']], member['section'],
+                       member['first_name'], member['last_name'], member['age'],
+                       member['date_of_birth'], member['floating.gender'].lower()]
 
-        missing = [_ for _ in old_members if not new_members.count(_)]
+    headers = ["Last Term", "Section", "Section Name", "First", "Last", "Age", "DOB", "Gender"]
 
-        for first, last in missing:
-            sections = old_term.find_sections_by_name(first, last)
-            member = old_members_raw[old_members.index((first, last))]
-            age = member.age(ref_date=old.enddate).days // 365
-            rows.append([old['name'], section_map[sections[0]], sections[0], first, last, age, member['date_of_birth'],
-                         member['floating.gender'].lower()])
+    write_rows(headers, rows(), fmt, no_headers)
 
-    headers = ["Last Term", "Section", "Section Name", "First", "Last", "Age", "DOB", "Gender"]
 
-    if csv:
-        w = csv_writer(sys.stdout)
-        if not no_headers:
-            w.writerow(list(headers))
-        w.writerows(rows)
+def census_dates(osm, auth, dates, term=None, fmt='table', no_headers=False,
+                 history=None):
+    dates = [datetime.datetime.strptime(_, '%Y-%m-%d') for _ in dates]
+    if history:
+        store = HistoryStore(history)
+        frame = store.census_by_dates(dates)
+        store.close()
     else:
-        if not no_headers:
-            print(tabulate.tabulate(rows, headers=headers))
-        else:
-            print(tabulate.tabulate(rows, tablefmt="plain"))
+        frame = group_for_term(osm, auth, term).census_by_dates(dates)
+    frame['date'] = frame['date'].dt.strftime('%Y-%m-%d')
+
+    write_frame(frame, fmt, no_headers)
 
 
 def contacts_list(osm, auth, sections, term=None):
-    group = Group(osm, auth, MAPPING.keys(), term)
+    group = group_for_term(osm, auth, term)
 
     for section in sections:
         for member in group.section_all_members(section):
             print("{} {}".format(member['first_name'], member['last_name']))
 
 
-def contacts_detail(osm, auth, sections, csv=False, term=None, no_headers=False):
-    group = Group(osm, auth, MAPPING.keys(), term)
+def contacts_detail(osm, auth, sections, fmt='table', term=None, no_headers=False,
+                    offline=None):
     section_map = {'Garrick': 'Beavers',
                    'Paget': 'Beavers',
                    'Swinfen': 'Beavers',
@@ -261,111 +293,112 @@ def contacts_detail(osm, auth, sections, csv=False, term=None, no_headers=False)
                    'Erasmus': 'Scouts',
                    'Boswell': 'Scouts',
                    'Johnson': 'Scouts'}
-    rows = []
-
-    def add_row(section, member):
-        rows.append([section_map[section], section, member['first_name'], member['last_name'],
-                     member['date_of_birth'],
-                     member['contact_primary_1.email1'],
-                     member['contact_primary_1.address1'],
-                     member['contact_primary_1.address2'],
-                     member['contact_primary_1.address3'],
-                     member['contact_primary_1.postcode'],
-                     member['contact_primary_2.address1'],
-                     member['floating.gender'].lower()])
 
-    for section in sections:
-        for member in group.section_all_members(section):
-            add_row(section, member)
+    def rows():
+        group = group_for_term(osm, auth, term)
+        for section in sections:
+            for member in group.section_all_members(section):
+                yield [section_map[section], section, member['first_name'], member['last_name'],
+                       member['date_of_birth'],
+                       member['contact_primary_1.email1'],
+                       member['contact_primary_1.address1'],
+                       member['contact_primary_1.address2'],
+                       member['contact_primary_1.address3'],
+                       member['contact_primary_1.postcode'],
+                       member['contact_primary_2.address1'],
+                       member['floating.gender'].lower()]
+
+    def offline_rows():
+        with closing(Mirror(offline)) as mirror:
+            for row in mirror.contacts_details(
+                    [Group.SECTIONIDS[section] for section in sections]):
+                yield [section_map[row['section']], row['section'], row['first_name'], row['last_name'],
+                       row['date_of_birth'],
+                       row['email1'],
+                       row['address1'],
+                       row['address2'],
+                       row['address3'],
+                       row['postcode'],
+                       row['address1_2'],
+                       (row['gender'] or '').lower()]
 
     headers = ["Section", "Section Name", "First", "Last", "DOB", "Email1", "Address1", "Address1.1", "Address1.2", "Address1.3",
                "Address2", "Address3", "Gender"]
 
-    if csv:
-        w = csv_writer(sys.stdout)
-        if not no_headers:
-            w.writerow(list(headers))
-        w.writerows(rows)
-    else:
-        if not no_headers:
-            print(tabulate.tabulate(rows, headers=headers))
-        else:
-            print(tabulate.tabulate(rows, tablefmt="plain"))
+    write_rows(headers, offline_rows() if offline else rows(), fmt, no_headers)
 
 
 def movers_list(osm, auth, sections, age=None, term=None,
-                csv=False, no_headers=False):
-    group = Group(osm, auth, MAPPING.keys(), term)
+                fmt='table', no_headers=False):
+    group = group_for_term(osm, auth, term)
 
-    rows = []
+    fields = ['firstname', 'lastname', 'real_age', 'dob',
+              "Date Parents Contacted", "Parents Preference",
+              "Date Leaders Contacted", "Agreed Section",
+              "Starting Date", "Leaving Date", "Notes", "Priority",
+              '8', '10 1/2', '14 1/2']
 
-    for section in sections:
-        section_ = group._sections.sections[Group.SECTIONIDS[section]]
+    def rows():
+        for section in sections:
+            section_ = group._sections.sections[Group.SECTIONIDS[section]]
+
+            movers = section_.movers
 
-        headers = ['firstname', 'lastname', 'real_age', 'dob',
-                   "Date Parents Contacted", "Parents Preference",
-                   "Date Leaders Contacted", "Agreed Section",
-                   "Starting Date", "Leaving Date", "Notes", "Priority",
-                   '8', '10 1/2', '14 1/2']
+            if age:
+                threshold = (365 * float(age))
+                now = datetime.datetime.now()
+                age_fn = lambda dob: (now - datetime.datetime.strptime(dob, '%Y-%m-%d')).days
 
-        movers = section_.movers
+                movers = [mover for mover in section_.movers
+                          if age_fn(mover['dob']) > threshold]
 
-        if age:
-            threshold = (365 * float(age))
             now = datetime.datetime.now()
-            age_fn = lambda dob: (now - datetime.datetime.strptime(dob, '%Y-%m-%d')).days
-
-            movers = [mover for mover in section_.movers
-                      if age_fn(mover['dob']) > threshold]
-
-        now = datetime.datetime.now()
-        for mover in movers:
-            real_dob = datetime.datetime.strptime(mover['dob'], '%Y-%m-%d')
-            rel_age = relativedelta.relativedelta(now, real_dob)
-            mover['real_age'] = "{0:02d}.{0:02d}".format(rel_age.years, rel_age.months)
-            mover['8'] = (real_dob+relativedelta.relativedelta(years=8)).strftime("%b %y")
-            mover['10 1/2'] = (real_dob + relativedelta.relativedelta(years=10, months=6)).strftime("%b %y")
-            mover['14 1/2'] = (real_dob + relativedelta.relativedelta(years=14, months=6)).strftime("%b %y")
-
-        rows += [[section_['sectionname']] +
-                 [member[header] for header in headers]
-                  for member in movers]
-
-    headers = ["Current Section"] + headers
-
-    if csv:
-        w = csv_writer(sys.stdout)
-        if not no_headers:
-            w.writerow(list(headers))
-        w.writerows(rows)
-    else:
-        if not no_headers:
-            print(tabulate.tabulate(rows, headers=headers))
-        else:
-            print(tabulate.tabulate(rows, tablefmt="plain"))
+            for mover in movers:
+                real_dob = datetime.datetime.strptime(mover['dob'], '%Y-%m-%d')
+                rel_age = relativedelta.relativedelta(now, real_dob)
+                mover['real_age'] = "{0:02d}.{0:02d}".format(rel_age.years, rel_age.months)
+                mover['8'] = (real_dob+relativedelta.relativedelta(years=8)).strftime("%b %y")
+                mover['10 1/2'] = (real_dob + relativedelta.relativedelta(years=10, months=6)).strftime("%b %y")
+                mover['14 1/2'] = (real_dob + relativedelta.relativedelta(years=14, months=6)).strftime("%b %y")
+
+                yield [section_['sectionname']] + [mover[field] for field in fields]
+
+    headers = ["Current Section"] + fields
+
+    write_rows(headers, rows(), fmt, no_headers)
 
 
 def events_list(osm, auth, sections, term=None):
-    group = Group(osm, auth, MAPPING.keys(), term)
+    group = group_for_term(osm, auth, term)
 
     for section in sections:
         for event in group._sections.sections[Group.SECTIONIDS[section]].events:
             print(event['name'])
 
 
-def events_info(osm, auth, sections, event, term=None):
-    group = Group(osm, auth, MAPPING.keys(), term)
+def events_info(osm, auth, sections, event, term=None, offline=None):
+    with ExitStack() as stack:
+        if offline:
+            mirror = stack.enter_context(closing(Mirror(offline)))
 
-    for section in sections:
-        ev = group._sections.sections[
-            Group.SECTIONIDS[section]].events.get_by_name(event)
-        print(",".join([ev[_] for _ in ['name', 'startdate', 'enddate', 'location']]))
+            def get_event(section):
+                return mirror.event(Group.SECTIONIDS[section], event)
+        else:
+            group = group_for_term(osm, auth, term)
+
+            def get_event(section):
+                return group._sections.sections[
+                    Group.SECTIONIDS[section]].events.get_by_name(event)
+
+        for section in sections:
+            ev = get_event(section)
+            print(",".join([ev[_] for _ in ['name', 'startdate', 'enddate', 'location']]))
 
 
 def events_attendees(osm, auth, sections, event,
-                     term=None, csv=False, attending_only=False,
+                     term=None, fmt='table', attending_only=False,
                      no_headers=False):
-    group = Group(osm, auth, MAPPING.keys(), term)
+    group = group_for_term(osm, auth, term)
 
     for section in sections:
         section_ = group._sections.sections[Group.SECTIONIDS[section]]
@@ -390,105 +423,155 @@ def events_attendees(osm, auth, sections, event,
                    extra_fields.keys()]
             return out
 
-        output = [fields(attendee)
-                  for attendee in attendees if section_.members.is_member(attendee['scoutid'])]
+        output = (fields(attendee)
+                  for attendee in attendees if section_.members.is_member(attendee['scoutid']))
         headers = [_[0] for _ in mapping] + list(extra_fields.values())
-        if csv:
-            w = csv_writer(sys.stdout)
-            if not no_headers:
-                w.writerow(list(headers))
-            w.writerows(output)
-        else:
-            if not no_headers:
-                print(tabulate.tabulate(output, headers=headers))
-            else:
-                print(tabulate.tabulate(output, tablefmt="plain"))
-
-
-def users_list(osm, auth, sections, csv=False, no_headers=False, term=None):
-    group = Group(osm, auth, MAPPING.keys(), term)
+        write_rows(headers, output, fmt, no_headers)
+
+
+def events_export(osm, auth, sections, terms=None, term=None, fmt='table',
+                  attending_only=False, no_headers=False, workers=4):
+    """Write the attendance of every event in sections as one long table.
+
+    There is a row per event, attendee and event field. Events are
+    taken from each of the named terms (term, or the current term, if
+    there are none) and all of the event lists, structures and
+    attendance records are fetched concurrently."""
+    group = group_for_term(osm, auth, term)
+    osm_sections = [group._sections.sections[Group.SECTIONIDS[section]]
+                    for section in sections]
+    section_names = {Group.SECTIONIDS[section]: section for section in sections}
+
+    def section_events(section_):
+        if not terms:
+            return list(section_.events)
+        return [event for term_ in section_.get_terms()
+                if term_['name'] in terms
+                for event in section_._get_events(term_)]
+
+    def fetch(event):
+        return event, event.fieldmap, event.attendees
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        events = [event for events_ in pool.map(section_events, osm_sections)
+                  for event in events_]
+        fetched = list(pool.map(fetch, events))
+
+    frames = []
+    for event, mapping, attendees in fetched:
+        if attending_only:
+            attendees = [attendee for attendee in attendees
+                         if attendee['attending'] == "Yes"]
+        if not attendees or not mapping:
+            continue
+        names, fields = zip(*mapping)
+        frame = pd.DataFrame(attendees).reindex(columns=['scoutid'] + list(fields))
+        frame.columns = ['scoutid'] + list(names)
+        frame = frame.melt(id_vars='scoutid', var_name='field', value_name='value',
+                           ignore_index=False).sort_index(kind='stable')
+        frame.insert(0, 'section', section_names[str(event._section['section_id'])])
+        frame.insert(1, 'term', event.term['name'])
+        frame.insert(2, 'eventid', event['eventid'])
+        frame.insert(3, 'event', event['name'])
+        frame.insert(4, 'startdate', event['startdate'])
+        frames.append(frame)
+
+    columns = ['section', 'term', 'eventid', 'event', 'startdate', 'scoutid',
+               'field', 'value']
+    table = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+    table['scoutid'] = table['scoutid'].astype(str)
+
+    # Attach each attendee's details from the section they attended with.
+    members = group.member_table()
+    members = members[['section', 'member_id', 'patrol', 'age']].assign(
+        scoutid=members['member_id'].astype(str)).drop(columns='member_id')
+    table = table.merge(members.drop_duplicates(['section', 'scoutid']),
+                        on=['section', 'scoutid'], how='left')
+    table['patrol'] = table['patrol'].fillna('')
+    table['age'] = table['age'].astype('Int64')
+
+    write_frame(table[columns[:6] + ['patrol', 'age', 'field', 'value']],
+                fmt, no_headers)
+
+
+def users_list(osm, auth, sections, fmt='table', no_headers=False, term=None):
+    group = group_for_term(osm, auth, term)
 
     for section in sections:
         for user in group._sections.sections[Group.SECTIONIDS[section]].users:
             print(user['firstname'])
 
 
-def members_badges(osm, auth, sections, csv=False, no_headers=False, term=None):
-    group = Group(osm, auth, MAPPING.keys(), term)
+def members_badges(osm, auth, sections, fmt='table', no_headers=False, term=None):
+    group = group_for_term(osm, auth, term)
 
     for section in sections:
         # members = group._sections.sections[Group.SECTIONIDS[section]].members
         members = group.section_yp_members_without_leaders(section)
-        rows = []
-        for member in members:
-            badges = member.get_badges(section_type=group.SECTION_TYPE[section])
-            if badges:
-                # If no badges - probably a leader
-                challenge_new = len([badge for badge in badges
-                                     if badge['awarded'] == '1' and badge['badge_group'] == '1'
-                                     and not badge['badge'].endswith('(Pre 2015)')])
-                challenge_old = len([badge for badge in badges
-                                     if badge['awarded'] == '1' and badge['badge_group'] == '1'
-                                     and badge['badge'].endswith('(Pre 2015)')])
-
-                activity = len([badge for badge in badges if badge['awarded'] == '1' and badge['badge_group'] == '2'])
-                staged = len([badge for badge in badges if badge['awarded'] == '1' and badge['badge_group'] == '3'])
-                core = len([badge for badge in badges if badge['awarded'] == '1' and badge['badge_group'] == '4'])
-
-                rows.append([member['date_of_birth'], member['last_name'], member['age'], section,
-                             challenge_new, challenge_old, activity, staged, core])
+
+        def rows():
+            for member in members:
+                badges = member.get_badges(section_type=group.SECTION_TYPE[section])
+                if badges:
+                    # If no badges - probably a leader
+                    challenge_new = len([badge for badge in badges
+                                         if badge['awarded'] == '1' and badge['badge_group'] == '1'
+                                         and not badge['badge'].endswith('(Pre 2015)')])
+                    challenge_old = len([badge for badge in badges
+                                         if badge['awarded'] == '1' and badge['badge_group'] == '1'
+                                         and badge['badge'].endswith('(Pre 2015)')])
+
+                    activity = len([badge for badge in badges if badge['awarded'] == '1' and badge['badge_group'] == '2'])
+                    staged = len([badge for badge in badges if badge['awarded'] == '1' and badge['badge_group'] == '3'])
+                    core = len([badge for badge in badges if badge['awarded'] == '1' and badge['badge_group'] == '4'])
+
+                    yield [member['date_of_birth'], member['last_name'], member['age'], section,
+                           challenge_new, challenge_old, activity, staged, core]
 
         headers = ["DOB", "Last Name", "Age", "Section Name", "Challenge", "Challenge_old", "Staged", "Activity", "Core"]
 
-        if csv:
-            w = csv_writer(sys.stdout)
-            if not no_headers:
-                w.writerow(list(headers))
-            w.writerows(rows)
+        write_rows(headers, rows(), fmt, no_headers)
+
+
+def member_badges(osm, auth, firstname, lastname, fmt='table', no_headers=False, term=None,
+                  offline=None):
+    with ExitStack() as stack:
+        if offline:
+            mirror = stack.enter_context(closing(Mirror(offline)))
+            members = [(json.loads(row['record']), row['sectionname'],
+                        functools.partial(mirror.badges, row['section_id'], row['member_id']))
+                       for row in mirror.find_by_name(
+                           firstname, lastname,
+                           [Group.SECTIONIDS[_] for _ in Group.YP_SECTIONS])]
         else:
-            if not no_headers:
-                print(tabulate.tabulate(rows, headers=headers))
-            else:
-                print(tabulate.tabulate(rows, tablefmt="plain"))
-
-
-def member_badges(osm, auth, firstname, lastname, csv=False, no_headers=False, term=None):
-    group = Group(osm, auth, MAPPING.keys(), term)
-
-    members = group.find_by_name(firstname, lastname)
-    # member = members[-1]
-    rows = []
-    for member in members:
-        for section_type in ('beavers', 'cubs', 'scouts'):
-            try:
-                badges = member.get_badges(section_type=section_type)
-                if badges is not None:
-                    for badge in [_ for _ in badges if _['awarded'] == '1']:
-                        rows.append([member['date_of_birth'], member['last_name'],
-                                     member['age'], section_type, member._section['sectionname'],
-                                     badge['badge'],
-                                     datetime.date.fromtimestamp(int(badge['awarded_date'])).isoformat()])
-            except:
-                import traceback
-                traceback.print_exc()
-                pass
+            group = group_for_term(osm, auth, term)
+            members = [(member, member._section['sectionname'], member.get_badges)
+                       for member in group.find_by_name(firstname, lastname)]
+
+        # member = members[-1]
+        rows = []
+        for member, sectionname, get_badges in members:
+            for section_type in ('beavers', 'cubs', 'scouts'):
+                try:
+                    badges = get_badges(section_type=section_type)
+                    if badges is not None:
+                        for badge in [_ for _ in badges if _['awarded'] == '1']:
+                            rows.append([member['date_of_birth'], member['last_name'],
+                                         member['age'], section_type, sectionname,
+                                         badge['badge'],
+                                         datetime.date.fromtimestamp(int(badge['awarded_date'])).isoformat()])
+                except:
+                    import traceback
+                    traceback.print_exc()
+                    pass
 
     headers = ["DOB", "Last Name", "Age", "Section Type", "Section Name", "Badge"]
 
-    if csv:
-        w = csv_writer(sys.stdout)
-        if not no_headers:
-            w.writerow(list(headers))
-        w.writerows(rows)
-    else:
-        if not no_headers:
-            print(tabulate.tabulate(rows, headers=headers))
-        else:
-            print(tabulate.tabulate(rows, tablefmt="plain"))
+    write_rows(headers, rows, fmt, no_headers)
 
 
-def payments(osm, auth, sections, start, end):
-    group = Group(osm, auth, MAPPING.keys(), None)
+def payments(osm, auth, sections, start, end, term=None):
+    group = group_for_term(osm, auth, term)
 
     for section in sections:
         osm_section = group._sections.sections[Group.SECTIONIDS[section]]
@@ -497,7 +580,7 @@ def payments(osm, auth, sections, start, end):
         print(payments.content.decode())
 
 
-def group_payments(osm, auth, outfile):
+def group_payments(osm, auth, outfile, workers=4):
     important_fields = ['first_name',
                         'last_name',
                         'joined',
@@ -526,143 +609,274 @@ def group_payments(osm, auth, outfile):
     general_amount = 17.95
     discount_amount = 12.13
 
-    # Fetch all of the available data for each term on which a payment is due.
-    group_by_date = {}
-    for name, date in payment_dates.items():
-        group_by_date[name] = Group(osm, auth, important_fields, on_date=date)
-
-    # Get a list of all members in all terms across the whole group.
-    all_yp_members = []
-    for group in group_by_date.values():
-        all_yp_members.extend(group.all_yp_members_without_leaders())
-
-    all_yp_by_scout_id = {member['member_id']: member for member in all_yp_members}
-
-    # Get the current group data for the current term.
-    current = Group(osm, auth, important_fields)
+    accessor = osm.shared_accessor(auth)
 
-    res = []
-    for scoutid, member in all_yp_by_scout_id.items():
-        current_member = current.find_by_scoutid_without_senior_duplicates(str(scoutid))
-        section = current_member[0]._section['sectionname'] if len(current_member) else 'Unknown'
-        d = collections.OrderedDict((('scoutid', scoutid), ('First name', member['first_name']),
-                                     ('Last name', member['last_name']), ('joined', member['started']),
-                                     ('left', member['end_date']),
-                                     ('section', section)))
-
-        joined = datetime.datetime.strptime(member['started'], "%Y-%m-%d").date()
-        ended = datetime.datetime.strptime(member['end_date'], "%Y-%m-%d").date() if member['end_date'] else False
-
-        amount = discount_amount if member['customisable_data.cf_subs_type_n_g_d_'] == 'D' else general_amount
-
-        for schedule, date_ in payment_dates.items():
-            d[schedule] = amount if ((joined < date_ and not ended) or
-                                     (joined < date_ and ended > date_)) else 0
-        res.append(d)
-
-    tbl = pd.DataFrame(res)
-    tbl.set_index(["Last name", "First name"], inplace=True)
+    def load(date=None):
+        return Group(osm, auth, important_fields, on_date=date,
+                     accessor=accessor)
 
     all_sections = list(Group.SECTIONIDS.keys())
 
-    def fetch_section(section_name):
-        section = group._sections.sections[Group.SECTIONIDS[section_name]]
+    def fetch_section(section):
         payments = section.get_payments(first_date.strftime('%Y-%m-%d'),
                                         last_date.strftime('%Y-%m-%d'))
         return pd.read_csv(StringIO(payments.content.decode())) if payments is not None else pd.DataFrame()
 
-    all = pd.concat([fetch_section(name) for name in all_sections], ignore_index=True)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Fetch all of the available data for each term on which a
+        # payment is due, and the group data for the current term.
+        current_future = pool.submit(load)
+        groups = list(pool.map(load, payment_dates.values()))
+        current = current_future.result()
+
+        # Fetch the payments made to every section.
+        all = pd.concat(list(pool.map(
+            fetch_section, [current._sections.sections[Group.SECTIONIDS[name]]
+                            for name in all_sections])), ignore_index=True)
+
+    # All YP members of the YP sections in all terms across the whole
+    # group. Where a member has more than one record the one from the
+    # latest payment date wins, and on that date the one from the most
+    # senior section (the last in YP_SECTIONS).
+    members = pd.concat([group.member_table().assign(_date=n)
+                         for n, group in enumerate(groups)],
+                        ignore_index=True)
+    members = members[members['yp'] &
+                      members['section'].isin(Group.YP_SECTIONS)]
+    members = members.assign(
+        _section=members['section'].map(Group.YP_SECTIONS.index))
+    members = members.sort_values(['_date', '_section'], kind='stable')
+    members = members.drop_duplicates('member_id', keep='last')
+
+    # The section each member is in now, if any.
+    now = current.member_table()
+    now = now[now['yp'] & ~now['senior_duplicate']].drop_duplicates('member_id')
+    section_names = {name: section['sectionname']
+                     for name, section in ((name, current._sections.sections[Group.SECTIONIDS[name]])
+                                           for name in now['section'].unique())}
+    current_section = dict(zip(now['member_id'].astype(str),
+                               now['section'].map(section_names)))
+
+    tbl = pd.DataFrame(collections.OrderedDict((
+        ('scoutid', members['member_id'].values),
+        ('First name', members['first_name'].values),
+        ('Last name', members['last_name'].values),
+        ('joined', members['started'].values),
+        ('left', members['end_date'].values),
+        ('section', [current_section.get(str(_), 'Unknown')
+                     for _ in members['member_id']]))))
+
+    # A member is charged on each schedule date that falls after they
+    # joined and before they left.
+    joined = pd.to_datetime(tbl['joined'], format='%Y-%m-%d',
+                            errors='coerce').values
+    ended = pd.to_datetime(tbl['left'].replace('', None), format='%Y-%m-%d',
+                           errors='coerce').values
+    amount = np.where(
+        members['customisable_data.cf_subs_type_n_g_d_'].values == 'D',
+        discount_amount, general_amount)
+    dates = np.array([np.datetime64(_) for _ in payment_dates.values()],
+                     dtype='datetime64[ns]')[:, np.newaxis]
+    charged = (joined < dates) & (np.isnat(ended) | (ended > dates))
+    for schedule, row in zip(schedules, charged):
+        tbl[schedule] = np.where(row, amount, 0)
 
-    all['Schedule'] = all['Schedule'].str.replace('^General Subscriptions.*$', 'General Subscriptions')
-    all['Schedule'] = all['Schedule'].str.replace('^Discounted Subscriptions.*$', 'Discounted Subscriptions')
+    tbl.set_index(["Last name", "First name"], inplace=True)
+
+    all['Schedule'] = all['Schedule'].str.replace('^General Subscriptions.*$', 'General Subscriptions', regex=True)
+    all['Schedule'] = all['Schedule'].str.replace('^Discounted Subscriptions.*$', 'Discounted Subscriptions', regex=True)
     subs = all[(all['Schedule'] == 'General Subscriptions') | (all['Schedule'] == 'Discounted Subscriptions')]
 
     pv = pd.pivot_table(subs, values='Net', index=['Last name', 'First name'], columns=['Schedule', 'Payment'])
-    for schedule in schedules:
-        pv['General Subscriptions'][schedule].fillna(
-            pv['Discounted Subscriptions'][schedule], inplace=True)
-    del pv['Discounted Subscriptions']
-    pv.columns = pv.columns.droplevel()
-    del pv['2015/Q3']
-
-    combined = tbl.join(pv, lsuffix='_est', rsuffix='_act', how='outer')
+    # A member pays on either the general or the discounted schedule.
+    # Only the payments of the general schedule are reported.
+    actual = pv['General Subscriptions']
+    if 'Discounted Subscriptions' in pv.columns.get_level_values(0):
+        actual = actual.fillna(pv['Discounted Subscriptions'].reindex(
+            columns=actual.columns))
+    actual = actual.drop(columns='2015/Q3', errors='ignore')
+
+    # The payments export only identifies members by name, so this is
+    # the key that expected and actual payments are joined on.
+    combined = tbl.join(actual, lsuffix='_est', rsuffix='_act', how='outer')
 
     for schedule in schedules:
         for suffix in ['_est', '_act']:
-            combined[schedule + suffix].fillna(0, inplace=True)
+            combined[schedule + suffix] = combined[schedule + suffix].fillna(0)
 
     for schedule in schedules:
-        combined[schedule + '_var'] = combined.apply(lambda row: row[schedule + '_est'] - row[schedule + '_act'],
-                                                     axis=1)
+        combined[schedule + '_var'] = combined[schedule + '_est'] - combined[schedule + '_act']
 
     combined.to_excel(outfile, sheet_name="Data", merge_cells=False)
 
 
-if __name__ == '__main__':
-    level = logging.INFO
+def group_query(osm, auth, expression, fields=None, term=None, fmt='table',
+                as_json=False, no_headers=False):
+    group = group_for_term(osm, auth, term)
 
-    logging.basicConfig(level=level)
+    if fields:
+        fields = [_.strip() for _ in fields.split(',')]
+    else:
+        fields = ['section', 'first_name', 'last_name', 'date_of_birth',
+                  'age', 'gender']
 
-    args = docopt(__doc__, version='OSM 2.0')
+    result = group.query(expression, fields)
 
+    if as_json:
+        print(result.to_json(orient='records', indent=2))
+    else:
+        write_frame(result, fmt, no_headers)
+
+
+def group_quality(osm, auth, term=None, fmt='table', no_headers=False):
+    """Write the data quality rules broken by each member (see quality.py)."""
+    group = group_for_term(osm, auth, term)
+    write_frame(quality.violations(group), fmt, no_headers)
+
+
+def output_format(args):
+    fmt = 'csv' if args['--csv'] else args['--format']
+    if fmt not in FORMATS:
+        raise DocoptExit("format must be in {!r}.".format(FORMATS))
+    return fmt
+
+
+def run_batch(osm, auth, script, apiid, token, outdir='.'):
+    """Run each command in script, writing its output to its own file.
+
+    Each line of the script is a cli command without the <apiid> and
+    <token>, optionally followed by '> filename'. Without a filename the
+    output goes to a file named after the command. Blank lines and lines
+    starting with '#' are ignored. Every command that uses the same term
+    shares a single load of the Group."""
+    extensions = {'table': 'txt', 'csv': 'csv', 'jsonl': 'jsonl',
+                  'parquet': 'parquet'}
+
+    for number, line in enumerate(script, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+
+        words = shlex.split(line)
+        outfile = None
+        if '>' in words:
+            outfile = words[words.index('>') + 1]
+            words = words[:words.index('>')]
+
+        try:
+            args = docopt(__doc__, argv=[apiid, token] + words)
+            fmt = output_format(args)
+        except SystemExit:
+            log.error("Line {}: not a valid command: {}".format(number, line))
+            continue
+
+        if args['batch']:
+            log.error("Line {}: batches cannot be nested".format(number))
+            continue
+
+        if outfile is None:
+            outfile = "{}.{}".format(
+                "_".join(re.sub(r'\W+', '-', _).strip('-') for _ in words
+                         if not _.startswith('-')),
+                extensions[fmt])
+        outfile = os.path.join(outdir, outfile)
+
+        log.info("Running '{}' > {}".format(" ".join(words), outfile))
+        try:
+            with open(outfile, 'w') as out, redirect_stdout(out):
+                run_command(osm, auth, args)
+        except (Exception, DocoptExit):
+            log.exception("Line {}: '{}' failed".format(number, line))
+
+
+def run_command(osm, auth, args):
     sections = None
     if args['<section>']:
         section = args['<section>']
-        assert section in list(Group.SECTIONIDS.keys()) + ['Group'] + list(Group.SECTIONS_BY_TYPE.keys()), \
-            "section must be in {!r}.".format(list(Group.SECTIONIDS.keys()) + ['Group'])
+        if section not in list(Group.SECTIONIDS.keys()) + ['Group'] + list(Group.SECTIONS_BY_TYPE.keys()):
+            raise DocoptExit(
+                "section must be in {!r}.".format(list(Group.SECTIONIDS.keys()) + ['Group']))
 
         sections = Group.SECTIONS_BY_TYPE[section] if section in Group.SECTIONS_BY_TYPE.keys() else [section,]
 
     term = args['--term'] if args['--term'] else None
 
-    auth = osm.Authorisor(args['<apiid>'], args['<token>'])
-    auth.load_from_file(open(DEF_CREDS, 'r'))
+    fmt = output_format(args)
+
+    offline = args['--mirror'] if args['--offline'] else None
+
+    if args['mirror']:
+        with closing(Mirror(args['--mirror'])) as mirror:
+            mirror.update(group_for_term(osm, auth, term))
+        return
 
     if args['events']:
         if args['list']:
-            events_list(osm, auth, sections)
+            events_list(osm, auth, sections, term=term)
+        elif args['export']:
+            events_export(osm, auth, sections,
+                          terms=args['<termname>'],
+                          term=term,
+                          fmt=fmt,
+                          attending_only=args['--attending'],
+                          no_headers=args['--no_headers'])
         elif args['attendees']:
             events_attendees(osm, auth, sections,
                              args['<event>'],
-                             csv=args['--csv'],
+                             term=term,
+                             fmt=fmt,
                              attending_only=args['--attending'],
                              no_headers=args['--no_headers'])
         elif args['info']:
-            events_info(osm, auth, sections, args['<event>'])
+            events_info(osm, auth, sections, args['<event>'],
+                        term=term,
+                        offline=offline)
         else:
             log.error('unknown')
     elif args['contacts']:
         if args['list']:
-            contacts_list(osm, auth, sections)
+            contacts_list(osm, auth, sections, term=term)
         elif args['details']:
-            contacts_detail(osm, auth, sections, csv=args['--csv'],
-                          no_headers=args['--no_headers'])
+            contacts_detail(osm, auth, sections, fmt=fmt,
+                            term=term,
+                            no_headers=args['--no_headers'],
+                            offline=offline)
         else:
             log.error('unknown')
     elif args['movers']:
         if args['list']:
             movers_list(osm, auth, sections,
                         age=args['--minage'],
-                        csv=args['--csv'],
+                        term=term,
+                        fmt=fmt,
                         no_headers=args['--no_headers'])
         else:
             log.error('unknown')
     elif args['census']:
         if args['yl'] and args['list']:
             census_yl_list(osm, auth,
-                           csv=args['--csv'],
+                           term=term,
+                           fmt=fmt,
                            no_headers=args['--no_headers'])
 
         elif args['leavers']:
             census_leavers(osm, auth,
-                           csv=args['--csv'],
-                           no_headers=args['--no_headers'])
+                           fmt=fmt,
+                           no_headers=args['--no_headers'],
+                           history=args['--history'])
+
+        elif args['dates']:
+            census_dates(osm, auth, args['<date>'],
+                         term=term,
+                         fmt=fmt,
+                         no_headers=args['--no_headers'],
+                         history=args['--history'])
 
 
         elif args['list']:
             census_list(osm, auth,
-                        term=args['--term'],
-                        csv=args['--csv'],
+                        term=term,
+                        fmt=fmt,
                         no_headers=args['--no_headers'])
 
         else:
@@ -670,14 +884,16 @@ if __name__ == '__main__':
     elif args['users']:
         if args['list']:
             users_list(osm, auth, sections,
-                       csv=args['--csv'],
+                       term=term,
+                       fmt=fmt,
                        no_headers=args['--no_headers'])
         else:
             log.error('unknown')
     elif args['members']:
         if args['badges']:
             members_badges(osm, auth, sections,
-                           csv=args['--csv'],
+                           term=term,
+                           fmt=fmt,
                            no_headers=args['--no_headers'])
         else:
             log.error('unknown')
@@ -685,8 +901,10 @@ if __name__ == '__main__':
         if args['badges']:
             member_badges(osm, auth, args['<firstname>'],
                           args['<lastname>'],
-                          csv=args['--csv'],
-                          no_headers=args['--no_headers'])
+                          term=term,
+                          fmt=fmt,
+                          no_headers=args['--no_headers'],
+                          offline=offline)
         else:
             log.error('unknown')
 
@@ -696,7 +914,42 @@ if __name__ == '__main__':
         else:
             log.error('unknown')
 
+    elif args['query']:
+        group_query(osm, auth, args['<query>'],
+                    fields=args['--fields'],
+                    term=term,
+                    fmt=fmt,
+                    as_json=args['--json'],
+                    no_headers=args['--no_headers'])
+
+    elif args['quality']:
+        group_quality(osm, auth,
+                      term=term,
+                      fmt=fmt,
+                      no_headers=args['--no_headers'])
+
     elif args['payments']:
-        payments(osm, auth, sections, args['<start>'], args['<end>'])
+        payments(osm, auth, sections, args['<start>'], args['<end>'],
+                 term=term)
     else:
         log.error('unknown')
+
+
+if __name__ == '__main__':
+    level = logging.INFO
+
+    logging.basicConfig(level=level)
+
+    args = docopt(__doc__, version='OSM 2.0')
+
+    auth = osm.Authorisor(args['<apiid>'], args['<token>'])
+    auth.load_from_file(open(DEF_CREDS, 'r'))
+
+    if args['batch']:
+        script = args['<script>']
+        run_batch(osm, auth,
+                  sys.stdin if script in (None, '-') else open(script, 'r'),
+                  args['<apiid>'], args['<token>'],
+                  outdir=args['--outdir'])
+    else:
+        run_command(osm, auth, args)
@@ -0,0 +1,283 @@
+# coding=utf-8
+"""Web dashboard of the group, section and audit reports.
+
+Usage:
+  dashboard.py [-d] [--port=<port>] [--refresh=<minutes>] [--term=<term>]
+               [--audit]
+  dashboard.py (-h | --help)
+  dashboard.py --version
+
+
+Options:
+  -d,--debug     Turn on debug output.
+  --port=<port>  Port to serve on [default: 8000].
+  --refresh=<minutes>  How often to reload the group from OSM [default: 60].
+  --term=<term>  Which OSM term to use [default: current].
+  --audit        Include the Google audit report (needs GAM).
+  -h,--help      Show this screen.
+  --version      Show version.
+
+Every report is rendered into an in-memory cache and served from there
+by a threaded server, gzipped for clients that accept it and with an
+ETag so that unchanged pages are not sent again. The group is reloaded
+in the background every --refresh minutes; if anything the reports show
+has changed they are re-rendered, and the previous versions are served
+until the new ones are ready. The audit report is made from Google data
+that the group does not show, so it is re-rendered on every refresh.
+"""
+
+import gzip
+import hashlib
+import logging
+import threading
+import http.server
+from collections import namedtuple, OrderedDict
+from urllib.parse import quote, unquote
+
+from docopt import docopt
+
+import osm
+from group import Group
+
+log = logging.getLogger(__name__)
+
+DEF_CREDS = "osm.creds"
+
+PORT = 8000
+
+Page = namedtuple('Page', ['html', 'gzipped', 'etag'])
+
+_INDEX = "<html><body>\n<h1>Reports</h1>\n<ul>\n{}</ul>\n</body></html>"
+_LINK = '<li><a href="/{}">{}</a></li>\n'.format
+
+
+def _page(html):
+    body = html.encode('utf-8')
+    return Page(body, gzip.compress(body),
+                '"{}"'.format(hashlib.sha1(body).hexdigest()))
+
+
+class Dashboard(object):
+    """An in-memory cache of rendered reports.
+
+    load() returns the data the reports are made from, version(data)
+    returns something that changes when that data does, and
+    render(data) returns an OrderedDict of report name to html. Pages
+    that depend on more than the data (and so cannot be versioned) are
+    returned by live(data), which is rendered on every refresh. Any can
+    be left out to publish pages by hand."""
+
+    def __init__(self, load=None, render=None, version=None, live=None):
+        self._load = load
+        self._render = render
+        self._live = live
+        self._version_of = version
+        self._version = None
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+
+    def publish(self, name, html):
+        page = _page(html)
+        with self._lock:
+            self._pages[name] = page
+
+    def names(self):
+        with self._lock:
+            return list(self._pages.keys())
+
+    def page(self, name):
+        """Return the Page called name (or the index for ''), or None."""
+        if name == '':
+            return _page(_INDEX.format("".join(
+                _LINK(quote(_), _) for _ in self.names())))
+        with self._lock:
+            return self._pages.get(name)
+
+    def refresh(self):
+        """Reload the data and re-render the reports if it has changed,
+        and re-render the live pages.
+
+        Does nothing if a refresh is already running."""
+        if not self._refreshing.acquire(blocking=False):
+            return
+        try:
+            data = self._load()
+            version = self._version_of(data) if self._version_of else None
+            if version is not None and version == self._version:
+                log.info("Reports are up to date")
+            else:
+                # Each page is swapped in whole once it has been rendered,
+                # so requests are served from the previous version until
+                # then.
+                for name, html in self._render(data).items():
+                    self.publish(name, html)
+                self._version = version
+                log.info("Rendered {} reports".format(len(self.names())))
+            if self._live:
+                for name, html in self._live(data).items():
+                    self.publish(name, html)
+        except Exception:
+            log.error("Failed to refresh the reports", exc_info=True)
+        finally:
+            self._refreshing.release()
+
+    def refresh_every(self, seconds):
+        """Refresh in a background thread now and then every seconds."""
+        stop = threading.Event()
+
+        def run():
+            while not stop.is_set():
+                self.refresh()
+                stop.wait(seconds)
+
+        threading.Thread(target=run, daemon=True).start()
+        return stop
+
+
+def _handler(dashboard):
+
+    # noinspection PyClassHasNoInit
+    class Handler(http.server.BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            page = dashboard.page(unquote(self.path.strip('/')))
+            if page is None:
+                self.send_error(404)
+                return
+
+            if page.etag in [_.strip() for _ in
+                             self.headers.get('If-None-Match', '').split(',')]:
+                self.send_response(304)
+                self.send_header("ETag", page.etag)
+                self.end_headers()
+                return
+
+            zipped = 'gzip' in self.headers.get('Accept-Encoding', '')
+            body = page.gzipped if zipped else page.html
+            self.send_response(200)
+            self.send_header("Content-type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", page.etag)
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Vary", "Accept-Encoding")
+            if zipped:
+                self.send_header("Content-Encoding", "gzip")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            log.debug(format % args)
+
+    return Handler
+
+
+def serve(dashboard, port=PORT):
+    """Serve dashboard until interrupted."""
+    httpd = http.server.ThreadingHTTPServer(('', port), _handler(dashboard))
+
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+    httpd.server_close()
+
+
+def report_version(context, term=None):
+    """Return a hash of everything the report_pages() are made from (see
+    weekly_report.group_digest()), so that it only changes when one of
+    them would. The audit_pages() are not covered."""
+    import weekly_report
+
+    h = hashlib.sha1(weekly_report.group_digest(
+        context, weekly_report.get_quarter(),
+        term if term is not None else "Active").encode())
+    h.update(context.violations.to_csv(index=False).encode('utf-8'))
+    return h.hexdigest()
+
+
+def quality_report(violations):
+    """Return a Reporter holding a table of the data quality violations."""
+    import weekly_report
+
+    r = weekly_report.Reporter()
+    r.title("Data quality")
+    r.p("{} problems found.".format(len(violations)))
+    r.t_start(["Section", "First name", "Last name", "Problem"])
+    for row in violations[['section', 'first_name', 'last_name',
+                           'message']].itertuples(index=False):
+        r.t_row(row)
+    r.t_end()
+    return r
+
+
+def report_pages(context, term):
+    """Render the group report, each section report and the data quality
+    violations from a weekly_report.Context."""
+    import weekly_report
+
+    group = context.group
+    sections = weekly_report.report_sections(group)
+    reports = weekly_report.render_sections(context, sections)
+
+    r = weekly_report.Reporter()
+    weekly_report.group_report(r, group, weekly_report.get_quarter(),
+                               term if term is not None else "Active",
+                               context)
+
+    pages = OrderedDict([('Group', r.report())])
+    pages.update((section, reports[section].report())
+                 for section in sections)
+    pages['Data quality'] = quality_report(context.violations).report()
+    return pages
+
+
+def audit_pages(osm, auth, context):
+    """Render the Google audit report. It is not versioned: the Google
+    side can change when the group has not."""
+    import google_audit_report
+
+    group = context.group
+    return OrderedDict([('Audit', google_audit_report.audit_report(
+        osm, auth, group.YP_SECTIONS + [group.ADULT_SECTION, ]).report())])
+
+
+if __name__ == '__main__':
+
+    args = docopt(__doc__, version='OSM 2.0')
+
+    if args['--debug']:
+        level = logging.DEBUG
+    else:
+        level = logging.INFO
+
+    logging.basicConfig(level=level)
+    log.debug("Debug On\n")
+
+    if args['--term'] in [None, 'current']:
+        args['--term'] = None
+
+    auth = osm.Authorisor(open(DEF_CREDS, 'r'))
+
+    important_fields = ['first_name',
+                        'last_name',
+                        'joined',
+                        'started',
+                        'date_of_birth']
+
+    def load():
+        import weekly_report
+        return weekly_report.Context(
+            Group(osm, auth, important_fields, args['--term']))
+
+    board = Dashboard(
+        load=load,
+        render=lambda context: report_pages(context, args['--term']),
+        version=lambda context: report_version(context, args['--term']),
+        live=(lambda context: audit_pages(osm, auth, context))
+        if args['--audit'] else None)
+    board.refresh_every(int(args['--refresh']) * 60)
+
+    print("Serving on http://localhost:{}/".format(args['--port']))
+    serve(board, int(args['--port']))
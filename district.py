@@ -0,0 +1,125 @@
+# coding=utf-8
+"""Run the group reports for many groups in one process.
+
+Usage:
+  district.py [-d] [--workers=<n>] [--term=<term>] <config> <outdir>
+  district.py (-h | --help)
+  district.py --version
+
+
+Options:
+  <config>        YAML file of group definitions (see district.conf).
+  <outdir>        Output directory for the reports.
+  -d,--debug      Turn on debug output.
+  --workers=<n>   Number of groups to load and report on at once [default: 4].
+  --term=<term>   Which OSM term to use [default: current].
+  -h,--help       Show this screen.
+  --version       Show version.
+
+Each group is loaded with the Accessor shared by its set of
+credentials, so groups using the same credentials share one connection
+pool, request cache and rate governor. Each group is loaded and
+reported on in its own task on a thread pool.
+
+For each group this writes <outdir>/<group>.html (the weekly_report
+group report) and <outdir>/<group> census.csv.
+"""
+
+import os.path
+import logging
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+from docopt import docopt, DocoptExit
+
+import osm
+from group import define_group
+from update import MAPPING
+import weekly_report
+
+log = logging.getLogger(__name__)
+
+
+def read_config(filename):
+    """Read YAML config file"""
+    with open(filename, 'r') as f:
+        return yaml.safe_load(f)
+
+
+class District(object):
+    """The groups defined in a config file."""
+
+    def __init__(self, config, term=None):
+        self.term = term
+        self.definitions = config['groups']
+        self.classes = {name: define_group(name, definition)
+                        for name, definition in self.definitions.items()}
+        self._authorisors = {}
+        self._lock = threading.Lock()
+
+    def authorisor(self, creds_file):
+        with self._lock:
+            if creds_file not in self._authorisors:
+                with open(creds_file, 'r') as f:
+                    self._authorisors[creds_file] = osm.Authorisor(f)
+            return self._authorisors[creds_file]
+
+    def load(self, name):
+        """Load one group (blocking)."""
+        auth = self.authorisor(self.definitions[name]['credentials'])
+        log.info("Loading {}".format(name))
+        return self.classes[name](osm, auth, MAPPING.keys(), self.term,
+                                  accessor=osm.shared_accessor(auth))
+
+
+def report(name, group, outdir, term):
+    r = weekly_report.Reporter()
+    weekly_report.group_report(r, group, weekly_report.get_quarter(),
+                               term if term is not None else "Active")
+    with open(os.path.join(outdir, "{}.html".format(name)), 'w') as f:
+        f.write(r.report())
+
+    census = group.census_by_dates([datetime.datetime.now()])
+    census.to_csv(os.path.join(outdir, "{} census.csv".format(name)),
+                  index=False)
+    log.info("Finished {}".format(name))
+
+
+def _main(config, outdir, term, workers):
+    if not os.path.isdir(outdir):
+        raise DocoptExit("{} is not a directory.".format(outdir))
+
+    district = District(read_config(config), term)
+
+    def run(name):
+        report(name, district.load(name), outdir, term)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {name: pool.submit(run, name)
+                   for name in district.definitions.keys()}
+
+    for name, future in futures.items():
+        if future.exception() is not None:
+            log.error("Failed to report on {}".format(name),
+                      exc_info=future.exception())
+
+
+if __name__ == '__main__':
+
+    args = docopt(__doc__, version='OSM 2.0')
+
+    if args['--debug']:
+        level = logging.DEBUG
+    else:
+        level = logging.WARN
+
+    logging.basicConfig(level=level)
+    log.debug("Debug On\n")
+
+    if args['--term'] in [None, 'current']:
+        args['--term'] = None
+
+    _main(args['<config>'], args['<outdir>'], args['--term'],
+          int(args['--workers']))
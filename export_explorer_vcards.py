@@ -17,7 +17,6 @@ Options:
 
 """
 
-from collections import OrderedDict
 import os.path
 import logging
 import datetime
@@ -26,38 +25,23 @@ from docopt import docopt
 import osm
 import vobject as vo
 
-from group import Group, OSM_REF_FIELD
+import district
+from group import define_group, OSM_REF_FIELD
 from update import MAPPING
 
 log = logging.getLogger(__name__)
 
 DEF_CREDS = "explorer_osm.creds"
 
+# The Explorers are defined with the other groups in district.conf.
+DEF_DISTRICT_CONF = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 "district.conf")
+EXPLORER_GROUP = "7th Lichfield Explorers"
 
-class ExplorerGroup(Group):
-    SECTIONIDS = OrderedDict((('New', '33728'),))
-    # 'Waiting List': ""}
+ExplorerGroup = define_group(
+    'ExplorerGroup',
+    district.read_config(DEF_DISTRICT_CONF)['groups'][EXPLORER_GROUP])
 
-    ADULT_SECTION = None
-    SUBS_SECTION = None
-
-    YP_SECTIONS = ['New']
-
-    SECTION_TYPE = {
-        'New': 'explorers'
-    }
-
-    # Create a reverse mapping of the Sections to their types.
-    SECTIONS_BY_TYPE = OrderedDict((
-        ('explorers', ['New']),))
-
-    MIN_AGE = {
-        'New': 15,
-    }
-
-    MAX_AGE = {
-        'New': 18,
-    }
 
 def parse_tel(number_field, default_name):
     index = 0
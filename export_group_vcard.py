@@ -23,7 +23,6 @@ import os.path
 import logging
 import itertools
 import functools
-import smtplib
 from docopt import docopt
 import osm
 import vobject as vo
@@ -32,6 +31,7 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
 from group import Group, OSM_REF_FIELD
+from mailer import Mailer
 from update import MAPPING
 
 from export_vcards import (
@@ -47,29 +47,19 @@ FROM = "Richard Taylor <r.taylor@bcs.org.uk>"
 
 
 def send(to, subject, vcards, fro=FROM):
-
-    for dest in to:
-        msg = MIMEMultipart()
-        msg['Subject'] = subject
-        msg['From'] = fro
-        msg['To'] = dest
-
-        body = MIMEText(vcards, 'vcard')
-        body.add_header('Content-Disposition', 'attachment',
-                        filename="group.vcf")
-        msg.attach(body)
-
-        hostname = 'localhost'
-
-        s = smtplib.SMTP(hostname)
-
-        try:
-            s.sendmail(fro, dest, msg.as_string())
-        except:
-            log.error(msg.as_string(),
-                      exc_info=True)
-
-        s.quit()
+    with Mailer() as mailer:
+        for dest in to:
+            msg = MIMEMultipart()
+            msg['Subject'] = subject
+            msg['From'] = fro
+            msg['To'] = dest
+
+            body = MIMEText(vcards, 'vcard')
+            body.add_header('Content-Disposition', 'attachment',
+                            filename="group.vcf")
+            msg.attach(body)
+
+            mailer.send(msg)
 
 
 def member2vcards(member, section):
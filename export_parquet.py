@@ -0,0 +1,232 @@
+# coding=utf-8
+"""Export the Group to Parquet files.
+
+Usage:
+  export_parquet.py [-d] [--term=<term>] [--workers=<n>]
+         [--payments=<start>:<end>] <apiid> <token> <outdir>
+  export_parquet.py (-h | --help)
+  export_parquet.py --version
+
+
+Options:
+  <outdir>       Output directory for the Parquet datasets.
+  -d,--debug     Turn on debug output.
+  --term=<term>  Which OSM term to use [default: current].
+  --workers=<n>  Number of sections to export at once [default: 4].
+  --payments=<start>:<end>  Also export the payments made between these
+                 dates (YYYY-MM-DD).
+  -h,--help      Show this screen.
+  --version      Show version.
+
+Each dataset is written to its own directory under <outdir>, partitioned
+by section (hive style), e.g.
+
+  <outdir>/members/section=Paget/part-0.parquet
+
+so that it can be read directly by DuckDB:
+
+  SELECT * FROM read_parquet('out/members/*/*.parquet', hive_partitioning=1)
+
+or by pandas.read_parquet('out/members'). The datasets are members (with
+the derived columns of Group.member_table()), terms, programme, events,
+attendance, movers and payments.
+
+Sections are fetched in parallel. Every partition of a dataset is then
+written with the same schema: the union of the columns of all of the
+sections, with the derived member columns typed as in
+Group.member_table() and every other (OSM record) field stored as a
+string. A section that lacks a column has nulls in it.
+"""
+
+import os
+import logging
+from io import StringIO
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from docopt import docopt
+
+import osm
+from group import Group
+
+log = logging.getLogger(__name__)
+
+DEF_CACHE = "osm.cache"
+DEF_CREDS = "osm.creds"
+
+COMPRESSION = 'zstd'
+
+
+# The types of the columns that Group.member_table() derives. All other
+# fields are stored as strings.
+DERIVED_TYPES = {
+    'members': {
+        'section_type': pa.string(),
+        'age': pa.int64(),
+        'age_exact': pa.float64(),
+        'gender': pa.string(),
+        'yp': pa.bool_(),
+        'yl': pa.bool_(),
+        'leader': pa.bool_(),
+        'scout_helper': pa.bool_(),
+        'senior_duplicate': pa.bool_(),
+    },
+}
+
+
+def dataset_schema(dataset, frames):
+    """Return the schema for a dataset made of frames (one per section).
+
+    The columns are the union of the columns of frames, in the order
+    they are first seen, less the 'section' partition column."""
+    types = DERIVED_TYPES.get(dataset, {})
+    columns = []
+    for frame in frames:
+        columns.extend(_ for _ in frame.columns
+                       if _ != 'section' and _ not in columns)
+    return pa.schema([(_, types.get(_, pa.string())) for _ in columns])
+
+
+def _as_text(value):
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        # An integer field that pandas made float because of a gap.
+        return str(int(value))
+    return str(value)
+
+
+def _arrow_table(frame, schema):
+    frame = frame.reindex(columns=schema.names)
+    for field in schema:
+        if field.type == pa.string():
+            frame[field.name] = frame[field.name].map(_as_text).astype(object)
+    return pa.Table.from_pandas(frame, schema=schema, preserve_index=False)
+
+
+def write_partition(outdir, dataset, section, frame, schema):
+    """Write one section's part of a dataset. Return the number of rows."""
+    if frame is None or not len(frame):
+        return 0
+
+    path = os.path.join(outdir, dataset, 'section={}'.format(section))
+    os.makedirs(path, exist_ok=True)
+    pq.write_table(_arrow_table(frame, schema),
+                   os.path.join(path, 'part-0.parquet'),
+                   use_dictionary=True, compression=COMPRESSION)
+    return len(frame)
+
+
+def write_datasets(outdir, frames):
+    """Write {dataset: {section: frame}}, each dataset with one schema.
+
+    Return {section: {dataset: rows}}."""
+    counts = {}
+    for dataset, sections in frames.items():
+        schema = dataset_schema(dataset, [_ for _ in sections.values()
+                                          if _ is not None])
+        for section, frame in sections.items():
+            counts.setdefault(section, {})[dataset] = write_partition(
+                outdir, dataset, section, frame, schema)
+    return counts
+
+
+def _records(objects):
+    return pd.DataFrame([_._record for _ in objects], dtype=object)
+
+
+def section_datasets(group, section, payments=None):
+    """Yield (dataset, DataFrame) for each dataset of one section."""
+    section_ = group._sections.sections[group.SECTIONIDS[section]]
+
+    table = group.member_table()
+    if len(table):
+        yield 'members', table[table['section'] == section]
+
+    yield 'terms', _records(section_.get_terms())
+
+    if section_.programme:
+        yield 'programme', _records(section_.programme.values())
+
+    yield 'events', _records(section_.events)
+
+    attendance = [pd.DataFrame(event.attendees, dtype=object).assign(
+                      eventid=event['eventid'])
+                  for event in section_.events]
+    if attendance:
+        yield 'attendance', pd.concat(attendance, ignore_index=True)
+
+    if section_.movers:
+        yield 'movers', pd.DataFrame(list(section_.movers), dtype=object)
+
+    if payments:
+        response = section_.get_payments(*payments)
+        if response is not None:
+            yield 'payments', pd.read_csv(StringIO(response.content.decode()),
+                                          dtype=str)
+
+
+def fetch_section(group, section, payments=None):
+    """Return {dataset: DataFrame} for one section."""
+    return dict(section_datasets(group, section, payments))
+
+
+def _main(osm, auth, outdir, term=None, workers=4, payments=None):
+    # update needs gspread, which writing the datasets does not.
+    from update import MAPPING
+
+    group = Group(osm, auth, MAPPING.keys(), term,
+                  accessor=osm.shared_accessor(auth))
+
+    # Build the member table once, before the sections share it.
+    group.member_table()
+
+    frames = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fetch_section, group, section, payments): section
+                   for section in group.SECTIONIDS.keys()}
+        for future in as_completed(futures):
+            section = futures[future]
+            try:
+                datasets = future.result()
+            except Exception:
+                log.error("Failed to export {}".format(section), exc_info=True)
+                continue
+            for dataset, frame in datasets.items():
+                frames.setdefault(dataset, {})[section] = frame
+
+    # Sections in group order, so that columns are too.
+    frames = {dataset: {section: sections[section]
+                        for section in group.SECTIONIDS.keys()
+                        if section in sections}
+              for dataset, sections in frames.items()}
+
+    for section, counts in write_datasets(outdir, frames).items():
+        log.info("{}: {}".format(section, ", ".join(
+            "{} {}".format(n, dataset) for dataset, n in counts.items())))
+
+
+if __name__ == '__main__':
+
+    args = docopt(__doc__, version='OSM 2.0')
+
+    if args['--debug']:
+        level = logging.DEBUG
+    else:
+        level = logging.INFO
+
+    logging.basicConfig(level=level)
+    log.debug("Debug On\n")
+
+    auth = osm.Authorisor(args['<apiid>'], args['<token>'])
+    auth.load_from_file(open(DEF_CREDS, 'r'))
+
+    if args['--term'] in [None, 'current']:
+        args['--term'] = None
+
+    payments = args['--payments'].split(':') if args['--payments'] else None
+
+    _main(osm, auth, args['<outdir>'], args['--term'],
+          int(args['--workers']), payments)
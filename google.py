@@ -102,6 +102,7 @@ class Worksheet():
         self.row_count = self.wks.row_count
         self.col_values = retry(self.sheet, self.wks, self.wks.col_values)
         self.cell = retry(self.sheet, self.wks, self.wks.cell)
+        self.range = retry(self.sheet, self.wks, self.wks.range)
         self.update_cells = retry(self.sheet, self.wks, self.wks.update_cells)
         self.update_cell = retry(self.sheet, self.wks, self.wks.update_cell)
 
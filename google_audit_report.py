@@ -26,6 +26,7 @@ import functools
 
 from docopt import docopt
 from weekly_report import Reporter
+import dashboard
 
 
 import osm
@@ -132,7 +133,8 @@ def intro(r):
     r.p("This is an automatic report ... ")
 
 
-def _main(osm, auth, sections, no_email, email, http):
+def audit_report(osm, auth, sections):
+    """Return a Reporter holding the audit report."""
     osm_adults = fetch_osm_adults(osm, auth, sections)
     users = fetch_user_report()
     osm_users_first_last = set([(_['first'], _['last']) for _ in osm_adults])
@@ -295,6 +297,12 @@ def _main(osm, auth, sections, no_email, email, http):
     r.t_end()
     r.p("")
 
+    return r
+
+
+def _main(osm, auth, sections, no_email, email, http):
+    r = audit_report(osm, auth, sections)
+
     if no_email:
         print(r.report())
     elif email:
@@ -303,31 +311,10 @@ def _main(osm, auth, sections, no_email, email, http):
                'Google Audit Report')
 
     if http:
-        print("Serving on http://localhost:8000/")
-        serve(r)
-
-
-def serve(report):
-    import http.server
-
-    # noinspection PyClassHasNoInit
-    class Handler(http.server.BaseHTTPRequestHandler):
-
-        def do_GET(self):
-            self.send_response(200)
-            self.send_header("Content-type", "text/html")
-            self.end_headers()
-            self.wfile.write(bytes(report.report(), 'UTF-8'))
-
-    server_address = ('', 8000)
-    httpd = http.server.HTTPServer(server_address, Handler)
-
-    try:
-        httpd.serve_forever()
-    except KeyboardInterrupt:
-        pass
-
-    httpd.server_close()
+        board = dashboard.Dashboard()
+        board.publish('Audit', r.report())
+        print("Serving on http://localhost:{}/".format(dashboard.PORT))
+        dashboard.serve(board)
 
 
 if __name__ == '__main__':
@@ -2,7 +2,10 @@ from datetime import datetime
 from dateutil import relativedelta
 from collections import OrderedDict
 import logging
+import numpy as np
+import pandas as pd
 import osm
+import query
 
 log = logging.getLogger(__name__)
 
@@ -10,6 +13,40 @@ log = logging.getLogger(__name__)
 # OSM_REF_FIELD = 'customisable_data.PersonalReference'
 OSM_REF_FIELD = 'member_id'
 
+# Member roles, as classified by Group.role().
+YP = 'yp'
+YOUNG_LEADER = 'yl'
+SCOUT_HELPER = 'scout_helper'
+LEADER = 'leader'
+
+CENSUS_GENDERS = ('M', 'F', 'O')
+
+
+def _gender_index(genders):
+    """Map gender strings to an index into CENSUS_GENDERS."""
+    genders = np.char.strip(np.char.lower(np.array(genders, dtype=str)))
+    return np.where(np.isin(genders, ('m', 'male')), 0,
+                    np.where(np.isin(genders, ('f', 'female')), 1, 2))
+
+
+def _patrol_exclude_list(include_yl_as_yp):
+    """The patrol names whose members are not YP (see Group._classify())."""
+    l = ['leaders', 'winter adv.']
+    if include_yl_as_yp:
+        l += ['young leaders', ]
+    return l
+
+
+def _yp_mask(age, excluded):
+    """Vectorised Group._classify(): True where the role would be YP.
+
+    age is in (fractional) years and excluded is whether the member's
+    patrol is in the exclude list."""
+    young_leader = (excluded & (15 < age) & (age < 18)) | (
+        (15.8 < age) & (age < 18))
+    scout_helper = excluded & (age <= 15)
+    return ~young_leader & ~scout_helper & ~(age > 18)
+
 
 class Member(osm.Member):
 
@@ -83,6 +120,24 @@ class Group(object):
         ('cubs', ['Maclean', 'Rowallan', 'Somers']),
         ('scouts', ['Boswell', 'Johnson', 'Erasmus'])))
 
+    # The section type that members of a junior section move up to. A
+    # member that also appears in the senior section is only counted
+    # there.
+    SENIOR_SECTION_TYPE = {
+        'Paget': 'cubs',
+        'Swinfen': 'cubs',
+        'Maclean': 'scouts',
+        'Rowallan': 'scouts',
+        'Garrick': 'scouts',
+        'Somers': 'scouts',
+    }
+
+    # The ages counted in the census for each section type.
+    CENSUS_AGES = OrderedDict((
+        ('beavers', range(5, 9)),
+        ('cubs', range(7, 11)),
+        ('scouts', range(10, 16))))
+
     MIN_AGE = {
         'Saturn': 4,
         'Swinfen': 5,
@@ -110,12 +165,17 @@ class Group(object):
     }
 
     def __init__(self, osm, auth, important_fields, term=None, on_date=None,
-                 include_yl_as_yp=True, object_types=osm.ALL_OBJECTS):
+                 include_yl_as_yp=True, object_types=osm.ALL_OBJECTS,
+                 ref_date=None, accessor=None):
         self._osm = osm
         self._important_fields = important_fields
         self._sections = self._osm.OSM(auth, self.SECTIONIDS.values(),
-                                       term, on_date, object_types=object_types)
+                                       term, on_date, object_types=object_types,
+                                       accessor=accessor)
         self.include_yl_as_yp = include_yl_as_yp
+        self.ref_date = ref_date if ref_date is not None else datetime.now()
+        self._invalidate()
+        self._build_indexes()
 
     def section_all_members(self, section):
         # If there a no members the 'members' will be an empty list
@@ -128,7 +188,9 @@ class Group(object):
             return []
 
     def all_adult_members(self):
-        return self.section_all_members('Adult')
+        if not self.ADULT_SECTION:
+            return []
+        return self.section_all_members(self.ADULT_SECTION)
 
     def all_adult_references(self):
         return [member[OSM_REF_FIELD] for member in self.all_adult_members()]
@@ -144,7 +206,9 @@ class Group(object):
                 if member[OSM_REF_FIELD].strip() == ""]
 
     def missing_adult_references(self):
-        return self._section_missing_references('Adult')
+        if not self.ADULT_SECTION:
+            return []
+        return self._section_missing_references(self.ADULT_SECTION)
 
     def all_yp_members_dict(self):
         return {s: self.section_all_members(s) for
@@ -159,21 +223,29 @@ class Group(object):
                 s in self.YP_SECTIONS}
 
     def all_yp_members_without_senior_duplicates_dict(self):
-        return {'Paget': self.remove_senior_duplicates('Paget',
-                                                       self.all_cubs()),
-                'Swinfen': self.remove_senior_duplicates('Swinfen',
-                                                         self.all_cubs()),
-                'Maclean': self.remove_senior_duplicates('Maclean',
-                                                         self.all_scouts()),
-                'Rowallan': self.remove_senior_duplicates('Rowallan',
-                                                          self.all_scouts()),
-                'Garrick': self.remove_senior_duplicates('Garrick',
-                                                         self.all_scouts()),
-                'Somers': self.remove_senior_duplicates('Somers',
-                                                        self.all_scouts()),
-                'Erasmus': self.section_yp_members_without_leaders('Erasmus'),
-                'Boswell': self.section_yp_members_without_leaders('Boswell'),
-                'Johnson': self.section_yp_members_without_leaders('Johnson')}
+        """Return {section: [members]} for each YP section with any members
+        that also appear in the senior section removed.
+
+        The result is computed once and shared by all callers (until the
+        reference date or the Young Leader setting changes) so it must not
+        be modified."""
+        return self._derived('without_senior_duplicates',
+                             self._build_without_senior_duplicates)
+
+    def _build_without_senior_duplicates(self):
+        seniors_by_type = {}
+        for section_type in set(self.SENIOR_SECTION_TYPE.values()):
+            seniors_by_type[section_type] = self._index_by_ref(
+                [member for senior in self.SECTIONS_BY_TYPE[section_type]
+                 for member in self.section_yp_members_without_leaders(senior)])
+
+        return {section: (
+            self._remove_senior_duplicates(
+                section,
+                seniors_by_type[self.SENIOR_SECTION_TYPE[section]])
+            if section in self.SENIOR_SECTION_TYPE else
+            self.section_yp_members_without_leaders(section))
+            for section in self.YP_SECTIONS}
 
     def all_yp_members_without_senior_duplicates(self):
         all_section = self.all_yp_members_without_senior_duplicates_dict()
@@ -187,17 +259,64 @@ class Group(object):
 
     def set_yl_as_yp(self, yes):
         """Include Young Leaders as Young People"""
-        self.include_yl_as_yp = yes
+        if yes != self.include_yl_as_yp:
+            self.include_yl_as_yp = yes
+            self._invalidate()
+
+    def set_ref_date(self, ref_date):
+        """Set the date used to calculate ages when classifying members."""
+        if ref_date != self.ref_date:
+            self.ref_date = ref_date
+            self._invalidate()
+
+    def _invalidate(self):
+        """Drop everything derived from the member roles."""
+        self._roles = None
+        self._views = {}
+
+    def _derived(self, name, build):
+        """Return the memoised view called name, building it if needed."""
+        if name not in self._views:
+            self._views[name] = build()
+        return self._views[name]
 
     def get_yp_patrol_exclude_list(self):
         """
         :return: The list of patrol names that should be considered as not YP.
         :rtype:
         """
-        l = ['leaders', 'winter adv.']
-        if self.include_yl_as_yp:
-            l += ['young leaders', ]
-        return l
+        return _patrol_exclude_list(self.include_yl_as_yp)
+
+    def _classify(self, member, exclude_list):
+        age = member.age(self.ref_date).days / 365
+        excluded = member['patrol'].lower() in exclude_list
+        if (excluded and 15 < age < 18) or (15.8 < age < 18):
+            return YOUNG_LEADER
+        if excluded and age <= 15:
+            return SCOUT_HELPER
+        if age > 18:
+            return LEADER
+        return YP
+
+    def role(self, member):
+        """
+        Return the role (YP, YOUNG_LEADER, SCOUT_HELPER or LEADER) of member.
+
+        The roles of all members are classified in one pass the first time
+        they are needed and cached until the reference date or the Young
+        Leader setting changes.
+        """
+        exclude_list = self.get_yp_patrol_exclude_list()
+        if self._roles is None:
+            self._roles = {}
+            for section in self.SECTIONIDS.keys():
+                for m in self.section_all_members(section):
+                    self._roles[m] = self._classify(
+                        m, exclude_list)
+
+        if member not in self._roles:
+            self._roles[member] = self._classify(member, exclude_list)
+        return self._roles[member]
 
     def is_yl(self, member):
         """
@@ -206,23 +325,16 @@ class Group(object):
         :param member:
         :return: True or False
         """
-        return ((member['patrol'].lower() in
-                 self.get_yp_patrol_exclude_list()) and
-                ((member.age().days / 365 > 15) and
-                 (member.age().days / 365 < 18)) or
-                ((member.age().days / 365 > 15.8) and
-                 (member.age().days / 365 < 18)))
+        return self.role(member) == YOUNG_LEADER
 
     def is_scout_helper(self, member):
         """
-                Try to work out if the member is a Scout helper in a junior section.
+        Try to work out if the member is a Scout helper in a junior section.
 
-                :param member:
-                :return: True or False
-                """
-        return ((member['patrol'].lower() in
-                 self.get_yp_patrol_exclude_list()) and
-                (member.age().days / 365 <= 15))
+        :param member:
+        :return: True or False
+        """
+        return self.role(member) == SCOUT_HELPER
 
     def is_leader(self, member):
         """
@@ -231,15 +343,17 @@ class Group(object):
         :param member:
         :return: True or False
         """
-        return member.age().days / 365 > 18
+        return self.role(member) == LEADER
 
     def is_yp(self, member):
-        return not (self.is_yl(member) or self.is_leader(member) or self.is_scout_helper(member))
+        return self.role(member) == YP
 
     def section_yp_members_without_leaders(self, section):
-        return [member for member in
-                self.section_all_members(section)
-                if self.is_yp(member)]
+        return self._derived(
+            ('yp', section),
+            lambda: [member for member in
+                     self.section_all_members(section)
+                     if self.is_yp(member)])
 
     def section_yl_members(self, section):
         return [member for member in
@@ -289,56 +403,68 @@ class Group(object):
             self.section_yp_members_without_leaders('Boswell') +\
             self.section_yp_members_without_leaders('Erasmus')
 
+    def _build_indexes(self):
+        """Build the member lookup indexes.
+
+        These are built once when the group is loaded so that the find_*
+        methods do not need to scan every member of every section."""
+
+        self._yp_by_scoutid = {}
+        self._yp_by_name = {}
+        self._yp_by_first_name_only = {}
+        self._sections_by_ref = {}
+
+        for section in self.YP_SECTIONS:
+            for member in self.section_all_members(section):
+                entry = (section, member)
+                self._yp_by_scoutid.setdefault(
+                    str(member['member_id']), []).append(entry)
+                first, last = self._name_key(member['first_name'],
+                                             member['last_name'])
+                self._yp_by_name.setdefault((first, last), []).append(entry)
+                self._yp_by_first_name_only.setdefault(
+                    (first.split(' ')[0], last), []).append(entry)
+
+        for section in self.SECTIONIDS.keys():
+            for reference in self.all_section_references(section):
+                sections = self._sections_by_ref.setdefault(reference, [])
+                if section not in sections:
+                    sections.append(section)
+
+    @staticmethod
+    def _name_key(firstname, lastname):
+        return firstname.lower().strip(), lastname.lower().strip()
+
+    @staticmethod
+    def _in_section(entries, section_wanted):
+        return [member for section, member in entries
+                if not section_wanted or section_wanted == section]
+
     def find_ref_in_sections(self, reference, exclude_sections=None):
         """Search for a reference in all of the sections.
 
         return a list of section names."""
 
-        matching_sections = []
-
-        for section in [_ for _ in self.SECTIONIDS.keys() if
-                _ not in (exclude_sections if exclude_sections else [])]:
-            if reference in self.all_section_references(
-                    section):
-                matching_sections.append(section)
-
-        return matching_sections
+        return [section for section in self._sections_by_ref.get(reference, [])
+                if section not in (exclude_sections if exclude_sections else [])]
 
     def find_sections_by_name(self, firstname, lastname):
         """
         Return a list of sections that contain records with matching names.
         """
-        l = []
-        sections = self.all_yp_members_dict()
-        for section in sections.keys():
-            for member in sections[section]:
-                osm_firstname = member['first_name'].lower().strip()
-                if (osm_firstname.lower().strip() ==
-                        firstname.lower().strip() and
-                    member['last_name'].lower().strip() ==
-                        lastname.lower().strip()):
-                    l.append(section)
-        return l
+        return [section for section, member in
+                self._yp_by_name.get(self._name_key(firstname, lastname), [])]
 
     def find_by_name(self, firstname, lastname, section_wanted=None,
                      ignore_second_name=False):
         """Return a list of records with matching names"""
-        l = []
-        sections = self.all_yp_members_dict()
-        for section in sections.keys():
-            if (section_wanted and section_wanted != section):
-                continue
-            for member in sections[section]:
-                osm_firstname = member['first_name'].lower().strip()
-                if ignore_second_name:
-                    osm_firstname = osm_firstname.split(' ')[0]
-                    firstname = firstname.split(' ')[0]
-                if (osm_firstname.lower().strip() ==
-                        firstname.lower().strip() and
-                    member['last_name'].lower().strip() ==
-                        lastname.lower().strip()):
-                    l.append(member)
-        return l
+        if ignore_second_name:
+            first, last = self._name_key(firstname.split(' ')[0], lastname)
+            entries = self._yp_by_first_name_only.get((first, last), [])
+        else:
+            entries = self._yp_by_name.get(
+                self._name_key(firstname, lastname), [])
+        return self._in_section(entries, section_wanted)
 
     #def find_by_ref(self, ref, section_wanted=None):
     #    """Return a list of records with matching refs"""
@@ -355,41 +481,40 @@ class Group(object):
 
     def find_by_scoutid(self, scoutid, section_wanted=None):
         """Return a list of records with matching scoutids"""
-        l = []
-        sections = self.all_yp_members_dict()
-        for section in sections.keys():
-            if (section_wanted and section_wanted != section):
-                continue
-            for member in sections[section]:
-                try:
-                    if (str(member['member_id']) == scoutid.strip()):
-                        l.append(member)
-                except:
-                    print(str(member))
-                    raise
-        return l
+        return self._in_section(
+            self._yp_by_scoutid.get(scoutid.strip(), []), section_wanted)
 
     def find_by_scoutid_without_senior_duplicates(self, scoutid, section_wanted=None):
         """Return a list of records with matching scoutids excluding senior duplicates"""
-        l = []
-        sections = self.all_yp_members_without_senior_duplicates_dict()
-        for section in sections.keys():
-            if (section_wanted and section_wanted != section):
-                continue
-            for member in sections[section]:
-                try:
-                    if (str(member['member_id']) == scoutid.strip()):
-                        l.append(member)
-                except:
-                    print(str(member))
-                    raise
-        return l
+        def build():
+            index = {}
+            sections = self.all_yp_members_without_senior_duplicates_dict()
+            for section in sections.keys():
+                for member in sections[section]:
+                    index.setdefault(
+                        str(member['member_id']), []).append((section, member))
+            return index
+
+        return self._in_section(
+            self._derived('dedup_by_scoutid', build).get(scoutid.strip(), []),
+            section_wanted)
 
     # For each section we need to look at whether a member appears in a
     # senior section too (they will if they are in the process of
     # moving). If they are in a senior section we want to favour the
     # senior records (but warn if it is different).
     def remove_senior_duplicates(self, section, senior_members):
+        return self._remove_senior_duplicates(
+            section, self._index_by_ref(senior_members))
+
+    @staticmethod
+    def _index_by_ref(members):
+        index = {}
+        for member in members:
+            index.setdefault(member[OSM_REF_FIELD], []).append(member)
+        return index
+
+    def _remove_senior_duplicates(self, section, seniors_by_ref):
         kept_members = []
         for member in self.section_yp_members_without_leaders(section):
             if member[OSM_REF_FIELD] == "":
@@ -398,10 +523,7 @@ class Group(object):
                 kept_members.append(member)
                 continue
 
-            matching_senior_members = [senior_member for senior_member
-                                       in senior_members
-                                       if senior_member[OSM_REF_FIELD] ==
-                                       member[OSM_REF_FIELD]]
+            matching_senior_members = seniors_by_ref.get(member[OSM_REF_FIELD])
             if matching_senior_members:
                 log.info("{} section: {} is in senior section - "
                          "favouring senior record".format(
@@ -445,145 +567,342 @@ class Group(object):
                     (m['floating.gender'].lower() == 'f' or m['floating.gender'].lower() == 'female')))]
 
     def census(self):
-        """Return the information required for the annual census."""
-
-        r = {'Beavers': {'M': {5: 0, 6: 0, 7: 0, 8: 0},
-                         'F': {5: 0, 6: 0, 7: 0, 8: 0},
-                         'O': {5: 0, 6: 0, 7: 0, 8: 0}
-                         },
-             'Swinfen': {'M': {5: 0, 6: 0, 7: 0, 8: 0},
-                         'F': {5: 0, 6: 0, 7: 0, 8: 0},
-                         'O': {5: 0, 6: 0, 7: 0, 8: 0}
-                         },
-             'Paget': {'M': {5: 0, 6: 0, 7: 0, 8: 0},
-                         'F': {5: 0, 6: 0, 7: 0, 8: 0},
-                         'O': {5: 0, 6: 0, 7: 0, 8: 0}
-                         },
-             'Garrick': {'M': {5: 0, 6: 0, 7: 0, 8: 0},
-                         'F': {5: 0, 6: 0, 7: 0, 8: 0},
-                         'O': {5: 0, 6: 0, 7: 0, 8: 0}
-                         },
-             'Cubs': {'M': {7: 0, 8: 0, 9: 0, 10: 0},
-                      'F': {7: 0, 8: 0, 9: 0, 10: 0},
-                      'O': {7: 0, 8: 0, 9: 0, 10: 0}},
-             'Maclean': {'M': {7: 0, 8: 0, 9: 0, 10: 0},
-                      'F': {7: 0, 8: 0, 9: 0, 10: 0},
-                      'O': {7: 0, 8: 0, 9: 0, 10: 0}},
-             'Rowallan': {'M': {7: 0, 8: 0, 9: 0, 10: 0},
-                      'F': {7: 0, 8: 0, 9: 0, 10: 0},
-                      'O': {7: 0, 8: 0, 9: 0, 10: 0}},
-             'Somers': {'M': {7: 0, 8: 0, 9: 0, 10: 0},
-                      'F': {7: 0, 8: 0, 9: 0, 10: 0},
-                      'O': {7: 0, 8: 0, 9: 0, 10: 0}},
-             'Scouts': {'M': {10: 0, 11: 0, 12: 0, 13: 0, 14: 0, 15: 0},
-                        'F': {10: 0, 11: 0, 12: 0, 13: 0, 14: 0, 15: 0},
-                        'O': {10: 0, 11: 0, 12: 0, 13: 0, 14: 0, 15: 0}},
-             'Boswell': {'M': {10: 0, 11: 0, 12: 0, 13: 0, 14: 0, 15: 0},
-                        'F': {10: 0, 11: 0, 12: 0, 13: 0, 14: 0, 15: 0},
-                        'O': {10: 0, 11: 0, 12: 0, 13: 0, 14: 0, 15: 0}},
-             'Johnson': {'M': {10: 0, 11: 0, 12: 0, 13: 0, 14: 0, 15: 0},
-                        'F': {10: 0, 11: 0, 12: 0, 13: 0, 14: 0, 15: 0},
-                        'O': {10: 0, 11: 0, 12: 0, 13: 0, 14: 0, 15: 0}},
-             'Erasmus': {'M': {10: 0, 11: 0, 12: 0, 13: 0, 14: 0, 15: 0},
-                        'F': {10: 0, 11: 0, 12: 0, 13: 0, 14: 0, 15: 0},
-                        'O': {10: 0, 11: 0, 12: 0, 13: 0, 14: 0, 15: 0}}}
-
-        for i in range(5, 9):
-            r['Beavers']['F'][i] = len(
-                [m for m in
-                 self.girls_in_section('Swinfen') +
-                 self.girls_in_section('Paget') +
-                 self.girls_in_section('Garrick')
-                 if int(m.age().days / 365) == i])
-            r['Beavers']['M'][i] = len(
-                [m for m in
-                 self.boys_in_section('Swinfen') +
-                 self.boys_in_section('Paget') +
-                 self.boys_in_section('Garrick')
-                 if int(m.age().days / 365) == i])
-            r['Beavers']['O'][i] = len(
-                [m for m in
-                 self.others_in_section('Swinfen') +
-                 self.others_in_section('Paget') +
-                 self.others_in_section('Garrick')
-                 if int(m.age().days / 365) == i])
-            for section in ['Swinfen', 'Paget', 'Garrick']:
-                r[section]['F'][i] = len(
-                    [m for m in
-                     self.girls_in_section(section)
-                     if int(m.age().days / 365) == i])
-                r[section]['M'][i] = len(
-                    [m for m in
-                     self.boys_in_section(section)
-                     if int(m.age().days / 365) == i])
-                r[section]['O'][i] = len(
-                    [m for m in
-                     self.others_in_section(section)
-                     if int(m.age().days / 365) == i])
-
-        for i in range(7, 11):
-            r['Cubs']['F'][i] = len(
-                [m for m in
-                 self.girls_in_section('Maclean') +
-                 self.girls_in_section('Rowallan') +
-                 self.girls_in_section('Somers')
-                 if int(m.age().days / 365) == i])
-            r['Cubs']['M'][i] = len(
-                [m for m in
-                 self.boys_in_section('Maclean') +
-                 self.boys_in_section('Rowallan') +
-                 self.boys_in_section('Somers')
-                 if int(m.age().days / 365) == i])
-            r['Cubs']['O'][i] = len(
-                [m for m in
-                 self.others_in_section('Maclean') +
-                 self.others_in_section('Rowallan') +
-                 self.others_in_section('Somers')
-                 if int(m.age().days / 365) == i])
-            for section in ['Maclean', 'Rowallan', 'Somers']:
-                r[section]['F'][i] = len(
-                    [m for m in
-                     self.girls_in_section(section)
-                     if int(m.age().days / 365) == i])
-                r[section]['M'][i] = len(
-                    [m for m in
-                     self.boys_in_section(section)
-                     if int(m.age().days / 365) == i])
-                r[section]['O'][i] = len(
-                    [m for m in
-                     self.others_in_section(section)
-                     if int(m.age().days / 365) == i])
-
-        for i in range(10, 16):
-            r['Scouts']['F'][i] = len(
-                [m for m in
-                 self.girls_in_section('Johnson') +
-                 self.girls_in_section('Boswell') +
-                 self.girls_in_section('Erasmus')
-                 if int(m.age().days / 365) == i])
-            r['Scouts']['M'][i] = len(
-                [m for m in
-                 self.boys_in_section('Johnson') +
-                 self.boys_in_section('Boswell') +
-                 self.boys_in_section('Erasmus')
-                 if int(m.age().days / 365) == i])
-            r['Scouts']['O'][i] = len(
-                [m for m in
-                 self.others_in_section('Johnson') +
-                 self.others_in_section('Boswell') +
-                 self.others_in_section('Erasmus')
-                 if int(m.age().days / 365) == i])
-            for section in ['Boswell', 'Johnson', 'Erasmus']:
-                r[section]['F'][i] = len(
-                    [m for m in
-                     self.girls_in_section(section)
-                     if int(m.age().days / 365) == i])
-                r[section]['M'][i] = len(
-                    [m for m in
-                     self.boys_in_section(section)
-                     if int(m.age().days / 365) == i])
-                r[section]['O'][i] = len(
-                    [m for m in
-                     self.others_in_section(section)
-                     if int(m.age().days / 365) == i])
+        """Return the information required for the annual census.
+
+        The result is a dict keyed by section name and by section type
+        ('Beavers', 'Cubs', 'Scouts') of {'M'|'F'|'O': {age: count}}.
+
+        All of the counts are made in one pass over the members (without
+        senior duplicates) by building a section x gender x age tensor
+        with numpy.bincount."""
+
+        sections = [section for section_type in self.CENSUS_AGES.keys()
+                    for section in self.SECTIONS_BY_TYPE.get(section_type, [])]
+        all_members = self.all_yp_members_without_senior_duplicates_dict()
+
+        members = [(i, member) for i, section in enumerate(sections)
+                   for member in all_members[section]]
+        section_idx = np.array([i for i, member in members], dtype=np.int64)
+        gender_idx = _gender_index(
+            [member['floating.gender'] for i, member in members])
+        ages = self._census_ages([member for i, member in members])
+
+        max_age = max(max(r) for r in self.CENSUS_AGES.values()) + 1
+        valid = (ages >= 0) & (ages < max_age)
+        flat = ((section_idx * len(CENSUS_GENDERS) + gender_idx) * max_age +
+                ages)[valid]
+        counts = np.bincount(
+            flat, minlength=len(sections) * len(CENSUS_GENDERS) * max_age
+        ).reshape(len(sections), len(CENSUS_GENDERS), max_age)
+
+        r = {}
+        for section_type, age_range in self.CENSUS_AGES.items():
+            type_sections = [sections.index(_) for _ in
+                             self.SECTIONS_BY_TYPE.get(section_type, [])]
+            for name, tensor in ([(section_type.capitalize(),
+                                   counts[type_sections].sum(axis=0))] +
+                                 [(sections[i], counts[i])
+                                  for i in type_sections]):
+                r[name] = {gender: {age: int(tensor[g][age])
+                                    for age in age_range}
+                           for g, gender in enumerate(CENSUS_GENDERS)}
         return r
+
+    def _census_ages(self, members):
+        """Return an array of ages in whole years at self.ref_date."""
+        try:
+            dobs = np.array([member['date_of_birth'] for member in members],
+                            dtype='datetime64[D]')
+            # numpy reads an empty date as NaT rather than failing.
+            if np.isnat(dobs).any():
+                raise ValueError("Missing date_of_birth")
+        except ValueError:
+            # Let Member.age() report the offending record.
+            for member in members:
+                member.age(self.ref_date)
+            raise
+        ref_date = np.datetime64(self.ref_date.date(), 'D')
+        days = (ref_date - dobs).astype(np.int64)
+        return np.trunc(days / 365).astype(np.int64)
+
+    def member_table(self):
+        """Return a pandas.DataFrame with one row per member per section.
+
+        The columns are the (flattened) member record fields plus:
+
+          section, section_type, age (whole years), age_exact,
+          gender ('m', 'f' or 'o'), yp, yl, leader, scout_helper and
+          senior_duplicate (a YP in a YP section that is counted in a
+          senior section).
+
+        The table is built once and reused until the reference date or
+        the Young Leader setting changes."""
+        return self._derived('member_table', self._build_member_table)
+
+    def _build_member_table(self):
+        kept = set(member for members in
+                   self.all_yp_members_without_senior_duplicates_dict().values()
+                   for member in members)
+        rows = []
+        for section in self.SECTIONIDS.keys():
+            for member in self.section_all_members(section):
+                row = {k: v for k, v in member._record.items()
+                       if not isinstance(v, (dict, list))}
+                age = member.age(self.ref_date).days / 365
+                role = self.role(member)
+                gender = member['floating.gender'].lower().strip()
+                row.update(
+                    section=section,
+                    section_type=self.SECTION_TYPE[section],
+                    age=int(age),
+                    age_exact=age,
+                    gender=('m' if gender in ('m', 'male') else
+                            'f' if gender in ('f', 'female') else 'o'),
+                    yp=role == YP,
+                    yl=role == YOUNG_LEADER,
+                    leader=role == LEADER,
+                    scout_helper=role == SCOUT_HELPER,
+                    senior_duplicate=(role == YP and
+                                      section in self.YP_SECTIONS and
+                                      member not in kept))
+                rows.append(row)
+        return pd.DataFrame(rows)
+
+    def census_by_dates(self, dates):
+        """Return the census counts as at each of dates as a tidy frame.
+
+        See census_by_dates() for the format. The members are classified
+        as at each date, but only the members of this Group's term are
+        known, so use HistoryStore.census_by_dates() for dates in other
+        terms."""
+        return census_by_dates(self.member_table(), dates, self,
+                               self.include_yl_as_yp)
+
+    def _yp_table(self):
+        # The rows of member_table() that census() counts.
+        table = self.member_table()
+        if len(table):
+            table = table[table['section'].isin(self.YP_SECTIONS) &
+                          table['yp'] & ~table['senior_duplicate']]
+        return table
+
+    def membership_diff(self, later, ref_date=None):
+        """Return the joiners, leavers and transfers between self and later.
+
+        later is another Group, e.g. loaded for a later term or date. See
+        membership_diff() for the format; ages are as at ref_date, which
+        defaults to self.ref_date."""
+        return membership_diff(
+            self._yp_table(), later._yp_table(),
+            self.ref_date if ref_date is None else ref_date)
+
+    def query(self, expression, fields=None):
+        """Run a query (see query.py) over member_table().
+
+        'section in <type>' matches all of the sections of that type."""
+
+        return query.run_query(
+            self.member_table(), expression, fields,
+            aliases={'section': self.SECTIONS_BY_TYPE})
+
+
+def define_group(name, definition):
+    """Return a Group subclass for a group definition read from config.
+
+    definition is a dict of the form:
+
+        {'sections': {<section name>: {'id': <OSM section id>,
+                                       'type': <section type>,
+                                       'min_age': <years>,
+                                       'max_age': <years>,
+                                       'senior': <senior section type>},
+                      ...},
+         'adult_section': <section name>,
+         'subs_section': <section name>,
+         'census_ages': {<section type>: [<min>, <max>], ...}}
+
+    Sections of type 'adult' are not YP sections. min_age, max_age and
+    senior are only needed for YP sections; adult_section, subs_section
+    and census_ages are optional."""
+
+    sections = definition['sections']
+    yp_sections = [section for section, d in sections.items()
+                   if d['type'] != 'adult']
+
+    sections_by_type = OrderedDict()
+    for section in yp_sections:
+        sections_by_type.setdefault(sections[section]['type'], []).append(section)
+
+    if 'census_ages' in definition:
+        census_ages = OrderedDict(
+            (section_type, range(ages[0], ages[1] + 1))
+            for section_type, ages in definition['census_ages'].items())
+    else:
+        census_ages = OrderedDict(
+            (section_type, ages) for section_type, ages
+            in Group.CENSUS_AGES.items() if section_type in sections_by_type)
+
+    attrs = dict(
+        SECTIONIDS=OrderedDict((section, str(d['id']))
+                               for section, d in sections.items()),
+        ADULT_SECTION=definition.get('adult_section'),
+        SUBS_SECTION=definition.get('subs_section'),
+        YP_SECTIONS=yp_sections,
+        SECTION_TYPE={section: d['type'] for section, d in sections.items()},
+        SECTIONS_BY_TYPE=sections_by_type,
+        SENIOR_SECTION_TYPE={section: sections[section]['senior']
+                             for section in yp_sections
+                             if sections[section].get('senior')},
+        CENSUS_AGES=census_ages,
+        MIN_AGE={section: sections[section]['min_age']
+                 for section in yp_sections},
+        MAX_AGE={section: sections[section]['max_age']
+                 for section in yp_sections})
+
+    return type(str(name), (Group,), attrs)
+
+
+def census_by_dates(table, dates, group=Group, include_yl_as_yp=True):
+    """Count YP by section, gender and age as at each of dates.
+
+    table has a row per member per section, e.g. from
+    Group.member_table() or HistoryStore.member_intervals(), with the
+    columns section, member_id, date_of_birth, gender and patrol and
+    optionally joined, started, end_date, valid_from and valid_to. group
+    is the Group (or Group class) whose sections are counted.
+
+    A row is counted on a date if:
+
+      it is active: the member had started (or, failing that, joined)
+      on or before the date and had not left (end_date) by then, and
+      the date is in valid_from - valid_to (valid_to is exclusive);
+
+      the member is a YP as at the date (see Group._classify());
+
+      the member is not also counted as a YP in the senior section on
+      that date.
+
+    All of the dates are computed in one vectorised pass. The result is
+    a tidy DataFrame with the columns date, section_type, section,
+    gender ('M', 'F' or 'O'), age and count, with a row for every age in
+    group.CENSUS_AGES (including zero counts)."""
+
+    census_ages = group.CENSUS_AGES
+    sections_by_type = group.SECTIONS_BY_TYPE
+    sections = [section for section_type in census_ages.keys()
+                for section in sections_by_type.get(section_type, [])]
+    dates = pd.to_datetime(pd.Series(list(dates))).dt.normalize()
+    max_age = max(max(r) for r in census_ages.values()) + 1
+
+    if len(table):
+        # The senior sections are needed to find the senior duplicates
+        # even if they are not counted themselves.
+        table = table[table['section'].isin(group.YP_SECTIONS)]
+
+    def column(name):
+        if name in table.columns:
+            return pd.to_datetime(table[name].replace('', None),
+                                  format='%Y-%m-%d', errors='coerce')
+        return pd.Series(pd.NaT, index=table.index, dtype='datetime64[ns]')
+
+    counts = np.zeros(
+        (len(dates), len(sections), len(CENSUS_GENDERS), max_age),
+        dtype=np.int64)
+
+    if len(table) and len(dates):
+        on = dates.values.astype('datetime64[D]')[:, np.newaxis]
+
+        def within(start, end):
+            start = start.values.astype('datetime64[D]')
+            end = end.values.astype('datetime64[D]')
+            return ((np.isnat(start) | (start <= on)) &
+                    (np.isnat(end) | (end > on)))
+
+        active = (within(column('started').fillna(column('joined')),
+                         column('end_date')) &
+                  within(column('valid_from'), column('valid_to')))
+
+        dob = column('date_of_birth').values.astype('datetime64[D]')
+        days = (on - dob).astype(np.int64)
+        patrols = (table['patrol'].fillna('').astype(str)
+                   if 'patrol' in table.columns else
+                   pd.Series('', index=table.index))
+        excluded = np.isin(patrols.str.lower().values,
+                           _patrol_exclude_list(include_yl_as_yp))
+        yp = active & ~np.isnat(dob) & _yp_mask(days / 365, excluded)
+
+        # A member is a senior duplicate on a date if they are a YP in a
+        # section of their senior section type on that date.
+        refs = table[OSM_REF_FIELD].fillna('').astype(str)
+        section_types = table['section'].map(group.SECTION_TYPE)
+        senior_types = table['section'].map(group.SENIOR_SECTION_TYPE)
+        codes, keys = pd.factorize(refs + '|' + section_types)
+        yp_by_key = np.zeros((len(keys), len(dates)), dtype=np.int64)
+        np.add.at(yp_by_key, codes, yp.T)
+        seniors = pd.Index(keys).get_indexer(refs + '|' + senior_types)
+        has_senior = (seniors >= 0) & (refs != '').values
+        senior_duplicate = np.zeros_like(yp)
+        senior_duplicate[:, has_senior] = yp_by_key[seniors[has_senior]].T > 0
+
+        ages = np.trunc(days / 365).astype(np.int64)
+        in_census = table['section'].isin(sections).values
+        valid = (yp & ~senior_duplicate & in_census &
+                 (ages >= 0) & (ages < max_age))
+
+        section_idx = np.array([sections.index(_) if _ in sections else 0
+                                for _ in table['section']], dtype=np.int64)
+        gender_idx = _gender_index(table['gender'].fillna('').tolist())
+        date_idx = np.arange(len(dates))[:, np.newaxis]
+        flat = (((date_idx * len(sections) + section_idx) *
+                 len(CENSUS_GENDERS) + gender_idx) * max_age + ages)[valid]
+        counts = np.bincount(flat, minlength=counts.size).reshape(counts.shape)
+
+    rows = []
+    for d, date in enumerate(dates):
+        for section_type, age_range in census_ages.items():
+            for section in sections_by_type.get(section_type, []):
+                s = sections.index(section)
+                for g, gender in enumerate(CENSUS_GENDERS):
+                    for age in age_range:
+                        rows.append((date, section_type, section, gender, age,
+                                     int(counts[d, s, g, age])))
+    return pd.DataFrame(rows, columns=['date', 'section_type', 'section',
+                                       'gender', 'age', 'count'])
+
+
+def membership_diff(old, new, ref_date):
+    """Compare two member tables keyed on member_id.
+
+    old and new are tables in the format of Group.member_table(). The
+    result has a row for each member that is only in old ('left'), only
+    in new ('joined') or in both but in a different section
+    ('transferred'). It has the columns of the member's row (from old
+    for leavers, from new otherwise) plus change, old_section,
+    new_section and age (whole years as at ref_date). Leavers come
+    first, then joiners, then transfers, each in table order."""
+
+    def keyed(table):
+        if 'member_id' not in table.columns:
+            table = pd.DataFrame(columns=['member_id', 'section',
+                                          'date_of_birth'])
+        table = table.assign(_key=table['member_id'].astype(str))
+        return table.drop_duplicates('_key')
+
+    old = keyed(old)
+    new = keyed(new)
+
+    left = old[~old['_key'].isin(new['_key'])].assign(
+        change='left', old_section=lambda t: t['section'], new_section=None)
+    joined = new[~new['_key'].isin(old['_key'])].assign(
+        change='joined', old_section=None, new_section=lambda t: t['section'])
+
+    both = new.merge(old[['_key', 'section']].rename(
+        columns={'section': 'old_section'}), on='_key')
+    transferred = both[both['section'] != both['old_section']].assign(
+        change='transferred', new_section=lambda t: t['section'])
+
+    diff = pd.concat([left, joined, transferred], ignore_index=True)
+    dob = pd.to_datetime(diff['date_of_birth'], format='%Y-%m-%d',
+                         errors='coerce')
+    diff['age'] = ((pd.Timestamp(ref_date) - dob).dt.days // 365).astype('Int64')
+    return diff.drop(columns='_key')
@@ -0,0 +1,371 @@
+# coding=utf-8
+"""Historical store of OSM membership, programme and events by term.
+
+Usage:
+  history.py [-d] [--workers=<n>] <database> backfill
+  history.py [-d] <database> terms
+  history.py (-h | --help)
+  history.py --version
+
+
+Options:
+  <database>     SQLite file holding the store.
+  -d,--debug     Turn on debug output.
+  --workers=<n>  Number of terms to fetch at once [default: 4].
+  -h,--help      Show this screen.
+  --version      Show version.
+
+'backfill' fetches every term of every section in the Group that is not
+already in the store. Terms are fetched concurrently and each one is
+committed on its own, so an interrupted backfill carries on where it
+left off when it is re-run. Terms that have not yet ended are always
+re-fetched.
+
+Once terms are in the store a Group can be loaded from it rather than
+from OSM:
+
+    store = HistoryStore('history.db')
+    group = store.group('Autumn 2016', Group, important_fields)
+"""
+
+import json
+import sqlite3
+import logging
+import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+from docopt import docopt
+
+import osm
+from group import Group, census_by_dates
+
+log = logging.getLogger(__name__)
+
+DEF_CREDS = "osm.creds"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sections (
+    section_id TEXT PRIMARY KEY,
+    record TEXT NOT NULL);
+
+CREATE TABLE IF NOT EXISTS terms (
+    section_id TEXT NOT NULL,
+    term_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    startdate TEXT NOT NULL,
+    enddate TEXT NOT NULL,
+    record TEXT NOT NULL,
+    complete INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (section_id, term_id));
+
+CREATE INDEX IF NOT EXISTS terms_name ON terms (name);
+
+CREATE TABLE IF NOT EXISTS members (
+    section_id TEXT NOT NULL,
+    term_id TEXT NOT NULL,
+    member_id TEXT NOT NULL,
+    first_name TEXT,
+    last_name TEXT,
+    date_of_birth TEXT,
+    gender TEXT,
+    patrol TEXT,
+    joined TEXT,
+    started TEXT,
+    end_date TEXT,
+    record TEXT NOT NULL,
+    PRIMARY KEY (section_id, term_id, member_id));
+
+CREATE INDEX IF NOT EXISTS members_member_id ON members (member_id);
+CREATE INDEX IF NOT EXISTS members_term ON members (term_id);
+
+CREATE TABLE IF NOT EXISTS programme (
+    section_id TEXT NOT NULL,
+    term_id TEXT NOT NULL,
+    eveningid TEXT NOT NULL,
+    meetingdate TEXT,
+    title TEXT,
+    record TEXT NOT NULL,
+    PRIMARY KEY (section_id, term_id, eveningid));
+
+CREATE TABLE IF NOT EXISTS events (
+    section_id TEXT NOT NULL,
+    term_id TEXT NOT NULL,
+    eventid TEXT NOT NULL,
+    name TEXT,
+    startdate TEXT,
+    enddate TEXT,
+    location TEXT,
+    record TEXT NOT NULL,
+    PRIMARY KEY (section_id, term_id, eventid));
+"""
+
+MEMBER_COLUMNS = ('first_name', 'last_name', 'date_of_birth',
+                  'floating.gender', 'patrol', 'joined', 'started', 'end_date')
+
+
+def _get(record, key):
+    value = record.get(key)
+    return None if value is None else str(value)
+
+
+class HistoryStore(object):
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path)
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def complete_terms(self):
+        """Return the set of (section_id, term_id) that need not be fetched."""
+        return set(self._conn.execute(
+            "SELECT section_id, term_id FROM terms WHERE complete = 1"))
+
+    def save_section(self, section):
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sections VALUES (?, ?)",
+                (str(section['section_id']),
+                 json.dumps(section._record, default=str)))
+
+    def save_term(self, section_id, term, members, programme, events):
+        """Replace everything stored for one term of one section.
+
+        members is a dict of member_id to record; programme and events
+        are lists of records."""
+        section_id = str(section_id)
+        term_id = str(term['termid'])
+        complete = term.enddate.date() < datetime.date.today()
+
+        with self._conn:
+            for table in ('members', 'programme', 'events'):
+                self._conn.execute(
+                    "DELETE FROM {} WHERE section_id = ? AND term_id = ?"
+                    .format(table), (section_id, term_id))
+
+            self._conn.executemany(
+                "INSERT INTO members VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(section_id, term_id, str(member_id)) +
+                 tuple(_get(record, key) for key in MEMBER_COLUMNS) +
+                 (json.dumps(record, default=str),)
+                 for member_id, record in members.items()])
+
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO programme VALUES (?, ?, ?, ?, ?, ?)",
+                [(section_id, term_id, _get(record, 'eveningid'),
+                  _get(record, 'meetingdate'), _get(record, 'title'),
+                  json.dumps(record, default=str))
+                 for record in programme])
+
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(section_id, term_id, _get(record, 'eventid'),
+                  _get(record, 'name'), _get(record, 'startdate'),
+                  _get(record, 'enddate'), _get(record, 'location'),
+                  json.dumps(record, default=str))
+                 for record in events])
+
+            # Written last so that a term is only marked as complete
+            # once all of its data is in the store.
+            self._conn.execute(
+                "INSERT OR REPLACE INTO terms VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (section_id, term_id, term['name'].strip(),
+                 term['startdate'], term['enddate'],
+                 json.dumps(term._record, default=str), int(complete)))
+
+    def get_terms(self, section_id):
+        """Return the stored terms of a section as osm.Term objects."""
+        return [osm.Term(None, None, json.loads(record)) for record, in
+                self._conn.execute(
+                    "SELECT record FROM terms WHERE section_id = ? "
+                    "ORDER BY startdate", (str(section_id),))]
+
+    def terms(self):
+        """Return a DataFrame of the stored terms."""
+        return pd.read_sql(
+            "SELECT section_id, term_id, name, startdate, enddate, complete "
+            "FROM terms ORDER BY startdate, section_id", self._conn)
+
+    def members(self, term_names=None):
+        """Return a DataFrame of the stored members.
+
+        There is one row per member per section per term, with the
+        columns of the members table plus the term name, startdate and
+        enddate."""
+        sql = ("SELECT m.section_id, m.term_id, t.name AS term, "
+               "t.startdate AS term_start, t.enddate AS term_end, "
+               "m.member_id, m.first_name, m.last_name, m.date_of_birth, "
+               "m.gender, m.patrol, m.joined, m.started, m.end_date "
+               "FROM members m JOIN terms t "
+               "ON m.section_id = t.section_id AND m.term_id = t.term_id")
+        params = []
+        if term_names:
+            sql += " WHERE t.name IN ({})".format(
+                ",".join("?" * len(term_names)))
+            params = [_.strip() for _ in term_names]
+        return pd.read_sql(sql, self._conn, params=params)
+
+    def member_intervals(self, group_class=Group):
+        """Return the stored members with the dates each record applies.
+
+        There is one row per member per section per term, as members(),
+        with the section named as in group_class and valid_from and
+        valid_to columns. A record applies from the start of its term
+        (or without limit for the member's first stored term in the
+        section) until the start of their next stored term in the
+        section. Their last record applies until the end of its term if
+        a later term of the section is stored (they have left), or
+        without limit if not."""
+        names = {section_id: name
+                 for name, section_id in group_class.SECTIONIDS.items()}
+        members = self.members()
+        members['section'] = members['section_id'].map(names)
+        members = members[members['section'].notna()].sort_values(
+            ['section', 'member_id', 'term_start'], kind='stable')
+
+        latest = self.terms().groupby('section_id')['startdate'].max()
+        by_member = members.groupby(['section', 'member_id'])
+        following = by_member['term_start'].shift(-1)
+        left = (pd.to_datetime(members['term_end']) +
+                pd.Timedelta(days=1)).dt.strftime('%Y-%m-%d')
+        left = left.where(
+            members['term_start'] < members['section_id'].map(latest))
+
+        members['valid_from'] = members['term_start'].where(
+            by_member.cumcount() > 0)
+        members['valid_to'] = following.fillna(left)
+        return members.reset_index(drop=True)
+
+    def census_by_dates(self, dates, group_class=Group, include_yl_as_yp=True):
+        """Return the census counts as at each of dates from the stored
+        terms (see group.census_by_dates())."""
+        return census_by_dates(self.member_intervals(group_class), dates,
+                               group_class, include_yl_as_yp)
+
+    def group(self, term, group_class=Group, important_fields=(), **kwargs):
+        """Return a group_class loaded from the store for the named term."""
+        return group_class(_StoredOSM(self), None, important_fields,
+                           term=term, **kwargs)
+
+    def _load_sections(self, sectionid_list, term, on_date):
+        sections = {}
+        for section_id, record in self._conn.execute(
+                "SELECT section_id, record FROM sections"):
+            if sectionid_list is not False and section_id not in sectionid_list:
+                continue
+
+            terms = self.get_terms(section_id)
+            if term is not None:
+                terms = [_ for _ in terms if _['name'].strip() == term.strip()]
+            elif on_date is not None:
+                terms = [_ for _ in terms if _.is_active(on_date)]
+            else:
+                terms = [_ for _ in terms if _.is_active()]
+
+            section = osm.Section(None, None, json.loads(record), init=False)
+            section.terms = terms
+            section.term = terms[-1] if terms else None
+            section.members = {}
+            if section.term is not None:
+                for member_id, member in self._conn.execute(
+                        "SELECT member_id, record FROM members "
+                        "WHERE section_id = ? AND term_id = ?",
+                        (section_id, str(section.term['termid']))):
+                    section.members[member_id] = osm.MemberClass(
+                        None, section, None, json.loads(member), [])
+            else:
+                log.warning("No stored term for section {}".format(section_id))
+            sections[section_id] = section
+        return sections
+
+
+class _StoredOSM(object):
+    """Stands in for the osm module so that Group can load from the store."""
+
+    ALL_OBJECTS = osm.ALL_OBJECTS
+
+    def __init__(self, store):
+        self._store = store
+
+    # noinspection PyPep8Naming
+    def OSM(self, authorisor, sectionid_list=False, term=None, on_date=None,
+            object_types=osm.ALL_OBJECTS, accessor=None):
+        loaded = _StoredSections()
+        loaded.sections = self._store._load_sections(
+            [str(_) for _ in sectionid_list] if sectionid_list is not False
+            else False, term, on_date)
+        return loaded
+
+
+class _StoredSections(object):
+    sections = None
+    _accessor = None
+
+
+def fetch_term(section, term):
+    """Fetch the members, programme and events of one term of a section."""
+    members = section._get_members(term)
+    programme = section._get_programme(term)
+    events = section._get_events(term)
+    return ({key: member._record for key, member in members.items()},
+            [meeting._record for meeting in programme.values()],
+            [event._record for event in events])
+
+
+def backfill(store, sections, workers):
+    """Fetch every term of every section that is not already complete."""
+    complete = store.complete_terms()
+
+    jobs = []
+    for section in sections:
+        store.save_section(section)
+        for term in section.get_terms():
+            if (str(section['section_id']), str(term['termid'])) in complete:
+                continue
+            jobs.append((section, term))
+
+    log.info("{} terms to fetch".format(len(jobs)))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fetch_term, section, term): (section, term)
+                   for section, term in jobs}
+        # Writes happen on this thread only, as each fetch completes.
+        for future in as_completed(futures):
+            section, term = futures[future]
+            try:
+                members, programme, events = future.result()
+            except Exception:
+                log.warning("Failed to fetch {} {} - will retry next time"
+                            .format(section['section_name'], term['name']),
+                            exc_info=True)
+                continue
+            store.save_term(section['section_id'], term,
+                            members, programme, events)
+            log.info("Stored {} {} ({} members)".format(
+                section['section_name'], term['name'], len(members)))
+
+
+if __name__ == '__main__':
+
+    args = docopt(__doc__, version='OSM 2.0')
+
+    if args['--debug']:
+        level = logging.DEBUG
+    else:
+        level = logging.INFO
+
+    logging.basicConfig(level=level)
+    log.debug("Debug On\n")
+
+    store = HistoryStore(args['<database>'])
+
+    if args['backfill']:
+        auth = osm.Authorisor(open(DEF_CREDS, 'r'))
+        sections = osm.OSM(auth, Group.SECTIONIDS.values(), object_types=())
+        backfill(store, sections.sections.values(), int(args['--workers']))
+    elif args['terms']:
+        print(store.terms().to_string(index=False))
+
+    store.close()
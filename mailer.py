@@ -0,0 +1,146 @@
+# coding=utf-8
+"""Delivery of the report emails.
+
+A Mailer sends messages from a bounded queue on a background thread,
+over one SMTP connection that is opened on the first message and kept
+for the whole run:
+
+    with Mailer() as mailer:
+        for dest in to:
+            mailer.send(msg)
+
+Transient failures (dropped connections and 4xx replies) are retried,
+reconnecting as needed; anything else is logged and recorded in
+Mailer.results without stopping the other messages. The SMTP server is
+taken from SMTP_HOST (default localhost) and SMTP_PORT, and the
+connection is upgraded with STARTTLS and logged in to if SMTP_USER and
+SMTP_PASSWORD are set.
+"""
+
+import os
+import time
+import queue
+import smtplib
+import logging
+import threading
+from collections import namedtuple
+
+log = logging.getLogger(__name__)
+
+SMTP_HOST = os.environ.get('SMTP_HOST', 'localhost')
+SMTP_PORT = int(os.environ.get('SMTP_PORT', 0))
+SMTP_USER = os.environ.get('SMTP_USER')
+SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD')
+
+QUEUE_SIZE = 20
+RETRIES = 3
+RETRY_DELAY = 2
+
+Result = namedtuple('Result', ['to', 'subject', 'seconds', 'attempts', 'error'])
+
+_STOP = object()
+
+
+def _transient(exc):
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return 400 <= exc.smtp_code < 500
+    return isinstance(exc, (smtplib.SMTPServerDisconnected,
+                            smtplib.SMTPConnectError,
+                            ConnectionError, TimeoutError))
+
+
+class Mailer(object):
+
+    def __init__(self, hostname=SMTP_HOST, port=SMTP_PORT, user=SMTP_USER,
+                 password=SMTP_PASSWORD, queue_size=QUEUE_SIZE,
+                 retries=RETRIES, retry_delay=RETRY_DELAY):
+        self._hostname = hostname
+        self._port = port
+        self._user = user
+        self._password = password
+        self._retries = retries
+        self._retry_delay = retry_delay
+        self._conn = None
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self.results = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def send(self, msg):
+        """Queue msg for delivery to the addresses in its To header.
+
+        Blocks while the queue is full."""
+        self._queue.put(msg)
+
+    def close(self):
+        """Wait for the queued messages to be sent and disconnect.
+
+        Return the list of Results, one per message."""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        failed = [_ for _ in self.results if _.error is not None]
+        log.info("Sent {} of {} messages in {:.2f}s".format(
+            len(self.results) - len(failed), len(self.results),
+            sum(_.seconds for _ in self.results)))
+        return self.results
+
+    def _connect(self):
+        conn = smtplib.SMTP(self._hostname, self._port)
+        if self._user:
+            conn.starttls()
+            conn.login(self._user, self._password)
+        return conn
+
+    def _disconnect(self):
+        if self._conn is not None:
+            try:
+                self._conn.quit()
+            except smtplib.SMTPException:
+                pass
+            self._conn = None
+
+    def _deliver(self, msg):
+        attempts = 0
+        start = time.time()
+        while True:
+            attempts += 1
+            try:
+                if self._conn is None:
+                    self._conn = self._connect()
+                self._conn.send_message(msg)
+                return Result(msg['To'], msg['Subject'],
+                              time.time() - start, attempts, None)
+            except (smtplib.SMTPException, OSError) as e:
+                if not _transient(e) or attempts > self._retries:
+                    return Result(msg['To'], msg['Subject'],
+                                  time.time() - start, attempts, e)
+                log.warning("Failed to send to {} ({}) - retrying".format(
+                    msg['To'], e))
+                self._disconnect()
+                time.sleep(self._retry_delay * attempts)
+
+    def _run(self):
+        while True:
+            msg = self._queue.get()
+            if msg is _STOP:
+                break
+            try:
+                result = self._deliver(msg)
+            except Exception as e:
+                # A bad message must not stop the rest being sent.
+                result = Result(msg['To'], msg['Subject'], 0, 1, e)
+            if result.error is None:
+                log.info("Sent '{}' to {} in {:.2f}s".format(
+                    result.subject, result.to, result.seconds))
+            else:
+                log.error("Failed to send '{}' to {}: {}".format(
+                    result.subject, result.to, result.error))
+            self.results.append(result)
+        self._disconnect()
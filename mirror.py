@@ -0,0 +1,315 @@
+# coding=utf-8
+"""Local SQLite mirror of the Group's OSM data.
+
+The mirror holds the sections, terms, members (with their contacts and
+custom fields), events, attendance, movers and badges of a loaded Group
+in normalised, indexed tables. It is updated with 'cli mirror' and read
+by the cli commands that take --offline, so that lookups do not need to
+reload the Group from OSM.
+
+Each update upserts the current records and removes, per section, any
+members, events or movers that are no longer there.
+"""
+
+import json
+import sqlite3
+import logging
+import datetime
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sections (
+    section_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    section_type TEXT,
+    sectionname TEXT,
+    term_id TEXT,
+    mirrored TEXT NOT NULL);
+
+CREATE TABLE IF NOT EXISTS terms (
+    section_id TEXT NOT NULL,
+    term_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    startdate TEXT,
+    enddate TEXT,
+    PRIMARY KEY (section_id, term_id));
+
+CREATE INDEX IF NOT EXISTS terms_name ON terms (name);
+
+CREATE TABLE IF NOT EXISTS members (
+    section_id TEXT NOT NULL,
+    member_id TEXT NOT NULL,
+    term_id TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    first_key TEXT,
+    last_key TEXT,
+    date_of_birth TEXT,
+    gender TEXT,
+    patrol TEXT,
+    started TEXT,
+    end_date TEXT,
+    record TEXT NOT NULL,
+    PRIMARY KEY (section_id, member_id));
+
+CREATE INDEX IF NOT EXISTS members_member_id ON members (member_id);
+CREATE INDEX IF NOT EXISTS members_name ON members (last_key, first_key);
+CREATE INDEX IF NOT EXISTS members_term ON members (term_id);
+
+CREATE TABLE IF NOT EXISTS contacts (
+    section_id TEXT NOT NULL,
+    member_id TEXT NOT NULL,
+    contact TEXT NOT NULL,
+    first_name TEXT,
+    last_name TEXT,
+    email1 TEXT,
+    email2 TEXT,
+    phone1 TEXT,
+    phone2 TEXT,
+    address1 TEXT,
+    address2 TEXT,
+    address3 TEXT,
+    postcode TEXT,
+    PRIMARY KEY (section_id, member_id, contact));
+
+CREATE INDEX IF NOT EXISTS contacts_email1 ON contacts (email1);
+CREATE INDEX IF NOT EXISTS contacts_email2 ON contacts (email2);
+
+CREATE TABLE IF NOT EXISTS custom_fields (
+    section_id TEXT NOT NULL,
+    member_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (section_id, member_id, name));
+
+CREATE TABLE IF NOT EXISTS events (
+    section_id TEXT NOT NULL,
+    eventid TEXT NOT NULL,
+    term_id TEXT,
+    name TEXT,
+    startdate TEXT,
+    enddate TEXT,
+    location TEXT,
+    record TEXT NOT NULL,
+    PRIMARY KEY (section_id, eventid));
+
+CREATE INDEX IF NOT EXISTS events_name ON events (section_id, name);
+CREATE INDEX IF NOT EXISTS events_term ON events (term_id);
+
+CREATE TABLE IF NOT EXISTS attendance (
+    section_id TEXT NOT NULL,
+    eventid TEXT NOT NULL,
+    scoutid TEXT NOT NULL,
+    attending TEXT,
+    record TEXT NOT NULL,
+    PRIMARY KEY (section_id, eventid, scoutid));
+
+CREATE INDEX IF NOT EXISTS attendance_scoutid ON attendance (scoutid);
+
+CREATE TABLE IF NOT EXISTS movers (
+    section_id TEXT NOT NULL,
+    scoutid TEXT NOT NULL,
+    record TEXT NOT NULL,
+    PRIMARY KEY (section_id, scoutid));
+
+CREATE TABLE IF NOT EXISTS badges (
+    section_id TEXT NOT NULL,
+    section_type TEXT NOT NULL,
+    term_id TEXT NOT NULL,
+    scout_id TEXT NOT NULL,
+    badges TEXT NOT NULL,
+    PRIMARY KEY (section_id, section_type, term_id, scout_id));
+
+CREATE INDEX IF NOT EXISTS badges_scout_id ON badges (scout_id);
+"""
+
+# The contact groups of a member record and the fields kept for each.
+CONTACTS = ('contact_primary_member', 'contact_primary_1', 'contact_primary_2')
+CONTACT_FIELDS = ('firstname', 'lastname', 'email1', 'email2', 'phone1',
+                  'phone2', 'address1', 'address2', 'address3', 'postcode')
+
+BADGE_SECTION_TYPES = ('beavers', 'cubs', 'scouts')
+
+
+def _str(value):
+    return None if value is None else str(value)
+
+
+def _dumps(record):
+    return json.dumps(record, default=str)
+
+
+class Mirror(object):
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def _replace(self, table, section_id, key, rows):
+        """Upsert rows and remove the section's rows that are not in them.
+
+        key is the name of the column (after section_id) that identifies
+        a row within the section."""
+        if rows:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO {} VALUES ({})".format(
+                    table, ",".join("?" * len(rows[0]))), rows)
+
+        keep = set(row[1] for row in rows)
+        stale = [(section_id, _[0]) for _ in self._conn.execute(
+            "SELECT {} FROM {} WHERE section_id = ?".format(key, table),
+            (section_id,)) if _[0] not in keep]
+        self._conn.executemany(
+            "DELETE FROM {} WHERE section_id = ? AND {} = ?".format(table, key),
+            stale)
+        return stale
+
+    def update(self, group, badges=True):
+        """Upsert everything in group into the mirror."""
+        for name, section_id in group.SECTIONIDS.items():
+            try:
+                section = group._sections.sections[section_id]
+            except KeyError:
+                log.warning("Section {} not loaded - not mirrored".format(name))
+                continue
+            with self._conn:
+                self._update_section(group, name, section, badges)
+
+    def _update_section(self, group, name, section, badges):
+        section_id = str(section['section_id'])
+        term_id = _str(section.term['termid']) if section.term else None
+
+        self._conn.execute(
+            "INSERT OR REPLACE INTO sections VALUES (?, ?, ?, ?, ?, ?)",
+            (section_id, name, group.SECTION_TYPE.get(name),
+             section['sectionname'] if 'sectionname' in section else name,
+             term_id, datetime.datetime.now().isoformat()))
+
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO terms VALUES (?, ?, ?, ?, ?)",
+            [(section_id, _str(term['termid']), term['name'],
+              term['startdate'], term['enddate'])
+             for term in getattr(section, 'terms', [])])
+
+        members = list(group.section_all_members(name))
+        rows = []
+        contacts = []
+        fields = []
+        for member in members:
+            record = member._record
+            member_id = str(member['member_id'])
+            first_key, last_key = group._name_key(member['first_name'],
+                                                  member['last_name'])
+            rows.append((section_id, member_id, term_id,
+                         member['first_name'], member['last_name'],
+                         first_key, last_key,
+                         _str(record.get('date_of_birth')),
+                         _str(record.get('floating.gender')),
+                         _str(record.get('patrol')),
+                         _str(record.get('started')),
+                         _str(record.get('end_date')),
+                         _dumps(record)))
+            for contact in CONTACTS:
+                values = [_str(record.get("{}.{}".format(contact, field)))
+                          for field in CONTACT_FIELDS]
+                if any(values):
+                    contacts.append(
+                        tuple([section_id, member_id, contact] + values))
+            fields.extend((section_id, member_id, key, _str(value))
+                          for key, value in record.items()
+                          if '.' in key and not isinstance(value, (dict, list)))
+
+        self._replace('members', section_id, 'member_id', rows)
+        # Contacts and custom fields are rewritten with their members.
+        for table in ('contacts', 'custom_fields'):
+            self._conn.execute(
+                "DELETE FROM {} WHERE section_id = ?".format(table),
+                (section_id,))
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO contacts VALUES "
+            "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", contacts)
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO custom_fields VALUES (?, ?, ?, ?)", fields)
+
+        events = list(section.events)
+        stale = self._replace('events', section_id, 'eventid', [
+            (section_id, str(event['eventid']),
+             _str(event.term['termid']) if event.term else term_id,
+             event['name'], event['startdate'], event['enddate'],
+             event['location'], _dumps(event._record))
+            for event in events])
+        self._conn.executemany(
+            "DELETE FROM attendance WHERE section_id = ? AND eventid = ?",
+            stale)
+        for event in events:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO attendance VALUES (?, ?, ?, ?, ?)",
+                [(section_id, str(event['eventid']), str(attendee['scoutid']),
+                  _str(attendee.get('attending')), _dumps(attendee))
+                 for attendee in event.attendees])
+
+        if section.movers is not None:
+            self._replace('movers', section_id, 'scoutid', [
+                (section_id, str(mover.get('scoutid')), _dumps(mover))
+                for mover in section.movers])
+
+        if badges and term_id is not None and name in group.YP_SECTIONS:
+            for section_type in BADGE_SECTION_TYPES:
+                by_member = section.badges_by_member(section_type)
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO badges VALUES (?, ?, ?, ?, ?)",
+                    [(section_id, section_type, term_id, scout_id,
+                      _dumps(member_badges))
+                     for scout_id, member_badges in by_member.items()])
+
+        log.info("Mirrored {}: {} members, {} events".format(
+            name, len(members), len(events)))
+
+    def contacts_details(self, section_ids):
+        """Return the member and contact columns used by contacts details."""
+        rows = []
+        for section_id in section_ids:
+            rows.extend(self._conn.execute(
+                "SELECT s.name AS section, m.first_name, m.last_name, "
+                "m.date_of_birth, m.gender, c1.email1, c1.address1, "
+                "c1.address2, c1.address3, c1.postcode, "
+                "c2.address1 AS address1_2 "
+                "FROM members m JOIN sections s ON s.section_id = m.section_id "
+                "LEFT JOIN contacts c1 ON c1.section_id = m.section_id "
+                "AND c1.member_id = m.member_id "
+                "AND c1.contact = 'contact_primary_1' "
+                "LEFT JOIN contacts c2 ON c2.section_id = m.section_id "
+                "AND c2.member_id = m.member_id "
+                "AND c2.contact = 'contact_primary_2' "
+                "WHERE m.section_id = ? ORDER BY m.rowid", (section_id,)))
+        return rows
+
+    def find_by_name(self, firstname, lastname, section_ids):
+        """Return the members with matching names in section_ids."""
+        first, last = firstname.lower().strip(), lastname.lower().strip()
+        return [row for row in self._conn.execute(
+            "SELECT m.*, s.name AS section, s.sectionname "
+            "FROM members m JOIN sections s ON s.section_id = m.section_id "
+            "WHERE m.last_key = ? AND m.first_key = ?", (last, first))
+            if row['section_id'] in section_ids]
+
+    def badges(self, section_id, member_id, section_type):
+        """Return the badges of a member, or None."""
+        row = self._conn.execute(
+            "SELECT b.badges FROM badges b "
+            "JOIN sections s ON s.section_id = b.section_id "
+            "AND s.term_id = b.term_id "
+            "WHERE b.section_id = ? AND b.section_type = ? AND b.scout_id = ?",
+            (section_id, section_type, member_id)).fetchone()
+        return json.loads(row['badges']) if row else None
+
+    def event(self, section_id, name):
+        """Return the named event of a section, or None."""
+        return self._conn.execute(
+            "SELECT * FROM events WHERE section_id = ? AND name = ?",
+            (section_id, name)).fetchone()
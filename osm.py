@@ -17,12 +17,14 @@ Options:
 
 """
 import enum
+import threading
 import time
 import traceback
 
 from docopt import docopt
 
 import sys
+import requests.adapters
 import requests_cache
 import requests_oauth2client as oauth2
 import logging
@@ -50,6 +52,9 @@ TZ = dateutil.tz.gettz("Europe/London")
 pyTZ = pytz.timezone('Europe/London')
 FMT = '%Y-%m-%d %H:%M:%S %Z%z'
 
+# Maximum number of requests that may be in flight at once on one Accessor.
+MAX_CONCURRENT_REQUESTS = 4
+
 
 class OSMException(Exception):
 
@@ -106,7 +111,7 @@ class OSMObject(MutableMapping):
 class Accessor(object):
     BASE_URL = "https://www.onlinescoutmanager.co.uk/"
 
-    def __init__(self, authorisor):
+    def __init__(self, authorisor, max_concurrent=MAX_CONCURRENT_REQUESTS):
         self._auth = authorisor
 
         # self.session = oauth2.requests.Session()
@@ -117,6 +122,34 @@ class Accessor(object):
             expire_after=60 * 60
         )
         self._session.auth = self._auth.auth
+        adapter = requests.adapters.HTTPAdapter(pool_connections=max_concurrent,
+                                                pool_maxsize=max_concurrent)
+        self._session.mount('https://', adapter)
+
+        # Rate governor shared by every thread using this Accessor: at
+        # most max_concurrent requests are in flight at once, and _pause()
+        # holds back all of them.
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._resume_at = 0
+
+    def _pause(self, seconds):
+        """Hold back all requests on this Accessor for seconds.
+
+        This stops every thread that uses the Accessor (all of a group's
+        sections when it is shared, see shared_accessor()), not just the
+        caller: they all draw on the same OSM rate limit."""
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.time() + seconds)
+
+    def _wait(self):
+        """Block until any pause set by _pause() has ended."""
+        while True:
+            with self._lock:
+                delay = self._resume_at - time.time()
+            if delay <= 0:
+                return
+            time.sleep(delay)
 
     def __call__(self, query, fields=None, authorising=False,
                  clear_cache=False, debug=False, result_type='json'):
@@ -141,8 +174,10 @@ class Accessor(object):
 
         retry_limit = 2
         while retry_limit > 0:
+            self._wait()
             try:
-                result = self._session.post(url, data=values)
+                with self._slots:
+                    result = self._session.post(url, data=values)
                 retry_limit -= 1
             except:
                 log.error("urlopen failed: {0}, {1}".format(
@@ -151,8 +186,9 @@ class Accessor(object):
 
             if result.status_code == 429:
                 retry_after = int(result.headers['Retry-After'])
-                log.warning(f"Exceeded OSM API limited, waiting {retry_after}s before retry ...")
-                time.sleep(retry_after)
+                log.warning(f"Exceeded OSM API limited, pausing all requests "
+                            f"for {retry_after}s before retry ...")
+                self._pause(retry_after)
                 log.warning("Retrying")
             else:
                 break
@@ -170,21 +206,24 @@ class Accessor(object):
 
         log.warning(f"Ratelimit remaining: (limit={ratelimit}, remaining={ratelimit_remaining})")
 
-        if ratelimit_remaining < (ratelimit / 100) * 50:
-            log.warning(f"Reached 50% of OSM ratelimit. "
+        # Tightest threshold first. (They used to be tested from 50% down,
+        # so the 95% wait was never reached.) At 95% every request on this
+        # Accessor waits for the reset period, not just this one.
+        if ratelimit_remaining < (ratelimit / 100) * 5:
+            log.warning(f"Reached 95% of OSM ratelimit. "
                         f"(limit={ratelimit}, remaining={ratelimit_remaining}, "
                         f"reset_period={ratelimit_reset_period}")
+            log.warning(f"Pausing all requests for reset period of "
+                        f"{ratelimit_reset_period}s...")
+            self._pause(ratelimit_reset_period + 30)
         elif ratelimit_remaining < (ratelimit / 100) * 20:
             log.warning(f"Reached 80% of OSM ratelimit. "
                         f"(limit={ratelimit}, remaining={ratelimit_remaining}, "
                         f"reset_period={ratelimit_reset_period}")
-        elif ratelimit_remaining < (ratelimit / 100) * 5:
-            log.warning(f"Reached 95% of OSM ratelimit. "
+        elif ratelimit_remaining < (ratelimit / 100) * 50:
+            log.warning(f"Reached 50% of OSM ratelimit. "
                         f"(limit={ratelimit}, remaining={ratelimit_remaining}, "
                         f"reset_period={ratelimit_reset_period}")
-            log.warning(f"Waiting for reset period of {ratelimit_reset_period}s...")
-            time.sleep(ratelimit_reset_period + 30)
-            log.warning(f"Finished waiting, carrying on.")
 
         # Crude test to see if the response is JSON
         # OSM returns a string as an error case.
@@ -206,6 +245,23 @@ class Accessor(object):
         return obj
 
 
+_accessors = {}
+_accessors_lock = threading.Lock()
+
+
+def shared_accessor(authorisor):
+    """Return the Accessor shared by everything using the same credentials.
+
+    Sharing the Accessor shares its connection pool, request cache and
+    rate governor between all of the OSM objects (and threads) that use
+    that set of credentials."""
+    key = (authorisor.client_id, authorisor.client_secret)
+    with _accessors_lock:
+        if key not in _accessors:
+            _accessors[key] = Accessor(authorisor)
+        return _accessors[key]
+
+
 class Authorisor(object):
 
     def __init__(self, creds_file=None, client_id=None, client_secret=None):
@@ -326,6 +382,23 @@ class Member(OSMObject):
         self._section = section
         self._custom = custom
 
+    def identity(self):
+        """Return (section_id, member_id), which identifies the member."""
+        section_id = (self._section['section_id']
+                      if self._section is not None else None)
+        return (str(section_id), str(self._record.get('member_id')))
+
+    # Members are the same member when they have the same identity,
+    # rather than when every field of their records is equal, so that
+    # they can be compared cheaply and kept in sets and dicts.
+    def __eq__(self, other):
+        if not isinstance(other, Member):
+            return NotImplemented
+        return self.identity() == other.identity()
+
+    def __hash__(self):
+        return hash(self.identity())
+
     def check_custom_group(self):
         '''Report any errors missing custom groups.'''
 
@@ -380,19 +453,8 @@ class Member(OSMObject):
 
     def get_badges(self, section_type):
         """Return a list of awarded badges"""
-        url = "ext/badges/badgesbyperson/?action=loadBadgesByMember&" \
-              "section={}" \
-              "&sectionid={}&term_id={}".format(
-            section_type,
-            int(self._section['section_id']),
-            self._section.term['termid'])
-
-        badge_data = self._accessor(url)
-
-        my_badges = [member for member in badge_data['data']
-                     if member['scout_id'] == self['member_id']]
-
-        return my_badges[0]['badges'] if my_badges else None
+        return self._section.badges_by_member(section_type).get(
+            str(self['member_id']))
 
     def __getattr__(self, key):
         try:
@@ -534,10 +596,11 @@ class Movers(Sequence):
 
 class Event(OSMObject):
 
-    def __init__(self, osm, section, accessor, record):
+    def __init__(self, osm, section, accessor, record, term=None):
         self._osm = osm,
         self._section = section
         self._accessor = accessor
+        self._term = term
         OSMObject.__init__(self, osm, accessor, record)
 
         self._attendees = None
@@ -598,13 +661,18 @@ class Event(OSMObject):
                                                   self._accessor)
         return self._attendees
 
+    @property
+    def term(self):
+        """The term the event was fetched for."""
+        return self._term if self._term is not None else self._section.term
+
     def _get_fieldmap(self, osm, section, accessor):
         url = "ext/events/event/?action=getStructureForEvent" \
               "&sectionid={0}" \
               "&termid={1}" \
               "&eventid={2}" \
             .format(section['section_id'],
-                    section.term['termid'],
+                    self.term['termid'],
                     self['eventid'])
 
         return accessor(url)['structure']
@@ -615,7 +683,7 @@ class Event(OSMObject):
               "&termid={1}" \
               "&eventid={2}" \
             .format(section['section_id'],
-                    section.term['termid'],
+                    self.term['termid'],
                     self['eventid'])
 
         return accessor(url)['items']
@@ -630,9 +698,9 @@ class Event(OSMObject):
 
 class Events(Sequence):
 
-    def __init__(self, osm, section, accessor, record):
+    def __init__(self, osm, section, accessor, record, term=None):
         if record:
-            self._events = [Event(osm, section, accessor, _)
+            self._events = [Event(osm, section, accessor, _, term)
                             for _ in record['items']]
         else:
             self._events = []
@@ -763,6 +831,10 @@ class Section(OSMObject):
         self.events = []
         self.users = []
         self.movers = []
+
+        self._badges_by_member = {}
+        self._badges_lock = threading.Lock()
+
         if init:
             self.init()
 
@@ -876,6 +948,30 @@ class Section(OSMObject):
             self['section_name'],
             self['section_type'])
 
+    def badges_by_member(self, section_type, term=None):
+        """Return {scout_id: [badges]} for section_type in term.
+
+        The whole section's badges are fetched with one request, which is
+        shared by all of the members of the section."""
+        term = term if term is not None else self.term
+        key = (section_type, term['termid'])
+        with self._badges_lock:
+            if key not in self._badges_by_member:
+                url = "ext/badges/badgesbyperson/?action=loadBadgesByMember&" \
+                      "section={}" \
+                      "&sectionid={}&term_id={}".format(
+                    section_type,
+                    int(self['section_id']),
+                    term['termid'])
+
+                badge_data = self._accessor(url)
+
+                badges = {}
+                for member in badge_data['data']:
+                    badges.setdefault(str(member['scout_id']), member['badges'])
+                self._badges_by_member[key] = badges
+            return self._badges_by_member[key]
+
     def _get_badges(self, badge_type):
         url = "challenges.php?action=getInitialBadges" \
               "&type={0}" \
@@ -893,15 +989,17 @@ class Section(OSMObject):
     # def events(self):
     #    pass
 
-    def _get_events(self):
+    def _get_events(self, term=None):
+        term = term if term is not None else self.term
+
         url = "ext/events/summary/?action=get" \
               "&sectionid={0}" \
               "&termid={1}" \
             .format(self['section_id'],
-                    self.term['termid'])
+                    term['termid'])
 
         return Events(self._osm, self, self._accessor,
-                      self._accessor(url))
+                      self._accessor(url), term)
 
     def _get_users(self):
         url = "ext/settings/access/?action=getUsersForSection" \
@@ -944,23 +1042,27 @@ class Section(OSMObject):
                           headers, data)
         return None
 
-    def _get_members(self):
+    def _get_members(self, term=None):
+        term = term if term is not None else self.term
+
         url = "ext/members/contact/grid/?action=getMembers" \
               "&section_id={0}" \
               "&term_id={1}" \
               "&dateFormat=uk" \
               "&section={2}" \
             .format(self['section_id'],
-                    self.term['termid'],
+                    term['termid'],
                     self['section_type'])
 
         return Members(self._osm, self, self._accessor,
                        self._accessor(url))
 
-    def _get_programme(self):
+    def _get_programme(self, term=None):
+        term = term if term is not None else self.term
+
         url = "programme.php?action=getProgrammeSummary" \
               "&sectionid={0}&termid={1}".format(self['section_id'],
-                                                 self.term['termid'])
+                                                 term['termid'])
 
         return Programme(self._osm, self, self._accessor,
                          self._accessor(url))
@@ -982,8 +1084,8 @@ class Section(OSMObject):
 class OSM(object):
 
     def __init__(self, authorisor, sectionid_list=False, term=None,
-                 on_date=None, object_types=ALL_OBJECTS):
-        self._accessor = Accessor(authorisor)
+                 on_date=None, object_types=ALL_OBJECTS, accessor=None):
+        self._accessor = accessor if accessor is not None else Accessor(authorisor)
 
         self.sections = {}
         self.section = None
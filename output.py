@@ -0,0 +1,156 @@
+# coding=utf-8
+"""Streaming output of tabular results.
+
+Rows are taken from any iterable (usually a generator) and written as
+they arrive, so long outputs start at once and are never held in memory
+as a whole. Supported formats are:
+
+  table    aligned plain text columns. The column widths and alignment
+           are fixed by the headers and the first chunk. Longer text in
+           later chunks is truncated to fit; longer numbers are written
+           in full rather than changed.
+  csv      CSV.
+  jsonl    one JSON object per row.
+  parquet  Parquet, written one row group per chunk (needs pyarrow).
+"""
+
+import sys
+import json
+import numbers
+import itertools
+from csv import writer as csv_writer
+
+FORMATS = ('table', 'csv', 'jsonl', 'parquet')
+
+CHUNK_SIZE = 500
+
+
+class OutputError(Exception):
+    pass
+
+
+def _chunks(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _text(value):
+    return '' if value is None else str(value)
+
+
+def _table_layout(headers, chunk, no_headers):
+    """Return the width of each column and whether it is right aligned.
+
+    A column is right aligned if all of its values in chunk are numbers."""
+    columns = list(zip(*chunk)) or [()] * len(headers)
+    widths = []
+    right = []
+    for heading, column in zip(headers, columns):
+        values = [_ for _ in column if _ is not None]
+        widths.append(max([len(_text(_)) for _ in values] +
+                          [0 if no_headers else len(_text(heading))]))
+        right.append(bool(values) and all(
+            isinstance(_, numbers.Number) and not isinstance(_, bool)
+            for _ in values))
+    return widths, right
+
+
+def _table_line(cells, widths, right):
+    texts = []
+    for cell, width, r in zip(cells, widths, right):
+        text = _text(cell)
+        texts.append(text.rjust(width) if r else text[:width].ljust(width))
+    return "  ".join(texts).rstrip() + "\n"
+
+
+def _write_table(out, headers, rows, no_headers, chunk_size):
+    # With no rows the headers are still written.
+    chunks = itertools.chain(_chunks(rows, chunk_size), [[]])
+    layout = None
+    for chunk in chunks:
+        if layout is None:
+            layout = _table_layout(headers, chunk, no_headers)
+            if not no_headers:
+                out.write(_table_line(headers, *layout))
+                out.write(_table_line(['-' * _ for _ in layout[0]], *layout))
+        for row in chunk:
+            out.write(_table_line(row, *layout))
+        out.flush()
+
+
+def _write_csv(out, headers, rows, no_headers, chunk_size):
+    w = csv_writer(out)
+    if not no_headers:
+        w.writerow(list(headers))
+    for chunk in _chunks(rows, chunk_size):
+        w.writerows(chunk)
+        out.flush()
+
+
+def _write_jsonl(out, headers, rows, no_headers, chunk_size):
+    for chunk in _chunks(rows, chunk_size):
+        for row in chunk:
+            record = list(row) if no_headers else dict(zip(headers, row))
+            out.write(json.dumps(record, default=str))
+            out.write("\n")
+        out.flush()
+
+
+def _write_parquet(out, headers, rows, no_headers, chunk_size):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise OutputError("parquet output needs pyarrow to be installed")
+
+    # Parquet always needs column names and a binary stream.
+    out = getattr(out, 'buffer', out)
+    headers = [str(_) for _ in headers]
+    writer = None
+    try:
+        for chunk in _chunks(rows, chunk_size):
+            columns = [[None if value is None else str(value)
+                        for value in column] for column in zip(*chunk)]
+            batch = pa.table(dict(zip(headers, columns)),
+                             schema=pa.schema([(_, pa.string())
+                                               for _ in headers]))
+            if writer is None:
+                writer = pq.ParquetWriter(out, batch.schema)
+            writer.write_table(batch)
+        if writer is None:
+            writer = pq.ParquetWriter(
+                out, pa.schema([(_, pa.string()) for _ in headers]))
+    finally:
+        if writer is not None:
+            writer.close()
+    out.flush()
+
+
+_WRITERS = {
+    'table': _write_table,
+    'csv': _write_csv,
+    'jsonl': _write_jsonl,
+    'parquet': _write_parquet,
+}
+
+
+def write_rows(headers, rows, fmt='table', no_headers=False, out=None,
+               chunk_size=CHUNK_SIZE):
+    """Write rows to out (stdout by default) in the given format."""
+    if fmt not in _WRITERS:
+        raise OutputError("Unknown format {!r}, must be one of {}".format(
+            fmt, ", ".join(FORMATS)))
+    _WRITERS[fmt](sys.stdout if out is None else out,
+                  headers, rows, no_headers, chunk_size)
+
+
+def write_frame(frame, fmt='table', no_headers=False, out=None,
+                chunk_size=CHUNK_SIZE):
+    """Write a pandas.DataFrame in the given format."""
+    write_rows(list(frame.columns),
+               (list(row) for row in frame.itertuples(index=False)),
+               fmt, no_headers, out, chunk_size)
@@ -0,0 +1,144 @@
+# coding=utf-8
+"""Data quality rules over the group member table.
+
+Each Rule is a query (see query.py) over Group.member_table() that
+matches the members breaking it, with a message for each match. The
+query is run as a vectorised mask over every section at once, so
+adding a rule adds a mask rather than another loop over the members.
+
+As well as the member table columns, the rules can use:
+
+  min_age, max_age  the age range of the member's section
+  age_in_range      age is within min_age - max_age
+  in_subs           the member is in the Subs section (always true if
+                    the group has no Subs section)
+  in_yp_section     the member is counted as a YP in a YP section
+
+and 'section in yp' / 'section in subs' match the YP / Subs sections.
+
+Only the YP of each section are checked, apart from the adult section
+in which everyone is.
+"""
+
+from collections import namedtuple
+
+import pandas as pd
+
+import query
+from group import OSM_REF_FIELD
+
+Rule = namedtuple('Rule', ['name', 'expression', 'message', 'fields'])
+
+RULES = (
+    Rule('gender',
+         "floating.gender not in (m, f, male, female)",
+         "Sex ({}) not in 'M', 'F', 'Male', 'Female'",
+         ('floating.gender',)),
+    Rule('primary_address',
+         "section in yp and contact_primary_1.address1 = ''",
+         "Primary Address missing", ()),
+    Rule('primary_phone',
+         "section in yp and "
+         "contact_primary_1.phone1 = '' and contact_primary_1.phone2 = '' and "
+         "contact_primary_2.phone1 = '' and contact_primary_2.phone2 = ''",
+         "No telephone number in primary contact 1 or 2", ()),
+    Rule('age',
+         "section in yp and not age_in_range",
+         "Age ({}) is out of range ({} - {})",
+         ('age', 'min_age', 'max_age')),
+    Rule('not_in_subs',
+         "section in yp and not in_subs",
+         "Not in Subs Section", ()),
+    Rule('not_in_yp_section',
+         "section in subs and not in_yp_section",
+         "Not in any YP section.", ()),
+    Rule('member_address',
+         "section not in (yp, subs) and contact_primary_member.address1 = ''",
+         "Member Address missing", ()),
+    Rule('member_phone',
+         "section not in (yp, subs) and "
+         "contact_primary_member.phone1 = '' and "
+         "contact_primary_member.phone2 = ''",
+         "No telephone number for member.", ()),
+)
+
+# The columns the rules may read that not every record has.
+TEXT_FIELDS = ('floating.gender',
+               'contact_primary_1.address1',
+               'contact_primary_1.phone1', 'contact_primary_1.phone2',
+               'contact_primary_2.phone1', 'contact_primary_2.phone2',
+               'contact_primary_member.address1',
+               'contact_primary_member.phone1',
+               'contact_primary_member.phone2')
+
+COLUMNS = ['section', OSM_REF_FIELD, 'first_name', 'last_name',
+           'rule', 'message']
+
+
+def checked_table(group):
+    """Return the rows of the member table that are checked, with the
+    extra columns used by the rules."""
+    members = group.member_table()
+    if not len(members):
+        return members
+
+    table = members[(members['section'] == group.ADULT_SECTION) |
+                    members['yp']].copy()
+
+    for field in TEXT_FIELDS:
+        if field not in table.columns:
+            table[field] = ''
+
+    refs = table[OSM_REF_FIELD].astype(str)
+    yp = table[table['section'].isin(group.YP_SECTIONS) &
+               ~table['senior_duplicate']]
+    table['in_yp_section'] = refs.isin(set(yp[OSM_REF_FIELD].astype(str)))
+    if group.SUBS_SECTION:
+        # Subs records are not YP, so look for them in the whole table.
+        subs = members[members['section'] == group.SUBS_SECTION]
+        table['in_subs'] = refs.isin(set(subs[OSM_REF_FIELD].astype(str)))
+    else:
+        table['in_subs'] = True
+
+    table['min_age'] = table['section'].map(group.MIN_AGE).astype('Int64')
+    table['max_age'] = table['section'].map(group.MAX_AGE).astype('Int64')
+    table['age_in_range'] = ((table['age'] >= table['min_age']) &
+                             (table['age'] <= table['max_age'])).fillna(False)
+    return table
+
+
+def violations(group, rules=RULES):
+    """Return a DataFrame with a row for each rule broken by each member.
+
+    The columns are COLUMNS. Rows are in member table order, and in
+    rule order for each member."""
+    table = checked_table(group)
+    if not len(table):
+        return pd.DataFrame(columns=COLUMNS)
+
+    aliases = {'section': {'yp': group.YP_SECTIONS,
+                           'subs': [group.SUBS_SECTION]
+                           if group.SUBS_SECTION else []}}
+    found = []
+    for order, rule in enumerate(rules):
+        broken = table[query.compile_query(rule.expression,
+                                           aliases)(table).values]
+        if not len(broken):
+            continue
+        found.append(pd.DataFrame({
+            '_row': broken.index,
+            '_order': order,
+            'section': broken['section'].values,
+            OSM_REF_FIELD: broken[OSM_REF_FIELD].values,
+            'first_name': broken['first_name'].values,
+            'last_name': broken['last_name'].values,
+            'rule': rule.name,
+            'message': [rule.message.format(*values) for values in
+                        zip(*[broken[_] for _ in rule.fields])]
+            if rule.fields else rule.message}))
+
+    if not found:
+        return pd.DataFrame(columns=COLUMNS)
+
+    return pd.concat(found, ignore_index=True).sort_values(
+        ['_row', '_order'], kind='stable')[COLUMNS].reset_index(drop=True)
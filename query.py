@@ -0,0 +1,256 @@
+# coding=utf-8
+"""Small query language over the group member table.
+
+Queries are written as boolean expressions over the columns of
+Group.member_table(), e.g.
+
+    section in cubs and age >= 10 and gender = f and not yl
+
+Supported syntax:
+
+  * comparisons: =, ==, !=, <, <=, >, >=
+  * membership: <column> in a, b, c   and   <column> not in (a, b, c)
+  * bare column names are treated as boolean columns (e.g. yl, leader)
+  * and, or, not and parentheses for grouping.
+
+Values may be numbers, bare words or quoted strings. String comparisons
+are case insensitive and ignore surrounding whitespace.
+
+An expression is compiled once into a function that takes a
+pandas.DataFrame and returns a boolean mask, so the whole table is
+filtered in a single vectorised pass.
+"""
+
+import re
+
+import pandas as pd
+
+
+class QueryError(Exception):
+    pass
+
+
+_TOKEN_RE = re.compile(r"""
+    \s*(?:
+      (?P<string>"[^"]*"|'[^']*')
+    | (?P<op><=|>=|==|!=|=|<|>)
+    | (?P<punct>[(),])
+    | (?P<word>[^\s(),<>=!"']+)
+    )""", re.VERBOSE)
+
+_KEYWORDS = ('and', 'or', 'not', 'in')
+
+
+def tokenise(text):
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        m = _TOKEN_RE.match(text, pos)
+        if not m:
+            raise QueryError("Unexpected input at {!r}".format(text[pos:]))
+        pos = m.end()
+        kind = m.lastgroup
+        value = m.group(kind)
+        if kind == 'string':
+            tokens.append(('value', value[1:-1]))
+        elif kind == 'word' and value.lower() in _KEYWORDS:
+            tokens.append((value.lower(), value))
+        else:
+            tokens.append((kind, value))
+    return tokens
+
+
+def _number(value):
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+
+
+def _as_text(series):
+    return series.fillna('').astype(str).str.strip().str.lower()
+
+
+def _compare(series, op, value):
+    number = _number(value)
+    if number is not None:
+        numeric = pd.to_numeric(series, errors='coerce')
+        if numeric.notna().any() or len(series) == 0:
+            left, right = numeric, number
+        else:
+            left, right = _as_text(series), value.strip().lower()
+    else:
+        left, right = _as_text(series), value.strip().lower()
+
+    if op in ('=', '=='):
+        return left == right
+    if op == '!=':
+        return left != right
+    if op == '<':
+        return left < right
+    if op == '<=':
+        return left <= right
+    if op == '>':
+        return left > right
+    if op == '>=':
+        return left >= right
+    raise QueryError("Unknown operator {!r}".format(op))
+
+
+class _Parser(object):
+
+    def __init__(self, tokens, aliases):
+        self._tokens = tokens
+        self._pos = 0
+        self._aliases = aliases
+
+    def peek(self):
+        return self._tokens[self._pos][0] if self._pos < len(self._tokens) else None
+
+    def take(self, kind=None):
+        if self._pos >= len(self._tokens):
+            raise QueryError("Unexpected end of query")
+        token = self._tokens[self._pos]
+        if kind is not None and token[0] != kind:
+            raise QueryError("Expected {!r} but found {!r}".format(kind, token[1]))
+        self._pos += 1
+        return token
+
+    def parse(self):
+        fn = self.or_expr()
+        if self.peek() is not None:
+            raise QueryError("Unexpected {!r}".format(self._tokens[self._pos][1]))
+        return fn
+
+    def or_expr(self):
+        fns = [self.and_expr()]
+        while self.peek() == 'or':
+            self.take()
+            fns.append(self.and_expr())
+        if len(fns) == 1:
+            return fns[0]
+        return lambda df: _reduce(fns, df, '__or__')
+
+    def and_expr(self):
+        fns = [self.not_expr()]
+        while self.peek() == 'and':
+            self.take()
+            fns.append(self.not_expr())
+        if len(fns) == 1:
+            return fns[0]
+        return lambda df: _reduce(fns, df, '__and__')
+
+    def not_expr(self):
+        if self.peek() == 'not':
+            self.take()
+            fn = self.not_expr()
+            return lambda df: ~fn(df)
+        return self.atom()
+
+    def atom(self):
+        if self.peek() == 'punct' and self._tokens[self._pos][1] == '(':
+            self.take()
+            fn = self.or_expr()
+            self._close()
+            return fn
+
+        column = self.take('word')[1]
+        kind = self.peek()
+
+        if kind == 'op':
+            op = self.take()[1]
+            value = self.value()
+            return lambda df: _compare(_column(df, column), op, value)
+
+        if kind == 'in' or (kind == 'not' and self._next_is('in')):
+            negate = kind == 'not'
+            if negate:
+                self.take()
+            self.take('in')
+            values = self._expand(column, self.value_list())
+            if negate:
+                return lambda df: ~_as_text(_column(df, column)).isin(values)
+            return lambda df: _as_text(_column(df, column)).isin(values)
+
+        # A bare column name is a boolean test.
+        return lambda df: _column(df, column).fillna(False).astype(bool)
+
+    def value(self):
+        kind, value = self.take()
+        if kind not in ('value', 'word'):
+            raise QueryError("Expected a value but found {!r}".format(value))
+        return value
+
+    def value_list(self):
+        bracketed = self.peek() == 'punct' and self._tokens[self._pos][1] == '('
+        if bracketed:
+            self.take()
+        values = [self.value()]
+        while self.peek() == 'punct' and self._tokens[self._pos][1] == ',':
+            self.take()
+            values.append(self.value())
+        if bracketed:
+            self._close()
+        return values
+
+    def _close(self):
+        token = self.take('punct')
+        if token[1] != ')':
+            raise QueryError("Expected ')' but found {!r}".format(token[1]))
+
+    def _next_is(self, kind):
+        return (self._pos + 1 < len(self._tokens) and
+                self._tokens[self._pos + 1][0] == kind)
+
+    def _expand(self, column, values):
+        aliases = self._aliases.get(column, {})
+        out = []
+        for value in values:
+            value = value.strip().lower()
+            out.extend(aliases.get(value, [value]))
+        return [_.lower() for _ in out]
+
+
+def _reduce(fns, df, op):
+    mask = fns[0](df)
+    for fn in fns[1:]:
+        mask = getattr(mask, op)(fn(df))
+    return mask
+
+
+def _column(df, column):
+    try:
+        return df[column]
+    except KeyError:
+        raise QueryError("Unknown field {!r}".format(column))
+
+
+def compile_query(expression, aliases=None):
+    """Compile expression into a function of a DataFrame returning a mask.
+
+    aliases maps a column name to a dict of {alias: [values]} used to
+    expand the right hand side of 'in' tests, e.g. to allow 'section in
+    cubs' to match each of the Cub sections."""
+
+    if expression is None or expression.strip() == '':
+        return lambda df: pd.Series(True, index=df.index)
+
+    aliases = {k: {a.lower(): v for a, v in m.items()}
+               for k, m in (aliases or {}).items()}
+    return _Parser(tokenise(expression), aliases).parse()
+
+
+def run_query(table, expression, fields=None, aliases=None):
+    """Filter table by expression and project the requested fields."""
+    mask = compile_query(expression, aliases)(table)
+    result = table[mask.values]
+    if fields:
+        missing = [_ for _ in fields if _ not in result.columns]
+        if missing:
+            raise QueryError("Unknown field(s) {}".format(", ".join(missing)))
+        result = result[list(fields)]
+    return result
@@ -0,0 +1,96 @@
+# coding=utf-8
+"""HTML rendering for the emailed and served reports.
+
+A Reporter appends each element to a buffer through a small set of
+compiled templates, so rendering is linear in the size of the report.
+Elements only carry a class: the look of the report comes from STYLE,
+which is put in the document head for the web. For email clients that
+ignore <style> blocks inline_styles() makes one pass over the body that
+inlines the style of each class and gives tables border and cellpadding
+attributes, so the cells (most of a report) need no styling of their
+own.
+"""
+
+import re
+from collections import OrderedDict
+
+# Styles by selector. Table cells are styled through their table's class.
+STYLE = OrderedDict((
+    ('hr', "color:sienna"),
+    ('h1.title', "border-bottom-style:solid;border-color:red"),
+    ('p.p', "margin-left:20px"),
+    ('table.t', "border-collapse:collapse"),
+    ('table.t th, table.t td', "border:1px solid black;padding:10px"),
+))
+
+_CSS = "\n".join("{} {{{}}}".format(selector, style)
+                 for selector, style in STYLE.items())
+
+_DOCUMENT = "<html><head><style>{}</style></head><body>\n{}\n</body></html>"
+
+_TITLE = '<h1 class="title">{}</h1>\n'.format
+_SUB_TITLE = "<h2>{}</h2>\n".format
+_P = '<p class="p">{}</p>\n'.format
+_TH = "<th>{}</th>".format
+_TD = "<td>{}</td>".format
+_LI = "<li>{}</li>".format
+
+# What each class becomes in an email.
+_INLINE = {
+    'title': ' style="{}"'.format(STYLE['h1.title']),
+    'p': ' style="{}"'.format(STYLE['p.p']),
+    't': ' border="1" cellpadding="10" style="{}"'.format(STYLE['table.t']),
+}
+
+_CLASSES = re.compile(r' class="({})"'.format("|".join(_INLINE.keys())))
+
+
+def inline_styles(html):
+    """Return html with each class replaced by the attributes that give
+    its style without a <style> block."""
+    return _CLASSES.sub(lambda m: _INLINE[m.group(1)], html)
+
+
+class Reporter(object):
+    STYLE = _CSS
+
+    def __init__(self):
+        self._parts = []
+
+    def body(self):
+        """Return the rendered elements without the document wrapper."""
+        return "".join(self._parts)
+
+    def report(self):
+        return _DOCUMENT.format(self.STYLE, self.body())
+
+    def extend(self, other):
+        """Append everything rendered by another Reporter."""
+        self._parts.extend(other._parts)
+
+    def email_report(self):
+        """Return the body with its styles inlined, for sending."""
+        return inline_styles(self.body())
+
+    def title(self, title):
+        self._parts.append(_TITLE(title))
+
+    def sub_title(self, sub_title):
+        self._parts.append(_SUB_TITLE(sub_title))
+
+    def p(self, line):
+        self._parts.append(_P(line))
+
+    def t_start(self, headings):
+        self._parts.append('<table class="t"><tr>{}</tr>\n'.format(
+            "".join(map(_TH, headings))))
+
+    def t_row(self, cells):
+        self._parts.append("<tr>{}</tr>\n".format("".join(map(_TD, cells))))
+
+    def t_end(self):
+        self._parts.append("</table>\n")
+
+    def ul(self, lines):
+        self._parts.append("<ul>\n{}</ul>\n".format(
+            "\n".join(map(_LI, lines))))
@@ -30,7 +30,6 @@ import json
 import traceback
 import logging
 import itertools
-import smtplib
 from docopt import docopt
 from datetime import date
 from datetime import datetime
@@ -44,6 +43,8 @@ from email.encoders import encode_base64
 from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 
+from mailer import Mailer
+
 log = logging.getLogger(__name__)
 
 try:
@@ -62,33 +63,24 @@ MONTH_MAP = {1: "10", 2: "11", 3: "12", 4: "01", 5: "02", 6: "03", 7: "04", 8: "
 
 
 def send(to, subject, report_path, fro=FROM):
-    for dest in to:
-        msg = MIMEMultipart()
-        msg['Subject'] = subject
-        msg['From'] = fro
-        msg['To'] = dest
-
-        fp = open(report_path, 'rb')
-        file1 = MIMEBase('application', 'vnd.ms-excel')
-        file1.set_payload(fp.read())
-        fp.close()
-        encode_base64(file1)
-        file1.add_header('Content-Disposition',
-                         'attachment;filename=output.xlsx')
-
-        msg.attach(file1)
-
-        hostname = 'localhost'
-
-        s = smtplib.SMTP(hostname)
-
-        try:
-            s.sendmail(fro, dest, msg.as_string())
-        except:
-            log.error(msg.as_string(),
-                      exc_info=True)
-
-        s.quit()
+    with Mailer() as mailer:
+        for dest in to:
+            msg = MIMEMultipart()
+            msg['Subject'] = subject
+            msg['From'] = fro
+            msg['To'] = dest
+
+            fp = open(report_path, 'rb')
+            file1 = MIMEBase('application', 'vnd.ms-excel')
+            file1.set_payload(fp.read())
+            fp.close()
+            encode_base64(file1)
+            file1.add_header('Content-Disposition',
+                             'attachment;filename=output.xlsx')
+
+            msg.attach(file1)
+
+            mailer.send(msg)
 
 
 def get_status(d):
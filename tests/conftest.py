@@ -0,0 +1,46 @@
+# coding=utf-8
+"""Shared fixtures. The modules under test are at the top of the
+repository."""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# A small group: one Beaver section that moves up to Cubs, plus adult and
+# Subs sections.
+SMALL_GROUP = {
+    'sections': {
+        'Beavers': {'id': 1, 'type': 'beavers', 'min_age': 6, 'max_age': 8,
+                    'senior': 'cubs'},
+        'Cubs': {'id': 2, 'type': 'cubs', 'min_age': 8, 'max_age': 10},
+        'Adult': {'id': 3, 'type': 'adult'},
+        'Subs': {'id': 4, 'type': 'adult'}},
+    'adult_section': 'Adult',
+    'subs_section': 'Subs',
+    'census_ages': {'beavers': [5, 8], 'cubs': [7, 10]}}
+
+
+@pytest.fixture
+def small_group():
+    """The Group class for SMALL_GROUP."""
+    from group import define_group
+    return define_group('SmallGroup', SMALL_GROUP)
+
+
+@pytest.fixture
+def table_group(small_group):
+    """Return a function that makes a small_group whose member table is
+    the given DataFrame rather than read from OSM."""
+
+    class TableGroup(small_group):
+
+        def __init__(self, table):
+            self._table = table
+
+        def member_table(self):
+            return self._table
+
+    return TableGroup
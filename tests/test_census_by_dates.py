@@ -0,0 +1,104 @@
+# coding=utf-8
+import pandas as pd
+import pytest
+
+from group import census_by_dates
+
+COLUMNS = ['section', 'member_id', 'date_of_birth', 'gender', 'patrol',
+           'joined', 'started', 'end_date']
+
+DATES = ['2020-01-01', '2021-01-01']
+
+
+@pytest.fixture
+def census(small_group):
+    def census(rows, dates=DATES):
+        return census_by_dates(pd.DataFrame(rows, columns=COLUMNS), dates,
+                               small_group)
+    return census
+
+
+def counted(result):
+    """The non-zero counts as {(date, section, gender, age): count}."""
+    result = result[result['count'] > 0]
+    return {(str(date.date()), section, gender, age): count
+            for date, section, gender, age, count in zip(
+                result['date'], result['section'], result['gender'],
+                result['age'], result['count'])}
+
+
+def test_ages_are_as_at_each_date(census):
+    result = census([('Beavers', 1, '2013-06-01', 'm', '', '', '2019-01-01', '')])
+    assert counted(result) == {('2020-01-01', 'Beavers', 'M', 6): 1,
+                               ('2021-01-01', 'Beavers', 'M', 7): 1}
+
+
+def test_genders(census):
+    result = census([
+        ('Cubs', 1, '2011-03-01', 'Female', '', '', '2019-01-01', ''),
+        ('Cubs', 2, '2011-03-01', 'other', '', '', '2019-01-01', ''),
+        ('Cubs', 3, '2011-03-01', '', '', '', '2019-01-01', '')], DATES[:1])
+    assert counted(result) == {('2020-01-01', 'Cubs', 'F', 8): 1,
+                               ('2020-01-01', 'Cubs', 'O', 8): 2}
+
+
+def test_members_are_counted_between_starting_and_leaving(census):
+    result = census([
+        # Left in 2020.
+        ('Cubs', 1, '2011-03-01', 'f', '', '', '2019-01-01', '2020-06-01'),
+        # No start date, so counted from joining.
+        ('Cubs', 2, '2011-03-01', 'f', '', '2020-06-01', '', ''),
+        # Starts after both dates.
+        ('Cubs', 3, '2011-03-01', 'f', '', '', '2021-06-01', '')])
+    assert counted(result) == {('2020-01-01', 'Cubs', 'F', 8): 1,
+                               ('2021-01-01', 'Cubs', 'F', 9): 1}
+
+
+def test_senior_duplicates_are_counted_in_the_senior_section(census):
+    result = census([
+        ('Beavers', 1, '2012-06-01', 'f', '', '', '2019-01-01', ''),
+        ('Cubs', 1, '2012-06-01', 'f', '', '', '2020-06-01', '')])
+    assert counted(result) == {('2020-01-01', 'Beavers', 'F', 7): 1,
+                               ('2021-01-01', 'Cubs', 'F', 8): 1}
+
+
+def test_only_yp_are_counted(census):
+    result = census([
+        # Patrol excludes them, so they are a scout helper.
+        ('Cubs', 1, '2011-03-01', 'm', 'Leaders', '', '2019-01-01', ''),
+        # No date of birth.
+        ('Cubs', 2, '', 'm', '', '', '2019-01-01', ''),
+        # Not a YP section.
+        ('Adult', 3, '2011-03-01', 'm', '', '', '2019-01-01', '')])
+    assert counted(result) == {}
+
+
+def test_valid_from_and_to_limit_each_row(small_group):
+    table = pd.DataFrame(
+        [('Beavers', 1, '2013-06-01', 'm', '', '', '2019-01-01', ''),
+         ('Beavers', 1, '2013-06-01', 'm', 'Leaders', '', '2019-01-01', '')],
+        columns=COLUMNS)
+    table['valid_from'] = [None, '2020-06-01']
+    table['valid_to'] = ['2020-06-01', None]
+    result = census_by_dates(table, DATES, small_group)
+    assert counted(result) == {('2020-01-01', 'Beavers', 'M', 6): 1}
+
+
+def test_every_census_age_has_a_row(census):
+    result = census([], DATES[:1])
+    assert list(result.columns) == ['date', 'section_type', 'section',
+                                    'gender', 'age', 'count']
+    # beavers 5 - 8 and cubs 7 - 10, for each gender.
+    assert len(result) == (4 + 4) * 3
+    assert result['count'].sum() == 0
+
+
+@pytest.mark.parametrize('date', DATES)
+def test_matches_one_date_at_a_time(date, census):
+    rows = [('Beavers', 1, '2013-06-01', 'm', '', '', '2019-01-01', ''),
+            ('Beavers', 2, '2012-06-01', 'f', '', '', '2019-01-01', ''),
+            ('Cubs', 2, '2012-06-01', 'f', '', '', '2020-06-01', ''),
+            ('Cubs', 3, '2011-03-01', 'f', '', '', '2019-01-01', '2020-06-01')]
+    both = census(rows)
+    one = census(rows, [date])
+    assert counted(both[both['date'] == date]) == counted(one)
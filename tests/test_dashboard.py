@@ -0,0 +1,34 @@
+# coding=utf-8
+from collections import OrderedDict
+
+import dashboard
+
+
+def test_live_pages_are_rendered_on_every_refresh():
+    data = {'version': 1}
+    rendered = []
+
+    def render(data):
+        rendered.append(data['version'])
+        return OrderedDict([('Group', 'group {}'.format(data['version']))])
+
+    audits = []
+
+    def live(data):
+        audits.append(1)
+        return OrderedDict([('Audit', 'audit {}'.format(len(audits)))])
+
+    board = dashboard.Dashboard(load=lambda: data, render=render,
+                                version=lambda data: data['version'],
+                                live=live)
+    board.refresh()
+    board.refresh()
+    assert rendered == [1]
+    assert board.page('Audit').html == b'audit 2'
+
+    data['version'] = 2
+    board.refresh()
+    assert rendered == [1, 2]
+    assert board.page('Group').html == b'group 2'
+    assert board.page('Audit').html == b'audit 3'
+    assert board.names() == ['Group', 'Audit']
@@ -0,0 +1,78 @@
+# coding=utf-8
+import pandas as pd
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+ds = pytest.importorskip('pyarrow.dataset')
+pq = pytest.importorskip('pyarrow.parquet')
+
+import export_parquet
+
+
+def members(section, rows, **custom):
+    frame = pd.DataFrame({
+        'member_id': [_[0] for _ in rows],
+        'first_name': [_[1] for _ in rows],
+        'section': section,
+        'age': [_[2] for _ in rows],
+        'age_exact': [_[2] + 0.5 for _ in rows],
+        'yp': True})
+    for column, values in custom.items():
+        frame[column] = values
+    return frame
+
+
+@pytest.fixture
+def frames():
+    return {'members': {
+        # A custom field that is a number in one section only, with a gap.
+        'Beavers': members('Beavers', [(1, 'Ann', 6), (2, 'Bob', 7)],
+                           **{'customisable_data.cf_1': [3, None],
+                              'customisable_data.cf_2': [None, None]}),
+        # A custom field that only this section has.
+        'Cubs': members('Cubs', [(3, 'Cat', 9)],
+                        **{'customisable_data.cf_1': ['x'],
+                           'customisable_data.cf_3': ['y']})}}
+
+
+def test_every_partition_has_one_schema(tmp_path, frames):
+    counts = export_parquet.write_datasets(str(tmp_path), frames)
+    assert counts == {'Beavers': {'members': 2}, 'Cubs': {'members': 1}}
+
+    schemas = [pq.read_schema(str(_)) for _ in
+               sorted((tmp_path / 'members').glob('section=*/*.parquet'))]
+    assert len(schemas) == 2
+    assert schemas[0].equals(schemas[1], check_metadata=False)
+    assert schemas[0].names == ['member_id', 'first_name', 'age', 'age_exact',
+                                'yp', 'customisable_data.cf_1',
+                                'customisable_data.cf_2',
+                                'customisable_data.cf_3']
+
+
+def test_the_dataset_reads_back(tmp_path, frames):
+    export_parquet.write_datasets(str(tmp_path), frames)
+
+    table = ds.dataset(str(tmp_path / 'members'),
+                       partitioning='hive').to_table()
+    assert table.schema.field('age').type == pa.int64()
+    assert table.schema.field('age_exact').type == pa.float64()
+    assert table.schema.field('yp').type == pa.bool_()
+    assert table.schema.field('customisable_data.cf_2').type == pa.string()
+
+    values = pq.read_table(str(tmp_path / 'members')).sort_by(
+        'member_id').to_pydict()
+    assert [str(_) for _ in values['section']] == ['Beavers', 'Beavers', 'Cubs']
+    assert values['member_id'] == ['1', '2', '3']
+    assert values['customisable_data.cf_1'] == ['3', None, 'x']
+    assert values['customisable_data.cf_2'] == [None, None, None]
+    assert values['customisable_data.cf_3'] == [None, None, 'y']
+
+
+def test_empty_sections_are_not_written(tmp_path):
+    frames = {'terms': {'Beavers': pd.DataFrame({'termid': ['1']}),
+                        'Cubs': pd.DataFrame(columns=['termid']),
+                        'Scouts': None}}
+    counts = export_parquet.write_datasets(str(tmp_path), frames)
+    assert counts == {'Beavers': {'terms': 1}, 'Cubs': {'terms': 0},
+                      'Scouts': {'terms': 0}}
+    assert [_.name for _ in (tmp_path / 'terms').iterdir()] == ['section=Beavers']
@@ -0,0 +1,73 @@
+# coding=utf-8
+import pandas as pd
+
+from group import membership_diff
+
+COLUMNS = ['member_id', 'first_name', 'section', 'date_of_birth']
+
+
+def table(rows):
+    return pd.DataFrame(rows, columns=COLUMNS)
+
+
+OLD = table([(1, 'Ann', 'Paget', '2013-06-01'),
+             (2, 'Bob', 'Paget', '2013-01-01'),
+             (4, 'Dan', 'Paget', '2012-02-01'),
+             (5, 'Eve', 'Maclean', '2011-01-01')])
+
+NEW = table([(1, 'Ann', 'Paget', '2013-06-01'),
+             (3, 'Cat', 'Swinfen', '2014-09-01'),
+             (4, 'Dan', 'Maclean', '2012-02-01'),
+             (5, 'Eve', 'Maclean', '2011-01-01')])
+
+
+def changes(diff):
+    return list(zip(diff['member_id'], diff['change'],
+                    diff['old_section'], diff['new_section']))
+
+
+def test_joiners_leavers_and_transfers():
+    diff = membership_diff(OLD, NEW, '2020-01-01')
+    # Leavers, then joiners, then transfers.
+    assert changes(diff) == [(2, 'left', 'Paget', None),
+                             (3, 'joined', None, 'Swinfen'),
+                             (4, 'transferred', 'Paget', 'Maclean')]
+
+
+def test_rows_come_from_the_right_table():
+    old = OLD.assign(first_name=['Ann', 'Bob', 'Dan (old)', 'Eve'])
+    new = NEW.assign(first_name=['Ann', 'Cat', 'Dan (new)', 'Eve'])
+    diff = membership_diff(old, new, '2020-01-01')
+    assert list(diff['first_name']) == ['Bob', 'Cat', 'Dan (new)']
+    assert list(diff['section']) == ['Paget', 'Swinfen', 'Maclean']
+
+
+def test_ages_are_whole_years_at_ref_date():
+    diff = membership_diff(OLD, NEW, '2020-01-01')
+    assert list(diff['age']) == [7, 5, 7]
+    diff = membership_diff(OLD, NEW, '2021-01-01')
+    assert list(diff['age']) == [8, 6, 8]
+
+
+def test_missing_date_of_birth_has_no_age():
+    new = NEW.assign(date_of_birth=['2013-06-01', '', '2012-02-01', '2011-01-01'])
+    diff = membership_diff(OLD, new, '2020-01-01')
+    assert diff['age'].isna().tolist() == [False, True, False]
+
+
+def test_member_ids_match_as_text():
+    new = NEW.assign(member_id=NEW['member_id'].astype(str))
+    diff = membership_diff(OLD, new, '2020-01-01')
+    assert list(diff['change']) == ['left', 'joined', 'transferred']
+
+
+def test_no_changes():
+    diff = membership_diff(OLD, OLD.copy(), '2020-01-01')
+    assert len(diff) == 0
+
+
+def test_empty_tables():
+    diff = membership_diff(pd.DataFrame(), NEW, '2020-01-01')
+    assert list(diff['change']) == ['joined'] * 4
+    diff = membership_diff(OLD, pd.DataFrame(), '2020-01-01')
+    assert list(diff['change']) == ['left'] * 4
@@ -0,0 +1,120 @@
+# coding=utf-8
+import logging
+import threading
+import time
+
+import pytest
+
+import osm
+
+
+class Response(object):
+
+    def __init__(self, status_code=200, remaining=100, reset=60, **headers):
+        self.status_code = status_code
+        self.headers = dict({'x-ratelimit-limit': '100',
+                             'x-ratelimit-remaining': str(remaining),
+                             'x-ratelimit-reset': str(reset)}, **headers)
+
+    def json(self):
+        return {}
+
+
+class Session(object):
+    """Stands in for the requests_cache session, returning responses in
+    turn and noting how many requests are in flight at once."""
+
+    def __init__(self, *args, **kwargs):
+        self.responses = []
+        self.in_flight = 0
+        self.most_in_flight = 0
+        self.posted_at = []
+        self.delay = 0
+        self._lock = threading.Lock()
+
+    def mount(self, prefix, adapter):
+        pass
+
+    def post(self, url, data=None):
+        with self._lock:
+            self.in_flight += 1
+            self.most_in_flight = max(self.most_in_flight, self.in_flight)
+            self.posted_at.append(osm.time.time())
+        time.sleep(self.delay)
+        with self._lock:
+            self.in_flight -= 1
+            return self.responses.pop(0) if self.responses else Response()
+
+
+class Clock(object):
+    """A clock whose sleep() moves time on rather than waiting."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class Authorisor(object):
+    auth = None
+
+
+@pytest.fixture
+def accessor(monkeypatch):
+    monkeypatch.setattr(osm.requests_cache, 'CachedSession', Session)
+    return osm.Accessor(Authorisor(), max_concurrent=2)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(osm, 'time', clock)
+    return clock
+
+
+def test_requests_in_flight_are_limited(accessor):
+    accessor._session.delay = 0.05
+    threads = [threading.Thread(target=accessor, args=('q',))
+               for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert accessor._session.most_in_flight == 2
+
+
+def test_nearing_the_rate_limit_pauses_every_request(accessor, clock, caplog):
+    accessor._session.responses = [Response(remaining=4, reset=60)]
+    with caplog.at_level(logging.WARNING, logger='osm'):
+        accessor('q')
+    assert clock.sleeps == []
+    assert "Pausing all requests" in caplog.text
+
+    # The next request, from any thread, waits out the reset period.
+    thread = threading.Thread(target=accessor, args=('q',))
+    thread.start()
+    thread.join()
+    assert clock.sleeps == [90]
+    assert accessor._session.posted_at == [1000, 1090]
+
+
+@pytest.mark.parametrize('remaining', [5, 19, 49, 100])
+def test_other_thresholds_do_not_pause(accessor, clock, remaining):
+    accessor._session.responses = [Response(remaining=remaining)]
+    accessor('q')
+    accessor('q')
+    assert clock.sleeps == []
+
+
+def test_too_many_requests_is_retried_after_a_pause(accessor, clock):
+    accessor._session.responses = [Response(429, **{'Retry-After': '5'}),
+                                   Response()]
+    assert accessor('q') == {}
+    assert clock.sleeps == [5]
+    assert accessor._session.posted_at == [1000, 1005]
@@ -0,0 +1,111 @@
+# coding=utf-8
+import io
+import json
+
+import pandas as pd
+import pytest
+
+import output
+
+HEADERS = ['name', 'age']
+ROWS = [('Ann', 6), ('Bob', 10), ('Cat', None)]
+
+
+def written(fmt, rows=ROWS, no_headers=False, chunk_size=output.CHUNK_SIZE):
+    out = io.StringIO()
+    output.write_rows(HEADERS, iter(rows), fmt, no_headers, out, chunk_size)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'jsonl'])
+def test_chunk_size_does_not_change_the_output(fmt):
+    assert written(fmt, chunk_size=1) == written(fmt, chunk_size=2) == written(fmt)
+
+
+@pytest.mark.parametrize('fmt', ['table', 'csv', 'jsonl'])
+def test_rows_are_written_before_the_input_is_read(fmt):
+    out = io.StringIO()
+    seen = []
+
+    def rows():
+        for n in range(10):
+            # What had been written when row n was asked for.
+            seen.append(out.getvalue().count("Ann"))
+            yield ('Ann', n)
+
+    output.write_rows(HEADERS, rows(), fmt, out=out, chunk_size=3)
+    assert seen == [0, 0, 0, 3, 3, 3, 6, 6, 6, 9]
+
+
+def test_table():
+    assert written('table') == ("name  age\n"
+                                "----  ---\n"
+                                "Ann     6\n"
+                                "Bob    10\n"
+                                "Cat\n")
+
+
+def test_table_without_headers():
+    assert written('table', no_headers=True) == "Ann   6\nBob  10\nCat\n"
+
+
+def test_table_layout_is_set_by_the_first_chunk():
+    rows = [('Ann', 6), ('Bob', 10), ('Dorothy', 1234)]
+    # Text is cut to fit; numbers are never changed.
+    assert written('table', rows, chunk_size=2) == ("name  age\n"
+                                                    "----  ---\n"
+                                                    "Ann     6\n"
+                                                    "Bob    10\n"
+                                                    "Doro  1234\n")
+    assert written('table', rows, chunk_size=3).splitlines()[-1] == "Dorothy  1234"
+
+
+def test_csv():
+    assert written('csv') == "name,age\r\nAnn,6\r\nBob,10\r\nCat,\r\n"
+    assert written('csv', no_headers=True) == "Ann,6\r\nBob,10\r\nCat,\r\n"
+
+
+def test_jsonl():
+    assert [json.loads(_) for _ in written('jsonl').splitlines()] == [
+        {'name': 'Ann', 'age': 6}, {'name': 'Bob', 'age': 10},
+        {'name': 'Cat', 'age': None}]
+    assert [json.loads(_) for _ in written('jsonl', no_headers=True).splitlines()] == [
+        ['Ann', 6], ['Bob', 10], ['Cat', None]]
+
+
+def test_no_rows():
+    assert written('csv', rows=[]) == "name,age\r\n"
+    assert written('jsonl', rows=[]) == ""
+    assert written('table', rows=[]) == "name  age\n----  ---\n"
+    assert written('table', rows=[], no_headers=True) == ""
+
+
+def test_parquet():
+    pq = pytest.importorskip('pyarrow.parquet')
+    out = io.BytesIO()
+    output.write_rows(HEADERS, iter(ROWS), 'parquet', out=out, chunk_size=2)
+    out.seek(0)
+    table = pq.read_table(out)
+    assert table.column_names == HEADERS
+    assert table.to_pydict() == {'name': ['Ann', 'Bob', 'Cat'],
+                                 'age': ['6', '10', None]}
+
+
+def test_parquet_with_no_rows_has_the_columns():
+    pq = pytest.importorskip('pyarrow.parquet')
+    out = io.BytesIO()
+    output.write_rows(HEADERS, iter([]), 'parquet', out=out)
+    out.seek(0)
+    assert pq.read_table(out).column_names == HEADERS
+
+
+def test_unknown_format():
+    with pytest.raises(output.OutputError):
+        written('xml')
+
+
+def test_write_frame():
+    frame = pd.DataFrame(ROWS[:2], columns=HEADERS)
+    out = io.StringIO()
+    output.write_frame(frame, 'csv', out=out)
+    assert out.getvalue() == "name,age\r\nAnn,6\r\nBob,10\r\n"
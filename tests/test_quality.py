@@ -0,0 +1,82 @@
+# coding=utf-8
+import pandas as pd
+import pytest
+
+import quality
+
+COLUMNS = ['section', 'member_id', 'first_name', 'last_name', 'age', 'yp',
+           'senior_duplicate', 'floating.gender',
+           'contact_primary_1.address1', 'contact_primary_1.phone1',
+           'contact_primary_member.address1', 'contact_primary_member.phone1']
+
+
+@pytest.fixture
+def broken(table_group):
+    def broken(rows, group_class=table_group):
+        v = quality.violations(group_class(pd.DataFrame(rows, columns=COLUMNS)))
+        assert list(v.columns) == quality.COLUMNS
+        return list(zip(v['first_name'], v['rule'], v['message']))
+    return broken
+
+
+GOOD_YP = ('Beavers', 1, 'Ann', 'A', 7, True, False, 'f', '1 Road', '0123', '', '')
+GOOD_SUBS = ('Subs', 1, 'Ann', 'A', 7, True, False, 'f', '', '', '', '')
+GOOD_ADULT = ('Adult', 2, 'Bob', 'B', 40, False, False, 'male', '', '',
+              '2 Road', '0456')
+
+
+def test_no_violations(broken):
+    assert broken([GOOD_YP, GOOD_SUBS, GOOD_ADULT]) == []
+
+
+def test_yp_rules_in_table_then_rule_order(broken):
+    cat = ('Beavers', 3, 'Cat', 'C', 12, True, False, 'x', '', '', '', '')
+    dan = ('Beavers', 4, 'Dan', 'D', 6, True, False, 'M', ' ', '0789', '', '')
+    assert broken([cat, dan, GOOD_YP, GOOD_SUBS]) == [
+        ('Cat', 'gender', "Sex (x) not in 'M', 'F', 'Male', 'Female'"),
+        ('Cat', 'primary_address', "Primary Address missing"),
+        ('Cat', 'primary_phone', "No telephone number in primary contact 1 or 2"),
+        ('Cat', 'age', "Age (12) is out of range (6 - 8)"),
+        ('Cat', 'not_in_subs', "Not in Subs Section"),
+        ('Dan', 'primary_address', "Primary Address missing"),
+        ('Dan', 'not_in_subs', "Not in Subs Section")]
+
+
+def test_adult_rules(broken):
+    eve = ('Adult', 5, 'Eve', 'E', 40, False, False, 'f', '', '', '', '')
+    assert broken([eve]) == [
+        ('Eve', 'member_address', "Member Address missing"),
+        ('Eve', 'member_phone', "No telephone number for member.")]
+
+
+def test_subs_member_not_in_a_yp_section(broken):
+    subs = GOOD_SUBS[:1] + (6,) + GOOD_SUBS[2:]
+    assert broken([GOOD_YP, GOOD_SUBS, subs]) == [
+        ('Ann', 'not_in_yp_section', "Not in any YP section.")]
+
+
+def test_subs_records_that_are_not_yp_count_as_in_subs(broken):
+    # e.g. an older sibling's record kept in Subs.
+    subs = GOOD_SUBS[:5] + (False,) + GOOD_SUBS[6:]
+    assert broken([GOOD_YP, subs]) == []
+
+
+def test_senior_duplicates_are_not_in_a_yp_section(broken):
+    yp = GOOD_YP[:6] + (True,) + GOOD_YP[7:]
+    assert [_[1] for _ in broken([yp, GOOD_SUBS])] == ['not_in_yp_section']
+
+
+def test_only_yp_and_adults_are_checked(broken):
+    leader = ('Beavers', 7, 'Fay', 'F', 30, False, False, '', '', '', '', '')
+    assert broken([GOOD_YP, GOOD_SUBS, leader]) == []
+
+
+def test_group_without_subs(broken, table_group):
+    class NoSubs(table_group):
+        SUBS_SECTION = None
+
+    assert broken([GOOD_YP], NoSubs) == []
+
+
+def test_empty_table(broken):
+    assert broken([]) == []
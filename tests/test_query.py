@@ -0,0 +1,107 @@
+# coding=utf-8
+import pandas as pd
+import pytest
+
+import query
+
+
+@pytest.fixture
+def table():
+    return pd.DataFrame({
+        'first_name': ['Ann', 'Bob', 'Cat', 'Dan', 'Eve'],
+        'section': ['Paget', 'Maclean', 'Rowallan', 'Boswell', 'Adult'],
+        'age': [6, 9, 10, 12, 40],
+        'gender': ['f', 'm', 'F ', 'm', 'f'],
+        'yl': [False, False, False, True, False],
+        'note': ['', 'two words', 'x', None, 'y'],
+    })
+
+
+def names(table, expression, aliases=None):
+    return list(query.run_query(table, expression, aliases=aliases)['first_name'])
+
+
+def test_and_binds_tighter_than_or(table):
+    # a or (b and c), not (a or b) and c.
+    assert names(table, "age < 7 or age > 9 and gender = m") == ['Ann', 'Dan']
+    assert names(table, "(age < 7 or age > 9) and gender = m") == ['Dan']
+
+
+def test_not_binds_tighter_than_and(table):
+    assert names(table, "not yl and age > 9") == ['Cat', 'Eve']
+    assert names(table, "not (yl and age > 9)") == ['Ann', 'Bob', 'Cat', 'Eve']
+
+
+def test_comparisons(table):
+    assert names(table, "age = 10") == ['Cat']
+    assert names(table, "age == 10") == ['Cat']
+    assert names(table, "age != 10") == ['Ann', 'Bob', 'Dan', 'Eve']
+    assert names(table, "age <= 9") == ['Ann', 'Bob']
+    assert names(table, "age >= 12") == ['Dan', 'Eve']
+
+
+def test_text_is_case_and_space_insensitive(table):
+    assert names(table, "gender = F") == ['Ann', 'Cat', 'Eve']
+
+
+def test_bare_column_is_boolean(table):
+    assert names(table, "yl") == ['Dan']
+
+
+def test_in_and_not_in(table):
+    assert names(table, "section in Paget, adult") == ['Ann', 'Eve']
+    assert names(table, "section in (paget, adult)") == ['Ann', 'Eve']
+    assert names(table, "section not in (paget, adult)") == ['Bob', 'Cat', 'Dan']
+
+
+def test_in_expands_aliases(table):
+    aliases = {'section': {'Cubs': ['Maclean', 'Rowallan'],
+                           'scouts': ['Boswell']}}
+    assert names(table, "section in cubs", aliases) == ['Bob', 'Cat']
+    assert names(table, "section in (CUBS, Paget)", aliases) == ['Ann', 'Bob', 'Cat']
+    assert names(table, "section not in (cubs, scouts)", aliases) == ['Ann', 'Eve']
+
+
+def test_aliases_only_apply_to_their_column(table):
+    aliases = {'section': {'cubs': ['Maclean', 'Rowallan']}}
+    assert names(table, "first_name in cubs", aliases) == []
+
+
+def test_quoted_strings(table):
+    assert names(table, "note = 'two words'") == ['Bob']
+    assert names(table, 'note = "two words"') == ['Bob']
+    assert names(table, "note = ''") == ['Ann', 'Dan']
+    assert names(table, "section in ('Paget', \"Boswell\")") == ['Ann', 'Dan']
+
+
+def test_empty_expression_matches_everything(table):
+    assert len(query.run_query(table, '')) == len(table)
+    assert len(query.run_query(table, None)) == len(table)
+
+
+def test_fields_are_projected(table):
+    result = query.run_query(table, "age > 10", fields=['section', 'age'])
+    assert list(result.columns) == ['section', 'age']
+    assert list(result['section']) == ['Boswell', 'Adult']
+
+
+@pytest.mark.parametrize('expression', [
+    "age >",
+    "age > 1 and",
+    "(age > 1",
+    "age > 1)",
+    "section in (a, b",
+    "age > 1 age < 2",
+    "age > (",
+    "name ! x",
+])
+def test_parse_errors(table, expression):
+    with pytest.raises(query.QueryError):
+        query.run_query(table, expression)
+
+
+def test_unknown_fields(table):
+    with pytest.raises(query.QueryError):
+        query.run_query(table, "size > 1")
+    with pytest.raises(query.QueryError):
+        query.run_query(table, "age > 1", fields=['size'])
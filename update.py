@@ -111,6 +111,148 @@ GS_SOURCE_FIELD = 'Source'  # Field used to hold the source of a record.
 GS_LAST_UPDATE_FIELD = 'Last Updated'
 
 
+# Most rows that are written to the gs in a single batch.
+BATCH_ROWS = 200
+
+
+def _a1(row, col):
+    """Return the A1 label of the cell at row, col (both from 1)."""
+    label = ''
+    while col:
+        col, rem = divmod(col - 1, 26)
+        label = chr(ord('A') + rem) + label
+    return '{}{}'.format(label, row)
+
+
+class CellBatch(object):
+    """Cell writes to a worksheet that are sent together by flush().
+
+    The cells to be written are fetched with one range() call and
+    written with one update_cells() call for each BATCH_ROWS rows, in
+    place of an update_cell() call for each cell."""
+
+    def __init__(self, wks):
+        self._wks = wks
+        self._cells = {}
+
+    def __len__(self):
+        return len(self._cells)
+
+    def set(self, row, col, value):
+        self._cells[(row, col)] = value
+
+    def flush(self):
+        if not self._cells:
+            return
+
+        rows = sorted(set(row for row, col in self._cells))
+        batches = 0
+        for start in range(0, len(rows), BATCH_ROWS):
+            first, last = rows[start], rows[start:start + BATCH_ROWS][-1]
+            cols = [col for row, col in self._cells if first <= row <= last]
+            cells = self._wks.range("{}:{}".format(
+                _a1(first, min(cols)), _a1(last, max(cols))))
+
+            changed = []
+            for cell in cells:
+                if (cell.row, cell.col) in self._cells:
+                    cell.value = self._cells[(cell.row, cell.col)]
+                    changed.append(cell)
+            self._wks.update_cells(changed)
+            batches += 1
+
+        log.info("Wrote {} cells in {} batches".format(
+            len(self._cells), batches))
+        self._cells = {}
+
+
+def _is_empty(values):
+    return all(value in ('', None) for value in values)
+
+
+class Snapshot(object):
+    """A worksheet read with one get_all_values() call.
+
+    references maps each reference in the column headed ref_heading to
+    its (first) row and columns maps each heading to its column, both
+    numbered from 1 as on the sheet. Writes made through set() are kept
+    in the grid as well as queued in a CellBatch, so one snapshot can be
+    diffed against by every section in a run."""
+
+    def __init__(self, wks, ref_heading):
+        self.wks = wks
+        self.grid = [list(values) for values in wks.get_all_values()]
+        self.row_count = max(wks.row_count, len(self.grid))
+        self.headings = self.row_values(HEADER_ROW)
+        self.columns = {}
+        for col, heading in enumerate(self.headings, 1):
+            self.columns.setdefault(heading, col)
+        self._ref_col = self.columns[ref_heading]
+        self.references = {}
+        for row in range(HEADER_ROW + 1, len(self.grid) + 1):
+            self._index(row)
+        self._batch = CellBatch(wks)
+
+    def _index(self, row):
+        reference = self.value(row, self._ref_col)
+        if reference not in ('', None):
+            self.references.setdefault(reference, row)
+
+    def all_references(self):
+        """Return the references on the sheet in row order, with repeats."""
+        return [self.value(row, self._ref_col)
+                for row in range(HEADER_ROW + 1, len(self.grid) + 1)
+                if self.value(row, self._ref_col) not in ('', None)]
+
+    def value(self, row, col):
+        try:
+            return self.grid[row - 1][col - 1]
+        except IndexError:
+            return ''
+
+    def row_values(self, row):
+        """Return the values in row, without the empty cells at the end."""
+        values = list(self.grid[row - 1]) if row <= len(self.grid) else []
+        while values and values[-1] in ('', None):
+            values.pop()
+        return values
+
+    def set(self, row, col, value):
+        while len(self.grid) < row:
+            self.grid.append([])
+        values = self.grid[row - 1]
+        if len(values) < col:
+            values.extend([''] * (col - len(values)))
+        old, values[col - 1] = values[col - 1], value
+        self._batch.set(row, col, value)
+
+        if col == self._ref_col and old != value:
+            if self.references.get(old) == row:
+                del self.references[old]
+                for later in range(row + 1, len(self.grid) + 1):
+                    if self.value(later, self._ref_col) == old:
+                        self.references[old] = later
+                        break
+            self._index(row)
+
+    def empty_row(self):
+        """Return the first row with no content in it or any row below it,
+        or False if the last row has content."""
+        empty_row = False
+        for row in range(self.row_count, 0, -1):
+            if row <= len(self.grid) and not _is_empty(self.grid[row - 1]):
+                break
+            empty_row = row
+        return empty_row
+
+    def add_rows(self, rows):
+        self.wks.add_rows(rows)
+        self.row_count += rows
+
+    def flush(self):
+        self._batch.flush()
+
+
 def format_date(field):
     """GS assumes all dates are in US format. So we have to
     guess whether a field looks like a date and reverse the format.
@@ -143,36 +285,33 @@ def format_date(field):
 #         return find_ref_in_sections(reference, section_list[1:])
 
 
-def process_section(name, section_members, spread, mapping, target_wks=YP_WKS):
-    wks = spread.worksheet(target_wks)
+def process_section(name, section_members, spread, mapping, target_wks=YP_WKS,
+                    snapshot=None):
+    """Update the rows of section_members in target_wks, adding rows for
+    members that are not there yet.
 
-    members = section_members
+    The sheet is compared against snapshot, which is read from the
+    worksheet if not given."""
+    if snapshot is None:
+        snapshot = Snapshot(spread.worksheet(target_wks),
+                            mapping[OSM_REF_FIELD])
 
-    # connect to spreadsheet
-    headings = wks.row_values(HEADER_ROW)
-
-    # Fetch the list of references that are already in the gs
-    references = wks.col_values(
-        1 + headings.index(mapping[OSM_REF_FIELD]))[1 + TOP_OFFSET:]
+    members = section_members
+    columns = snapshot.columns
 
-    def update_source(reference, row=None):
+    def update_source(row):
         """Update the source field in GS to record which section was the
         source the last update.
 
         """
+        snapshot.set(row, columns[GS_SOURCE_FIELD], name)
+        snapshot.set(row, columns[GS_LAST_UPDATE_FIELD],
+                     datetime.datetime.today().strftime('%m/%d/%Y'))
 
-        if row is None:
-            row = 2 + TOP_OFFSET + references.index(reference)
-
-        wks.update_cell(row, 1 + headings.index(GS_SOURCE_FIELD), name)
-        wks.update_cell(row, 1 + headings.index(GS_LAST_UPDATE_FIELD),
-                        datetime.datetime.today().strftime('%m/%d/%Y'))
-
-    def update_record(osm_values, reference, member):
+    def update_record(row, reference, member):
         updated = False
         for osm_field, gs_field in mapping.items():
-            gs_value = osm_values[
-                references.index(reference)][headings.index(gs_field)]
+            gs_value = snapshot.value(row, columns[gs_field])
             osm_value = member[osm_field]
             # if osm_value == '':
             # osm_value = None # gs returns None for '' so this make the
@@ -182,81 +321,64 @@ def process_section(name, section_members, spread, mapping, target_wks=YP_WKS):
                          "gs value ({!r})[{}] != osm value "
                          "({!r}) setting to ({})  gs: {!r}\n".format(
                              name, reference, osm_field, gs_field,
-                             format_date(gs_value), headings.index(gs_field),
+                             format_date(gs_value), columns[gs_field] - 1,
                              format_date(osm_value), format_date(osm_value),
-                             osm_values[references.index(reference)]))
-                wks.update_cell(
-                    2 + TOP_OFFSET +
-                    references.index(reference), 1 +
-                    headings.index(gs_field),
-                    format_date(osm_value))
+                             snapshot.row_values(row)))
+                snapshot.set(row, columns[gs_field], format_date(osm_value))
                 updated = True
 
         if updated:
             log.debug("Updated member information OSM record = \n {}".format(
                 str(member)))
             log.debug("Updated member information GS record = \n {}".format(
-                pprint.pformat(
-                    osm_values[references.index(reference)])))
+                pprint.pformat(snapshot.row_values(row))))
 
             # If any of the field have been updated we want to change the
             # Source column to note where from and when.
-            update_source(reference)
-
-    updated_members = []
-    updated_references = []
+            update_source(row)
 
     # Update any records that are in both the gs and osm.
-    osm_values = wks.get_all_values()[TOP_OFFSET + 1:]
+    new_members = []
     for member in members:
-        if member[OSM_REF_FIELD] in references:
-            update_record(osm_values, member[OSM_REF_FIELD], member)
-            updated_members.append(member)
-            updated_references.append(member[OSM_REF_FIELD])
-
-    new_members = [
-        member for member in members if member not in updated_members]
-
-    # new_members now contains only new records and
-    # deleted_references contains only deleted records
+        row = snapshot.references.get(member[OSM_REF_FIELD])
+        if row is None:
+            new_members.append(member)
+        else:
+            update_record(row, member[OSM_REF_FIELD], member)
 
     # append new records
     # find first empty row where there are no rows below it that have
     # any content
     if len(new_members) > 0:
-        empty_row = False
-        for row in range(1, wks.row_count + 1):
-            is_empty = (
-                len([cell for cell in wks.row_values(row)
-                     if cell is not None]) == 0)
-            if is_empty and empty_row is False:
-                empty_row = row
-            elif not is_empty and empty_row is not False:
-                empty_row = False
+        empty_row = snapshot.empty_row()
 
         # If there are not enough spare row in spreadsheet add extra rows
         start_row = empty_row
         if empty_row is False:
-            start_row = wks.row_count + 1
-            wks.add_rows(len(members))
-        elif (wks.row_count - empty_row) < len(new_members):
-            wks.add_rows(len(members) - (wks.row_count - empty_row))
+            start_row = snapshot.row_count + 1
+            snapshot.add_rows(len(members))
+        elif (snapshot.row_count - empty_row) < len(new_members):
+            snapshot.add_rows(
+                len(members) - (snapshot.row_count - empty_row))
 
         # Insert the new records
         row = start_row
         for member in new_members:
             for osm_field, gs_field in mapping.items():
-                wks.update_cell(row, 1 + headings.index(gs_field),
-                                format_date(member[osm_field]))
+                snapshot.set(row, columns[gs_field],
+                             format_date(member[osm_field]))
 
-            update_source(member[OSM_REF_FIELD], row=row)
+            update_source(row)
 
             row += 1
 
+    snapshot.flush()
+
 
-def delete_members(spread, references, wks=YP_WKS):
-    wks = spread.worksheet(wks)
-    headings = wks.row_values(HEADER_ROW)
+def delete_members(spread, references, wks=YP_WKS, snapshot=None):
+    if snapshot is None:
+        snapshot = Snapshot(spread.worksheet(wks), MAPPING[OSM_REF_FIELD])
+    wks = snapshot.wks
 
     # Handle deleted records.
     # These are moved to a special 'Deleted' worksheet
@@ -264,18 +386,18 @@ def delete_members(spread, references, wks=YP_WKS):
         del_wks = spread.worksheet('Deleted')
     except gspread.WorksheetNotFound:
         del_wks = spread.add_worksheet('Deleted', 1, wks.col_count)
-        header = wks.row_values(HEADER_ROW)
+        header = snapshot.headings
+        header_batch = CellBatch(del_wks)
         for col in range(1, len(header) + 1):
-            del_wks.update_cell(TOP_OFFSET, col, header[col - 1])
+            header_batch.set(TOP_OFFSET, col, header[col - 1])
+        header_batch.flush()
 
-    def move_row(reference, from_wks, to_wks):
-        # find reference in from_wks
-        current_references = from_wks.col_values(
-            1 + headings.index(MAPPING[OSM_REF_FIELD]))[1 + TOP_OFFSET:]
-        from_row = current_references.index(reference) + 1 + TOP_OFFSET + 1
+    def move_row(reference, to_wks):
+        # find reference in the snapshot
+        from_row = snapshot.references[reference]
 
         # add row to to_wks
-        from_row_values = from_wks.row_values(from_row)
+        from_row_values = snapshot.row_values(from_row)
 
         # Tidy up the nasty habbit of gs putting 'None' as a string
         values = []
@@ -286,14 +408,16 @@ def delete_members(spread, references, wks=YP_WKS):
 
         to_wks.append_row(values)
 
-        # remove row from from_wks
+        # remove row from the sheet
         for col in range(1, len(from_row_values) + 1):
-            from_wks.update_cell(from_row, col, '')
+            snapshot.set(from_row, col, '')
 
     log.info("Going to delete {!r}\n".format(references))
 
     for reference in references:
-        move_row(reference, wks, del_wks)
+        move_row(reference, del_wks)
+
+    snapshot.flush()
 
 
 def process_adults(group, spread):
@@ -302,8 +426,13 @@ def process_adults(group, spread):
     # Process Adults ##################
     adult_members = group.all_adult_members()
 
+    # The Leaders wks is read once and used for both the update and the
+    # delete.
+    snapshot = Snapshot(spread.worksheet(ADULT_WKS),
+                        ADULT_MAPPING[OSM_REF_FIELD])
+
     process_section('Adult', adult_members, spread,
-                    ADULT_MAPPING, target_wks=ADULT_WKS)
+                    ADULT_MAPPING, target_wks=ADULT_WKS, snapshot=snapshot)
 
     # Warn about missing references
     missing_ref_names = ["{} {}".format(member['firstname'],
@@ -315,22 +444,15 @@ def process_adults(group, spread):
             "\n\t".join(missing_ref_names)))
 
     # Get list of all reference is OSM
-    adult_osm_references = group.all_adult_references()
-
-    # get list of references on Leader wks
-    wks = spread.worksheet(ADULT_WKS)
-    headings = wks.row_values(HEADER_ROW)
-    gs_references = wks.col_values(
-        1 + headings.index(ADULT_MAPPING[OSM_REF_FIELD]))[TOP_OFFSET + 1:]
+    adult_osm_references = set(group.all_adult_references())
 
     log.info("Deleting old leaders...")
     # remove references that appear on Leaders wks but not in any
     # section
     delete_members(spread,
-                   [reference for reference in gs_references
-                    if (reference not in adult_osm_references) and
-                    reference is not None],
-                   wks=ADULT_WKS)
+                   [reference for reference in snapshot.all_references()
+                    if reference not in adult_osm_references],
+                   wks=ADULT_WKS, snapshot=snapshot)
 
 
 def process_yp(group, spread):
@@ -355,8 +477,9 @@ def process_yp(group, spread):
 
     log.info("Check adults in YP sections...")
     # check that all leaders are copied into the Adult section.
+    adult_references = set(group.all_adult_references())
     for leader in all_yp_section_leaders:
-        if leader[OSM_REF_FIELD] not in group.all_adult_references():
+        if leader[OSM_REF_FIELD] not in adult_references:
             log.warn("Leader {} is in {!r} section "
                      "but not in the Adult section.".format(
                          leader[OSM_REF_FIELD],
@@ -370,31 +493,30 @@ def process_yp(group, spread):
     log.info("Remove duplicate records at that are in senior sections ...")
     all_yp_members = group.all_yp_members_without_senior_duplicates_dict()
 
+    # The Master wks is read once and every section is compared against
+    # it, so members added by one section are seen by the next.
+    snapshot = Snapshot(spread.worksheet(YP_WKS), MAPPING[OSM_REF_FIELD])
+
     # Process the remaining members
     for name, section_members in all_yp_members.items():
         log.info("Processing section {}".format(name))
-        process_section(name, section_members, spread, MAPPING)
+        process_section(name, section_members, spread, MAPPING,
+                        snapshot=snapshot)
 
     log.info("Removing old members...")
     # remove deleted members
     # get list of all references from sections
-    all_references = []
+    all_references = set()
     for name, section_members in all_yp_members.items():
-        all_references.extend([member[OSM_REF_FIELD]
-                               for member in section_members])
-
-    # get list of references on Master wks
-    wks = spread.worksheet(YP_WKS)
-    headings = wks.row_values(HEADER_ROW)
-    gs_references = wks.col_values(
-        1 + headings.index(MAPPING[OSM_REF_FIELD]))[1 + TOP_OFFSET:]
+        all_references.update(member[OSM_REF_FIELD]
+                              for member in section_members)
 
     # remove references that appear on Master wks but not in any
     # section
     delete_members(spread,
-                   [reference for reference in gs_references
-                    if (reference not in all_references) and
-                    reference is not None])
+                   [reference for reference in snapshot.all_references()
+                    if reference not in all_references],
+                   snapshot=snapshot)
 
 
 def _main(osm, gc, auth):
@@ -3,6 +3,7 @@
 
 Usage:
   weekly_report.py [-d | --debug] [-n | --no_email] [--email=<email>] [-w | --web]
+                   [-f | --force] [--state=<file>]
                    [--quarter=<quarter>] [--term=<term>] <apiid> <token> <section>...
   weekly_report.py (-h | --help)
   weekly_report.py --version
@@ -14,29 +15,42 @@ Options:
   -n,--no_email  Do not send email.
   -w,--web       Serve report on local web server.
   --email=<email> Send to only this email address.
+  -f,--force     Send reports even if nothing in them has changed.
+  --state=<file> Where the hashes of the last reports sent are kept
+                 [default: weekly_report.state].
   --quarter=<quarter> Which quarter to use [default: current].
   --term=<term>  Which OSM term to use [default: current].
   -h,--help      Show this screen.
   --version      Show version.
 
+A hash of everything a report is made from is kept in the --state file
+for each report that is sent. When a report's hash is unchanged on the
+next run it is neither rendered nor sent. Reports are always rendered
+when they are forced (--force), printed (-n), sent to a single address
+(--email) or served (-w); then no hashes are made and the state file is
+neither read nor updated.
 """
 
-from collections import OrderedDict
+from collections import Counter, OrderedDict
 import datetime
+import hashlib
+import json
 import logging
-import smtplib
+import os.path
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
 import osm
+import dashboard
+import quality
+import reporter
+from mailer import Mailer
 from docopt import docopt
 from group import Group
 from group import OSM_REF_FIELD
 
-MIN_AGE = Group.MIN_AGE
-MAX_AGE = Group.MAX_AGE
-
 # import compass
 
 FROM = "Richard Taylor <r.taylor@bcs.org.uk>"
@@ -56,82 +70,78 @@ TO = {'Group': ['hippysurfer@gmail.com',
 
 DEF_CACHE = "osm.cache"
 DEF_CREDS = "osm.creds"
+DEF_STATE = "weekly_report.state"
 
 log = logging.getLogger(__name__)
 
 
-class Reporter(object):
-    STYLE = "\n".join(["hr {color:sienna;}",
-                       "h1 {border-bottom-style:solid; border-color:red;}",
-                       "p {margin-left:20px;}",
-                       "table {border-collapse:collapse;}",
-                       "table, th, td {border: 1px solid black;}"
-                       ])
-
-    def __init__(self):
-        self.t = ""
+class Reporter(reporter.Reporter):
 
     def send(self, to, subject,
-             fro=FROM):
+             fro=FROM, mailer=None):
+        """Queue the report for each address in to on mailer, or send it
+        on a new Mailer if none is given."""
+        if mailer is None:
+            with Mailer() as mailer:
+                return self.send(to, subject, fro, mailer)
+
+        body = self.email_report()
         for dest in to:
             msg = MIMEMultipart('alternative')
             msg['Subject'] = subject
             msg['From'] = fro
             msg['To'] = dest
 
-            body = MIMEText(self.t, 'html')
+            msg.attach(MIMEText(body, 'html'))
 
-            msg.attach(body)
+            mailer.send(msg)
 
-            # hostname = 'www.thegrindstone.me.uk' \
-            #           if not socket.gethostname() == 'rat' \
-            #           else 'localhost'
-            hostname = 'localhost'
 
-            s = smtplib.SMTP(hostname)
-            s.sendmail(fro, dest, msg.as_string())
-            s.quit()
+class Context(object):
+    """Everything the section report elements need from the group.
 
-    def report(self):
-        return "<html><head><style>{}</style></head>" \
-               "<body>\n{}\n</body></html>".format(self.STYLE, self.t)
+    It is built once per run, before any report is rendered, and is
+    only read from then on so that the reports can be rendered in
+    parallel."""
 
-    def title(self, title):
-        self.t += '<h1 style="border-bottom-style:solid; border-color:red;"' \
-                  '>{}</h1>\n'.format(title)
+    def __init__(self, group):
+        self.group = group
 
-    def sub_title(self, sub_title):
-        self.t += "<h2>{}</h2>\n".format(sub_title)
+        self.subs_ids = set(
+            str(member[OSM_REF_FIELD]) for member in
+            group.section_all_members(group.SUBS_SECTION)) \
+            if group.SUBS_SECTION else set()
+        self.yp_ids = set(
+            str(member[OSM_REF_FIELD]) for member in
+            group.all_yp_members_without_senior_duplicates())
 
-    def p(self, line):
-        self.t += '<p style="margin-left:20px;">{}</p>\n'.format(line)
+        # The members each section's report is about.
+        self.members = {
+            section: list(group.section_yp_members_without_leaders(section)
+                          if section != group.ADULT_SECTION else
+                          group.section_all_members(section))
+            for section in group.SECTIONIDS.keys()}
 
-    def t_start(self, headings):
-        self.t += '<table style="border-collapse:collapse;">'
-        self.t += '<tr style="border: 1px solid black; padding: 10px;">'
-        self.t += "".join(['<th style="border: 1px solid black;'
-                           'padding: 10px;">{}</th>'.format(cell) for cell
-                           in headings])
-        self.t += "</tr>\n"
+        # The classification columns of the member table, by
+        # (section, member id).
+        table = group.member_table()
+        self.classes = table.set_index(
+            ['section', table[OSM_REF_FIELD].astype(str)])[
+            ['age', 'yp', 'yl', 'leader', 'scout_helper',
+             'senior_duplicate']] if len(table) else None
+        self._ages = self.classes['age'].to_dict() \
+            if self.classes is not None else {}
 
-    def t_row(self, cells):
-        self.t += '<tr style="border: 1px solid black; padding: 10px;">'
-        self.t += "".join(['<td style="border: 1px solid black;'
-                           'padding: 10px;">{}</td>'.format(cell) for cell
-                           in cells])
-        self.t += "</tr>\n"
+        # Every rule broken by every member (see quality.py).
+        self.violations = quality.violations(group)
 
-    def t_end(self):
-        self.t += "</table>\n"
-
-    def ul(self, lines):
-        self.t += "<ul>\n"
-        self.t += "\n".join(["<li>{}</li>".format(line) for line in lines])
-        self.t += "</ul>\n"
+    def age(self, section, member):
+        """Return the age of member in whole years."""
+        return self._ages[(section, str(member[OSM_REF_FIELD]))]
 
 
 # noinspection PyUnusedLocal
-def intro(r, group, section):
+def intro(r, context, section):
     r.title("Section report for {}".format(section))
 
     r.p("This is an automatic report of the OSM data for '{}'. "
@@ -146,65 +156,17 @@ def intro(r, group, section):
         "identified problems.")
 
 
-def check_bad_data(r, group, section):
-
-    subs_members_ids = [member[OSM_REF_FIELD] for member in
-                        group.section_all_members(group.SUBS_SECTION)]
-    all_yp_members_without_senior_duplicates = group.all_yp_members_without_senior_duplicates()
-
-    members = group.section_yp_members_without_leaders(section) if \
-        section != 'Adult' else group.section_all_members(section)
-
-    reports = []
-    for member in members:
-        report = []
-
-        if member['floating.gender'].lower() not in ['m', 'f', 'male', 'female']:
-            report.append("Sex ({}) not in 'M', 'F', 'Male', 'Female'".format(
-                member['floating.gender']))
-
-        if section in group.YP_SECTIONS:
-            if member['contact_primary_1.address1'].strip() == '':
-                report.append("Primary Address missing")
-
-            if (member['contact_primary_1.phone1'].strip() == '' and
-                    member['contact_primary_1.phone2'].strip() == '' and
-                    member['contact_primary_2.phone1'].strip() == '' and
-                    member['contact_primary_2.phone2'].strip() == ''):
-                report.append("No telephone number in primary contact 1 or 2")
-
-            if (int(member.age().days / 365) < MIN_AGE[section] or
-                    int(member.age().days / 365) > MAX_AGE[section]):
-                report.append("Age ({}) is out of range ({} - {})".format(
-                    int(member.age().days / 365),
-                    MIN_AGE[section], MAX_AGE[section]))
-
-            if member[OSM_REF_FIELD] not in subs_members_ids:
-                report.append("Not in Subs Section")
-
-        elif section == group.SUBS_SECTION:
-            if member not in all_yp_members_without_senior_duplicates:
-                report.append("Not in any YP section.")
-
-        else:
+def check_bad_data(r, context, section):
+    broken = context.violations[context.violations['section'] == section]
 
-            if member['contact_primary_member.address1'].strip() == '':
-                report.append("Member Address missing")
-
-            if (member['contact_primary_member.phone1'].strip() == '' and
-                    member['contact_primary_member.phone2'].strip() == ''):
-                report.append("No telephone number for member.")
-
-        if report:
-            reports.append((member, report))
-
-    if reports:
+    if len(broken):
         r.sub_title("Records with bad or missing data.")
 
-        for report in reports:
-            r.p("{} {}:".format(report[0]['first_name'],
-                                report[0]['last_name']))
-            r.ul(report[1])
+        for _, member in broken.groupby(
+                OSM_REF_FIELD, sort=False)['message']:
+            first = broken.loc[member.index[0]]
+            r.p("{} {}:".format(first['first_name'], first['last_name']))
+            r.ul(list(member))
 
 # def section_compass_check(r, group, section):
 #     """Check the content of Compass for discrepancies with OSM
@@ -331,9 +293,10 @@ def census(r, group):
 
     r.sub_title('Census')
 
-    for i in ['Swinfen', 'Paget', 'Garrick',
-              'Maclean', 'Rowallan', 'Somers',
-              'Boswell', 'Johnson', 'Erasmus']:
+    section_types = list(group.CENSUS_AGES.keys())
+
+    for i in [section for section_type in section_types
+              for section in group.SECTIONS_BY_TYPE.get(section_type, [])]:
         r.t_start(['Section', 'Sex'] +
                   ["age - {} yrs".format(str(age))
                    for age in sorted(census_[i]['M'].keys())] +
@@ -351,7 +314,7 @@ def census(r, group):
         r.p("Total {} = {}".format(i, sum(male_counts) + sum(female_counts) + sum(other_counts)))
         r.p("")
 
-    for i in ['Beavers', 'Cubs', 'Scouts']:
+    for i in [_.capitalize() for _ in section_types]:
         r.t_start(['Section', 'Sex'] +
                   ["age - {} yrs".format(str(age))
                    for age in sorted(census_[i]['M'].keys())] +
@@ -370,15 +333,15 @@ def census(r, group):
         r.p("")
 
     total_male = 0
-    for i in ['Beavers', 'Cubs', 'Scouts']:
+    for i in [_.capitalize() for _ in section_types]:
         total_male += sum(census_[i]['M'].values())
 
     total_female = 0
-    for i in ['Beavers', 'Cubs', 'Scouts']:
+    for i in [_.capitalize() for _ in section_types]:
         total_female += sum(census_[i]['F'].values())
 
     total_other = 0
-    for i in ['Beavers', 'Cubs', 'Scouts']:
+    for i in [_.capitalize() for _ in section_types]:
         total_other += sum(census_[i]['O'].values())
 
     r.p("Total Male YP = {}".format(total_male))
@@ -406,7 +369,27 @@ elements = OrderedDict((
     ('Adult', COMMON)))
 
 
-def group_report(r, group, quarter, term):
+def section_elements(section):
+    """Return the report elements for a section."""
+    return elements.get(section, COMMON + NOT_ADULT)
+
+
+def report_sections(group):
+    """Return the names of the sections that get their own report.
+
+    These are the sections of elements, in that order, that the group
+    has. A group with none of them (e.g. one defined in district.conf)
+    gets a report for every section but Subs."""
+    sections = [section for section in elements.keys()
+                if section in group.SECTIONIDS]
+    return sections or [section for section in group.SECTIONIDS.keys()
+                        if section != group.SUBS_SECTION]
+
+
+def group_report(r, group, quarter, term, context=None, workers=4):
+    if context is None:
+        context = Context(group)
+
     r.title("Group Report (Quarter: {} Term: {})".format(quarter, term))
 
     census(r, group)
@@ -461,81 +444,148 @@ def group_report(r, group, quarter, term):
 
     # Get a list of all YL in all of the YP sections
     yls = group.all_yl_members()
-    # Create a list of their names.
-    refs = ["{} {}".format(_['first_name'], _['last_name']) for _ in yls]
+    # Count how many times each of their names appears.
+    refs = Counter("{} {}".format(_['first_name'], _['last_name']) for _ in yls)
     # Get a list of any that appear more than once.
-    duplicates = set(["{} {}".format(_['first_name'], _['last_name']) for _ in yls
-                      if refs.count("{} {}".format(_['first_name'], _['last_name'])) > 1])
+    duplicates = set(name for name, count in refs.items() if count > 1)
     # Get the total number of duplications.
-    dup_count = sum(set([refs.count("{} {}".format(_['first_name'], _['last_name'])) for _ in yls
-                         if refs.count("{} {}".format(_['first_name'], _['last_name'])) > 1]))
+    dup_count = sum(set(refs[name] for name in duplicates))
 
     r.sub_title("Young Leaders that are in more than 1 Section")
 
     r.t_start(["Name", "Number of Sections"])
 
     for yl in duplicates:
-        r.t_row([yl, refs.count(yl)])
+        r.t_row([yl, refs[yl]])
 
     r.t_end()
 
     r.p("Total Young Leaders in Sections (duplicates removed) = {}".format(total_yl_members - dup_count))
 
-    r.sub_title("YP in Group Subs but not in any YP Section")
-
-    subs_members = group.section_all_members(group.SUBS_SECTION)
-
-    all_yp_members_without_senior_duplicates_ids = [member[OSM_REF_FIELD] for member in
-                                                    group.all_yp_members_without_senior_duplicates()]
-
-    for member in sorted(subs_members, key=lambda _: _['last_name']):
-        if member[OSM_REF_FIELD] not in all_yp_members_without_senior_duplicates_ids:
-            sections = group.find_ref_in_sections(member[OSM_REF_FIELD],
-                                                  exclude_sections=('Subs',))
-            member_in_yp_section = (
-                group.find_by_scoutid(str(member[OSM_REF_FIELD]), sections[0])[0]
-                if len(sections) > 0 else None)
-
-            r.p("{} {} ({}): {} {}".format(
-                member['first_name'],
-                member['last_name'],
-                member.age_in_years_and_months(),
-                ",".join(sections),
-                ("" if member_in_yp_section is None else
-                 ("(Young Leader)" if group.is_yl(member_in_yp_section) else (
-                     "(Scout helper)" if group.is_scout_helper(member_in_yp_section) else "")))
-            ))
-
-    r.sub_title("YP in a YP Section but not in Group Subs")
-
-    subs_members_ids = [member[OSM_REF_FIELD] for member in
-                        group.section_all_members(group.SUBS_SECTION)]
-    all_yp_members_without_senior_duplicates = group.all_yp_members_without_senior_duplicates()
-
-    for member in sorted(all_yp_members_without_senior_duplicates,
-                         key=lambda _: _['last_name']):
-        if member[OSM_REF_FIELD] not in subs_members_ids:
-            sections = group.find_ref_in_sections(member[OSM_REF_FIELD],
-                                                  exclude_sections=('Subs',))
-
-            r.p("{} {} ({}): {} {}".format(
-                member['first_name'],
-                member['last_name'],
-                member.age_in_years_and_months(),
-                ",".join(sections),
-                "(Young Leader)" if group.is_yl(member) else (
-                    "(Scout helper)" if group.is_scout_helper(member) else "")))
+    if group.SUBS_SECTION:
+        r.sub_title("YP in Group Subs but not in any YP Section")
+
+        subs_members = group.section_all_members(group.SUBS_SECTION)
+
+        for member in sorted(subs_members, key=lambda _: _['last_name']):
+            if str(member[OSM_REF_FIELD]) not in context.yp_ids:
+                sections = group.find_ref_in_sections(member[OSM_REF_FIELD],
+                                                      exclude_sections=(group.SUBS_SECTION,))
+                member_in_yp_section = (
+                    group.find_by_scoutid(str(member[OSM_REF_FIELD]), sections[0])[0]
+                    if len(sections) > 0 else None)
+
+                r.p("{} {} ({}): {} {}".format(
+                    member['first_name'],
+                    member['last_name'],
+                    member.age_in_years_and_months(),
+                    ",".join(sections),
+                    ("" if member_in_yp_section is None else
+                     ("(Young Leader)" if group.is_yl(member_in_yp_section) else (
+                         "(Scout helper)" if group.is_scout_helper(member_in_yp_section) else "")))
+                ))
+
+        r.sub_title("YP in a YP Section but not in Group Subs")
+
+        all_yp_members_without_senior_duplicates = group.all_yp_members_without_senior_duplicates()
+
+        for member in sorted(all_yp_members_without_senior_duplicates,
+                             key=lambda _: _['last_name']):
+            if str(member[OSM_REF_FIELD]) not in context.subs_ids:
+                sections = group.find_ref_in_sections(member[OSM_REF_FIELD],
+                                                      exclude_sections=(group.SUBS_SECTION,))
+
+                r.p("{} {} ({}): {} {}".format(
+                    member['first_name'],
+                    member['last_name'],
+                    member.age_in_years_and_months(),
+                    ",".join(sections),
+                    "(Young Leader)" if group.is_yl(member) else (
+                        "(Scout helper)" if group.is_scout_helper(member) else "")))
 
     # process_compass(r, group)
 
     # process_finance_spreadsheet(r, group, quarter)
 
-    for section in elements.keys():
-        for element in elements[section]:
-            element(r, group, section)
+    reports = render_sections(context, report_sections(group), workers)
+    for section in report_sections(group):
+        r.extend(reports[section])
+
+
+def render_section(context, section):
+    """Return a Reporter holding the report for one section."""
+    r = Reporter()
+    for element in section_elements(section):
+        element(r, context, section)
+    return r
+
 
+def render_sections(context, sections, workers=4):
+    """Render the reports for sections in parallel.
 
-def _main(osm_, auth_, sections, no_email, email, quarter, term, http):
+    Return a dict of section to Reporter."""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(sections, pool.map(
+            lambda section: render_section(context, section), sections)))
+
+
+# The member table columns shown (or counted) in the group report.
+GROUP_FIELDS = ['section', OSM_REF_FIELD, 'first_name', 'last_name', 'gender',
+                'age', 'yp', 'yl', 'leader', 'scout_helper',
+                'senior_duplicate']
+
+
+def section_digest(context, section):
+    """Return a hash of everything the report for section is made from."""
+    h = hashlib.sha1(" ".join(
+        element.__name__ for element in section_elements(section)).encode())
+    for member in context.members[section]:
+        ref = str(member[OSM_REF_FIELD])
+        h.update(json.dumps(member._record, sort_keys=True,
+                            default=str).encode())
+        h.update("{} {} {}".format(context.age(section, member),
+                                   ref in context.subs_ids,
+                                   ref in context.yp_ids).encode())
+    return h.hexdigest()
+
+
+def group_digest(context, quarter, term):
+    """Return a hash of everything the group report is made from: the
+    GROUP_FIELDS of the member table, the ages in years and months that
+    it lists and the section reports that it includes."""
+    group = context.group
+    h = hashlib.sha1("{} {}".format(quarter, term).encode())
+
+    table = group.member_table()
+    if len(table):
+        h.update(table[GROUP_FIELDS].to_csv(index=False).encode())
+
+    listed = list(group.all_yp_members_without_senior_duplicates())
+    if group.SUBS_SECTION:
+        listed.extend(group.section_all_members(group.SUBS_SECTION))
+    for member in listed:
+        h.update("{} {}".format(member[OSM_REF_FIELD],
+                                member.age_in_years_and_months()).encode())
+
+    for section in report_sections(group):
+        h.update(section_digest(context, section).encode())
+    return h.hexdigest()
+
+
+def load_state(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_state(path, state):
+    with open(path, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+
+
+def _main(osm_, auth_, sections, no_email, email, quarter, term, http,
+          force=False, state_file=DEF_STATE):
     if isinstance(sections, str):
         sections = [sections, ]
 
@@ -551,52 +601,65 @@ def _main(osm_, auth_, sections, no_email, email, quarter, term, http):
         assert section in list(group.SECTIONIDS.keys()) + ['Group', ], \
             "section must be in {!r}.".format(group.SECTIONIDS.keys())
 
-    for section in sections:
-        r = Reporter()
-
-        if section == 'Group':
-            group_report(r, group, quarter,
-                         term if term is not None else "Active")
-        else:
-            for element in elements[section]:
-                element(r, group, section)
-
-        if no_email:
-            print(r.report())
-        elif email:
-            print("Sending to {}".format(email))
-            r.send([email, ],
-                   'OSM Data Integrity Report for {}'.format(section))
-        else:
-            r.send(TO[section],
-                   'OSM Data Integrity Report for {}'.format(section))
-
-        if http:
-            print("Serving {}".format(section))
-            serve(r)
-
-
-def serve(report):
-    import http.server
-
-    # noinspection PyClassHasNoInit
-    class Handler(http.server.BaseHTTPRequestHandler):
-
-        def do_GET(self):
-            self.send_response(200)
-            self.send_header("Content-type", "text/html")
-            self.end_headers()
-            self.wfile.write(bytes(report.report(), 'UTF-8'))
-
-    server_address = ('', 8000)
-    httpd = http.server.HTTPServer(server_address, Handler)
-
+    term = term if term is not None else "Active"
+    context = Context(group)
+
+    # Only reports going to their usual recipients are skipped when
+    # unchanged.
+    gated = not (force or no_email or email or http)
+    if gated:
+        state = load_state(state_file)
+        digests = {section: (group_digest(context, quarter, term)
+                             if section == 'Group' else
+                             section_digest(context, section))
+                   for section in sections}
+        unchanged = [_ for _ in sections if state.get(_) == digests[_]]
+        for section in unchanged:
+            log.info("{} is unchanged - not sent".format(section))
+        sections = [_ for _ in sections if _ not in unchanged]
+
+    reports = render_sections(
+        context, [_ for _ in sections if _ != 'Group'])
+
+    subjects = {}
+    board = dashboard.Dashboard()
+    mailer = Mailer()
     try:
-        httpd.serve_forever()
-    except KeyboardInterrupt:
-        pass
-
-    httpd.server_close()
+        for section in sections:
+            if section == 'Group':
+                r = Reporter()
+                group_report(r, group, quarter, term, context)
+            else:
+                r = reports[section]
+
+            if no_email:
+                print(r.report())
+            elif email:
+                print("Sending to {}".format(email))
+                r.send([email, ],
+                       'OSM Data Integrity Report for {}'.format(section),
+                       mailer=mailer)
+            else:
+                subject = 'OSM Data Integrity Report for {}'.format(section)
+                subjects[subject] = section
+                r.send(TO[section], subject, mailer=mailer)
+
+            if http:
+                board.publish(section, r.report())
+    finally:
+        results = mailer.close()
+
+    if gated:
+        failed = set(subjects.get(_.subject) for _ in results
+                     if _.error is not None)
+        state.update((section, digests[section])
+                     for section in subjects.values()
+                     if section not in failed)
+        save_state(state_file, state)
+
+    if http:
+        print("Serving on http://localhost:{}/".format(dashboard.PORT))
+        dashboard.serve(board)
 
 
 def get_quarter():
@@ -644,4 +707,6 @@ if __name__ == '__main__':
           args['--email'],
           args['--quarter'],
           args['--term'],
-          args['--web'])
+          args['--web'],
+          args['--force'],
+          args['--state'])